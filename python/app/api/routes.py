@@ -1,21 +1,63 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from typing import List
+import asyncio
+import hmac
 import json
-import time
 import os
-from dotenv import load_dotenv
+import time
+from contextlib import asynccontextmanager
 from app.services.pdfExtraction import extract_pdf_text
 from app.services.webArticleExtraction import extract_web_article
-from app.services.youtubeTranscript import get_youtube_transcript
-from app.services.gemini import extract_unique_topics_with_text, make_study_guide, format_study_guide_as_markdown
+from app.services.youtubeTranscript import get_youtube_transcript, extract_video_id
+from app.services.extractionQueue import extractor
+from app.services.uploadIngestion import spool_uploads, remove_spool, UploadLimitError
+from app.services.cacheWarming import most_requested_sources, start_warming, warming_report, warming_sources
+from app.services.gemini import (
+    extract_unique_topics_with_text, extract_topics_of_sources, make_study_guide, make_quick_study_guide,
+    format_study_guide_as_markdown
+)
+from app.services.sourceIdentity import resolve_sources, source_id as identify_source, text_label, youtube_video_id
+from app.services.sourceStats import get_source_stats
+from app.services.usageLedger import BudgetExceededError, get_usage_ledger, tenant_budget
+from app.services.sourceStore import SourceStore
+from app.services.textNormalization import normalize_text, estimate_tokens
+from app.services.extractiveSummary import summarize_texts, TEXTRANK, METHODS as SUMMARY_METHODS
+from app.services.guideStore import new_guide_id, save_guide, load_guide, merge_topic_maps, diff_topics
+from app.services.profileStore import save_profile, list_profiles, profile_path
+from app.services.resultStore import save_result, load_result, read_result, result_etag
+from app.config import get_settings
 from app.utils.logger import setup_logger
+from app.utils.helpers import canonical_hash, normalize_url
+from app.utils.singleflight import SingleFlight
+from app.utils.shared_state import get_shared_state
+from app.utils import metrics
+from app.utils.deadline import Deadline, DeadlineExceeded, deadline_scope, current_deadline
+from app.utils.circuit_breaker import CircuitOpenError, breaker_stats
+from app.utils.profiler import SamplingProfiler
+from app.utils.memory import MemoryBudget, MemoryLimitExceeded, memory_scope, memory_stage, rss_bytes
+from app.utils.scheduler import INTERACTIVE, call_scope, get_call_executor, get_scheduler
+from app.utils.usage import Usage, current_usage, usage_scope
+from app.utils.work_queue import get_work_queue
+from app.utils.responses import FastJSONResponse, etag_matches, negotiate_encoding
+from app.services.modelRouter import get_router
 from app.models.schemas import PasswordRequest, PasswordResponse
 
-# Load environment variables
-load_dotenv()
-
 logger = setup_logger(__name__)
-router = APIRouter()
+router = APIRouter(default_response_class=FastJSONResponse)
+
+# Concurrent identical work is coalesced at three levels: the whole pipeline,
+# each source extraction and each Gemini call. Extraction and Gemini results
+# are also cached in the shared state so other workers can reuse them.
+# Gemini calls run on the scheduler's pool, where they may wait for a slot.
+_pipeline_flights = SingleFlight("pipeline")
+_extraction_flights = SingleFlight("extraction", cache_ttl=get_settings().extraction_cache_ttl)
+_llm_flights = SingleFlight("llm", cache_ttl=get_settings().llm_cache_ttl, executor=get_call_executor)
+
+# Serialize updates to the same stored guide: guide ID -> [lock, holders and waiters].
+# The holder also takes the guide's lock in the shared state, for other workers.
+_guide_locks = {}
+_GUIDE_LOCK_POLL_SECONDS = 0.2
 
 @router.get("/api/health")
 def health_check():
@@ -23,13 +65,126 @@ def health_check():
     logger.info("Health check requested")
     return {"status": "healthy"}
 
+@router.get("/api/metrics")
+def get_metrics():
+    """Return this worker's metrics, model routing, circuit breaker, call queue and work queue states."""
+    return {
+        **metrics.snapshot(),
+        "models": get_router().stats(),
+        "circuits": breaker_stats(),
+        "scheduler": get_scheduler().stats(),
+        "work_queue": get_work_queue().stats() if get_settings().extraction_queue else None
+    }
+
+@router.get("/api/admin/profiles")
+def get_profiles(request: Request):
+    """List the stored request profiles, newest first (admin only)."""
+    _require_admin(request)
+    return {"profiles": list_profiles()}
+
+@router.get("/api/admin/profiles/{profile_id}")
+def download_profile(request: Request, profile_id: str):
+    """
+    Download a request profile in collapsed-stack format (admin only).
+    
+    The file can be opened with speedscope or rendered with flamegraph.pl.
+    """
+    _require_admin(request)
+    try:
+        path = profile_path(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return FileResponse(path, media_type="text/plain", filename=path.name)
+
+@router.post("/api/admin/warm", status_code=202)
+async def warm_caches(
+    request: Request,
+    pdfs: List[UploadFile] = File(default=[]),
+    sources: str = Form(default="{}"),
+    top: int = Form(default=0),
+    api_key: str = Form(default=None)
+):
+    """
+    Start warming the extraction and topic caches for sources (admin only).
+    
+    The sources are extracted and their topic maps generated in the
+    background, at low priority, so the first requests for them are served
+    from the caches. Poll /api/admin/warm/{job_id} for the coverage and the
+    time saved.
+    
+    Args:
+        pdfs: PDF files to warm
+        sources: JSON string with the URLs and video links to warm
+        top: Also warm this many of the most requested sources (needs SOURCE_ACCESS_STATS)
+        api_key: Optional Gemini API key whose requests the topic maps are cached for
+    
+    Returns:
+        The warming job ID and the number of sources it warms
+    """
+    _require_admin(request)
+    request_id = f"{int(time.time() * 1000)}"
+    if top < 0:
+        raise HTTPException(status_code=400, detail="top must not be negative")
+    stats = get_source_stats()
+    if top and stats is None:
+        raise HTTPException(status_code=400, detail="top needs SOURCE_ACCESS_STATS to be enabled")
+    urls, videos, _ = _parse_sources(request_id, sources)
+    spool_dir, pdf_files = await _spool(request_id, pdfs)
+    try:
+        targets = warming_sources(resolve_sources(pdf_files, urls, videos, []))
+        if top:
+            known = {target["id"] for target in targets}
+            targets += [target for target in most_requested_sources(stats, top) if target["id"] not in known]
+        if not targets:
+            raise HTTPException(status_code=400, detail="No sources to warm")
+        job_id, task = start_warming(targets, api_key)
+    except BaseException:
+        _release_spool(spool_dir)
+        raise
+    if spool_dir is not None:
+        task.add_done_callback(lambda _: remove_spool(spool_dir))
+    logger.info(f"[Request {request_id}] Started warming job {job_id} for {len(targets)} sources")
+    return {"job_id": job_id, "sources": len(targets)}
+
+@router.get("/api/admin/warm/{job_id}")
+def get_warming_report(request: Request, job_id: str):
+    """Return the progress or final report of a cache warming job (admin only)."""
+    _require_admin(request)
+    report = warming_report(job_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Warming job not found: {job_id}")
+    return report
+
+@router.get("/api/admin/usage")
+def get_usage(request: Request, tenant: str = None):
+    """
+    Return each tenant's usage in the current budget window and its budget (admin only).
+    
+    Args:
+        tenant: Optional tenant ("key:<hash>" or "client:<address>") to report on alone
+    """
+    _require_admin(request)
+    ledger = get_usage_ledger()
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="Usage accounting is not enabled")
+    tenants = ledger.report(tenant)
+    for entry in tenants:
+        entry["budget"] = tenant_budget(entry["tenant"], shared_key=not entry["tenant"].startswith("key:"))
+    return {
+        "window_start": ledger.window_start(),
+        "window_seconds": ledger.window_seconds,
+        "tenants": tenants
+    }
+
 @router.post("/api/verify-password", response_model=PasswordResponse)
 def verify_password(request: PasswordRequest):
     """Verify the access password."""
     logger.info("Password verification requested")
     
-    # Get password from environment variable
-    correct_password = os.getenv("ACCESS_PASSWORD", "your_secure_password_here")
+    # Get password from the application settings
+    correct_password = get_settings().access_password
     
     if request.password == correct_password:
         logger.info("Password verification successful")
@@ -40,223 +195,1305 @@ def verify_password(request: PasswordRequest):
 
 @router.post("/api/get-output")
 async def get_output(
+    request: Request,
     pdfs: List[UploadFile] = File(default=[]),
     sources: str = Form(default="{}"),
-    api_key: str = Form(default=None)
+    api_key: str = Form(default=None),
+    deadline_seconds: float = Form(default=None),
+    token_budget: int = Form(default=None),
+    summarizer: str = Form(default=None)
 ):
     """
     Process multiple input sources (PDFs, URLs, videos, text) and generate a study guide.
     
+    Identical requests arriving while one is already being processed share its
+    result instead of repeating the extraction and Gemini calls. The per-source
+    topic maps are stored so the guide can later be updated incrementally.
+    
+    The request runs within a time budget. When it runs low, remaining
+    sources are skipped and a partial guide is returned with notes on what
+    was dropped. If the client disconnects, work no other request is waiting
+    for is cancelled.
+    
+    With a token budget, sources that together exceed it are compressed
+    locally by extractive summarization before they are sent to Gemini.
+    
+    The text the request holds is capped by REQUEST_MEMORY_LIMIT_MB: sources
+    that do not fit are truncated or skipped with a note. Requests are
+    refused with 503 while the worker is above WORKER_RSS_LIMIT_MB.
+    
+    With usage accounting on, the request, its Gemini calls and tokens are
+    added to its tenant's usage; a tenant whose budget is used up is
+    refused with 429 before extraction or before the Gemini stages start.
+    
+    Admins can profile the request with the "X-Profile: 1" header or the
+    "profile=1" query parameter together with "X-Admin-Token"; the response
+    then includes the "profile_id" to download from /api/admin/profiles.
+    
     Args:
         pdfs: List of PDF files to extract text from
         sources: JSON string containing URLs, video links, and text inputs
         api_key: Optional Gemini API key provided by the user
+        deadline_seconds: Optional time budget overriding REQUEST_DEADLINE_SECONDS
+        token_budget: Optional input token budget overriding SUMMARY_TOKEN_BUDGET (0 disables it)
+        summarizer: Sentence scoring used for compression, "textrank" (default) or "tfidf"
     
     Returns:
-        Study guide markdown as a string
+        Study guide markdown, the stored guide ID, the IDs of its sources,
+        notes on anything dropped and, for a complete guide, the result ID
+        to download it again from /api/results
     """
     start_time = time.time()
     request_id = f"{int(start_time * 1000)}"  # Simple request ID based on timestamp
     
     logger.info(f"[Request {request_id}] Starting get_output request")
+    spool_dir = None
+    pipeline_key = None
+    usage = budget = None
+    deadline = _request_deadline(request_id, deadline_seconds)
+    compression = _summary_options(token_budget, summarizer)
+    _check_worker_memory(request_id)
+    profiler = _start_profiler(request, request_id)
     
     try:
-        # Parse sources JSON
+        urls, videos, text_inputs = _parse_sources(request_id, sources)
+
+        # Stream uploads to disk, hashing and enforcing size limits as we go
+        spool_dir, pdf_files = await _spool(request_id, pdfs)
+
+        # Identify every source and drop duplicates before anything is fetched
+        resolved = resolve_sources(pdf_files, urls, videos, text_inputs)
+        pdf_files, urls, videos, text_inputs = resolved["pdfs"], resolved["urls"], resolved["videos"], resolved["text"]
+        await _record_access(request_id, resolved)
+
+        # The canonical identity of this request, for coalescing
+        key_hash = canonical_hash(api_key.strip()) if api_key and api_key.strip() else ""
+        pipeline_key = canonical_hash({
+            "sources": resolved["ids"],
+            "unresolved": resolved["unresolved"],
+            "api_key": key_hash,
+            "compression": compression,
+        })
+        tenant = _tenant(request, key_hash)
+        usage = await _admit_usage(request_id, tenant, key_hash)
+
+        with deadline_scope(deadline), memory_scope(_memory_budget()) as budget, call_scope(INTERACTIVE, tenant), \
+                usage_scope(usage):
+            result = await _until_disconnected(
+                request, request_id, "get_output",
+                _pipeline_flights.do(
+                    pipeline_key,
+                    _metered, _generate_guide_content,
+                    request_id, pdf_files, urls, videos, text_inputs, api_key, key_hash, compression
+                )
+            )
+        result, run_usage = result
+        # Every caller of a coalesced run is charged for it and gets a guide record of its own
+        if usage is not None:
+            usage.add_usage(run_usage)
+        result = _save_new_guide(result)
+
+        # Log completion
+        end_time = time.time()
+        duration = end_time - start_time
+        logger.info(f"[Request {request_id}] Request completed successfully in {duration:.2f} seconds")
+        logger.info(f"[Request {request_id}] Final output length: {len(result['study_guide'])} characters")
+
+        result = await _store_result(request_id, pipeline_key, result)
+        response = _with_duplicate_notes(result, resolved["duplicates"])
+        if profiler is not None:
+            response = {**response, "profile_id": request_id}
+        return response
+    
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except MemoryLimitExceeded as e:
+        logger.error(f"[Request {request_id}] {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        # Catch any unexpected errors
+        end_time = time.time()
+        duration = end_time - start_time
+        logger.error(f"[Request {request_id}] Unexpected error after {duration:.2f} seconds: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred while processing your request: {str(e)}"
+        )
+    finally:
+        _finish_profiler(request_id, profiler, "get_output")
+        _release_spool(spool_dir, _pipeline_flights, pipeline_key)
+        await _record_usage(request_id, usage, budget)
+
+
+@router.get("/api/results/{result_id}")
+async def get_result(request: Request, result_id: str):
+    """
+    Download a generated study guide as markdown.
+    
+    The response carries a strong ETag; a request whose If-None-Match
+    matches it is answered with 304 Not Modified. The body is sent brotli or
+    gzip encoded when the client accepts it.
+    
+    Args:
+        result_id: ID returned with the guide by /api/get-output
+    """
+    try:
+        record = await asyncio.to_thread(load_result, result_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Result not found: {result_id}")
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), list(record["encodings"]))
+    headers = {
+        "ETag": result_etag(record, encoding),
+        # A result ID always serves the same guide
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+    }
+    etags = [result_etag(record)] + [result_etag(record, coding) for coding in record["encodings"]]
+    if etag_matches(request.headers.get("if-none-match"), etags):
+        metrics.increment("result_downloads_total", outcome="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    try:
+        body = await asyncio.to_thread(read_result, result_id, encoding)
+    except FileNotFoundError:
+        # Expired and removed since its record was read
+        raise HTTPException(status_code=404, detail=f"Result not found: {result_id}")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    metrics.increment("result_downloads_total", outcome="ok", encoding=encoding or "identity")
+    return Response(body, media_type="text/markdown; charset=utf-8", headers=headers)
+
+
+@router.post("/api/guides/{guide_id}/update")
+async def update_guide(
+    request: Request,
+    guide_id: str,
+    pdfs: List[UploadFile] = File(default=[]),
+    sources: str = Form(default="{}"),
+    removed: str = Form(default="[]"),
+    api_key: str = Form(default=None),
+    deadline_seconds: float = Form(default=None)
+):
+    """
+    Add and remove sources of a previously generated study guide.
+    
+    Only the added sources are extracted and sent for topic extraction; the
+    stored topic maps of the remaining sources are reused, and only topics
+    whose merged content changed are regenerated.
+    
+    Args:
+        guide_id: ID returned when the guide was generated
+        pdfs: PDF files to add
+        sources: JSON string with URLs, video links and text inputs to add
+        removed: JSON list of source IDs (or the original URLs) to remove
+        api_key: Optional Gemini API key provided by the user
+        deadline_seconds: Optional time budget overriding REQUEST_DEADLINE_SECONDS
+    
+    Returns:
+        Updated study guide markdown, the guide ID, the IDs of its sources and
+        notes on anything dropped
+    """
+    start_time = time.time()
+    request_id = f"{int(start_time * 1000)}"
+    
+    logger.info(f"[Request {request_id}] Starting update of guide {guide_id}")
+    spool_dir = None
+    usage = budget = None
+    deadline = _request_deadline(request_id, deadline_seconds)
+    _check_worker_memory(request_id)
+    
+    try:
+        urls, videos, text_inputs = _parse_sources(request_id, sources)
         try:
-            other_sources = json.loads(sources)
-            logger.debug(f"[Request {request_id}] Parsed sources JSON successfully")
-        except json.JSONDecodeError as e:
-            logger.error(f"[Request {request_id}] Failed to parse sources JSON: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Invalid JSON in sources parameter: {str(e)}")
-
-        urls = other_sources.get("urls", [])
-        videos = other_sources.get("videos", [])
-        text_inputs = other_sources.get("text", [])
-
-        # Log input summary
-        num_pdfs = len(pdfs)
-        num_urls = len(urls)
-        num_videos = len(videos)
-        num_texts = len(text_inputs)
-        logger.info(f"[Request {request_id}] Processing {num_pdfs} PDFs, {num_urls} URLs, {num_videos} videos, {num_texts} text inputs")
-
-        combined_output = []
-        successful_sources = 0
-        failed_sources = 0
-
-        # ============================
-        # 1. 📄 Extract PDF content
-        # ============================
-        logger.info(f"[Request {request_id}] Starting PDF extraction ({num_pdfs} files)")
-        pdf_results = []
-        for idx, pdf in enumerate(pdfs, 1):
-            try:
-                logger.info(f"[Request {request_id}] Processing PDF {idx}/{num_pdfs}: {pdf.filename}")
-                content = await extract_pdf_text(pdf)
-                pdf_results.append({
-                    "filename": pdf.filename,
-                    "content": content
-                })
-                combined_output.append(content)
-                successful_sources += 1
-                logger.info(f"[Request {request_id}] Successfully processed PDF: {pdf.filename}")
-            except Exception as e:
-                failed_sources += 1
-                error_msg = str(e)
-                logger.error(f"[Request {request_id}] Failed to process PDF {pdf.filename}: {error_msg}")
-                pdf_results.append({
-                    "filename": pdf.filename,
-                    "error": error_msg
-                })
-
-
-        # ============================
-        # 2. 🌐 Extract URL article content
-        # ============================
-        logger.info(f"[Request {request_id}] Starting URL extraction ({num_urls} URLs)")
-        url_results = []
-        for idx, url in enumerate(urls, 1):
-            try:
-                logger.info(f"[Request {request_id}] Processing URL {idx}/{num_urls}: {url}")
-                article = extract_web_article(url)
-                url_results.append(article)
-                combined_output.append(article["text"])
-                successful_sources += 1
-                logger.info(f"[Request {request_id}] Successfully processed URL: {url}")
-            except Exception as e:
-                failed_sources += 1
-                error_msg = str(e)
-                logger.error(f"[Request {request_id}] Failed to process URL {url}: {error_msg}")
-                url_results.append({"url": url, "error": error_msg})
-
-
-        # ============================
-        # 3. ▶️ Extract YouTube transcripts
-        # ============================
-        logger.info(f"[Request {request_id}] Starting video transcript extraction ({num_videos} videos)")
-        video_results = []
-        for idx, url in enumerate(videos, 1):
-            try:
-                logger.info(f"[Request {request_id}] Processing video {idx}/{num_videos}: {url}")
-                transcript = get_youtube_transcript(url)
-                video_results.append({"url": url, "transcript": transcript})
-                combined_output.append(transcript)
-                successful_sources += 1
-                logger.info(f"[Request {request_id}] Successfully processed video: {url}")
-            except Exception as e:
-                failed_sources += 1
-                error_msg = str(e)
-                logger.error(f"[Request {request_id}] Failed to process video {url}: {error_msg}")
-                video_results.append({"url": url, "error": error_msg})
-
-
-        # ============================
-        # 4. 📝 Raw text input
-        # ============================
-        logger.info(f"[Request {request_id}] Processing text inputs ({num_texts} entries)")
-        text_results = []
-        for idx, t in enumerate(text_inputs, 1):
-            try:
-                if t and isinstance(t, str) and len(t.strip()) > 0:
-                    text_results.append(t)
-                    combined_output.append(t)
-                    successful_sources += 1
-                    logger.debug(f"[Request {request_id}] Added text input {idx}/{num_texts}")
-                else:
-                    logger.warning(f"[Request {request_id}] Skipping empty or invalid text input {idx}/{num_texts}")
-            except Exception as e:
-                failed_sources += 1
-                logger.error(f"[Request {request_id}] Error processing text input {idx}: {str(e)}")
-
-        # Log extraction summary
-        total_sources = successful_sources + failed_sources
-        logger.info(f"[Request {request_id}] Source extraction complete: {successful_sources}/{total_sources} successful, {failed_sources} failed")
-
-        # Check if we have any content to process
-        if not combined_output:
-            logger.error(f"[Request {request_id}] No content extracted from any sources")
-            raise HTTPException(
-                status_code=400, 
-                detail="No content could be extracted from the provided sources. Please check your inputs and try again."
+            removed_sources = json.loads(removed)
+            if not isinstance(removed_sources, list):
+                raise ValueError("removed must be a JSON list")
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"[Request {request_id}] Failed to parse removed sources: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid JSON in removed parameter: {str(e)}")
+
+        spool_dir, pdf_files = await _spool(request_id, pdfs)
+        resolved = resolve_sources(pdf_files, urls, videos, text_inputs)
+        pdf_files, urls, videos, text_inputs = resolved["pdfs"], resolved["urls"], resolved["videos"], resolved["text"]
+        await _record_access(request_id, resolved)
+        key_hash = canonical_hash(api_key.strip()) if api_key and api_key.strip() else ""
+        tenant = _tenant(request, key_hash)
+        usage = await _admit_usage(request_id, tenant, key_hash)
+
+        with deadline_scope(deadline), memory_scope(_memory_budget()) as budget, call_scope(INTERACTIVE, tenant), \
+                usage_scope(usage):
+            record, markdown, notes = await _until_disconnected(
+                request, request_id, "update_guide",
+                _apply_guide_update(
+                    request_id, guide_id, removed_sources, pdf_files, urls, videos, text_inputs, api_key, key_hash
+                )
             )
 
-        # ============================
-        # 5. FINAL OUTPUT GENERATION
-        # ============================
-        logger.info(f"[Request {request_id}] Starting final study guide generation")
-        final_output_text = "\n\n".join(combined_output)
-        combined_length = len(final_output_text)
-        logger.info(f"[Request {request_id}] Combined content length: {combined_length} characters")
+        duration = time.time() - start_time
+        logger.info(f"[Request {request_id}] Guide {guide_id} updated successfully in {duration:.2f} seconds")
+        return _with_duplicate_notes({
+            "study_guide": markdown,
+            "guide_id": guide_id,
+            "sources": _describe_sources(record),
+            "notes": notes
+        }, resolved["duplicates"])
+
+    except HTTPException:
+        raise
+    except MemoryLimitExceeded as e:
+        logger.error(f"[Request {request_id}] {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        duration = time.time() - start_time
+        logger.error(f"[Request {request_id}] Unexpected error after {duration:.2f} seconds: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred while updating the study guide: {str(e)}"
+        )
+    finally:
+        _release_spool(spool_dir)
+        await _record_usage(request_id, usage, budget)
+
 
-        # Extract topics
+async def _apply_guide_update(request_id, guide_id, removed_sources, pdf_files, urls, videos, text_inputs,
+                              api_key, key_hash):
+    """
+    Apply an update to a stored guide while holding the guide's lock.
+    
+    Returns:
+        tuple: The saved guide record, its markdown and notes on dropped work
+    """
+    notes = []
+    async with _guide_lock(guide_id):
         try:
-            logger.info(f"[Request {request_id}] Extracting topics from combined content")
-            topics_data = extract_unique_topics_with_text(final_output_text, api_key=api_key)
-            logger.info(f"[Request {request_id}] Successfully extracted topics")
-        except Exception as e:
-            logger.error(f"[Request {request_id}] Failed to extract topics: {str(e)}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to extract topics from content: {str(e)}"
+            record = load_guide(guide_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+        # Drop removed sources
+        for value in removed_sources:
+            source_id = _resolve_source_id(value, record["sources"])
+            if source_id is None:
+                logger.warning(f"[Request {request_id}] Cannot remove unknown source: {value}")
+                continue
+            del record["sources"][source_id]
+            logger.info(f"[Request {request_id}] Removed source {source_id}")
+
+        # Extract and analyse only the added sources
+        with memory_stage(request_id, "extract"):
+            added = await _extract_sources(request_id, pdf_files, urls, videos, text_inputs, notes, skip_ids=record["sources"])
+        with memory_stage(request_id, "normalize"):
+            await _normalize_sources(request_id, added)
+        await _check_token_budget(request_id, added)
+        routing = []
+        with memory_stage(request_id, "topics"):
+            added_topics = await _extract_source_topics(request_id, added, api_key, key_hash, notes, routing)
+        added.discard_texts()
+        for document in added:
+            if document.id not in added_topics:
+                continue
+            record["sources"][document.id] = _source_entry(document, added_topics[document.id])
+
+        topics_data = merge_topic_maps({sid: src["topics"] for sid, src in record["sources"].items()})
+        if not topics_data:
+            logger.error(f"[Request {request_id}] Guide {guide_id} has no remaining content")
+            raise HTTPException(status_code=400, detail="The updated guide has no sources with content left.")
+
+        changed_topics = diff_topics(record["topics"], topics_data)
+        logger.info(f"[Request {request_id}] {len(added)} sources added, {len(changed_topics)}/{len(topics_data)} topics changed")
+
+        with memory_stage(request_id, "guide"):
+            guide = await _make_guide(
+                request_id, topics_data, api_key, key_hash,
+                previous_guide=record["study_guide"], changed_topics=changed_topics, routing=routing, notes=notes
             )
+        markdown = _format_guide(request_id, guide) + _format_notes(notes)
+
+        record["topics"] = _generated_topics(guide, topics_data)
+        record["study_guide"] = guide
+        save_guide(record)
+
+    return record, markdown, notes
+
+
+@asynccontextmanager
+async def _guide_lock(guide_id):
+    """
+    Hold the lock of a stored guide, across all workers.
+    
+    Updates in this worker queue on an asyncio.Lock, which is dropped once no
+    update holds or waits for it. Its holder then takes the guide's lock in
+    the shared state, waiting while an update in another worker holds it.
+    The shared lock expires after the longest request deadline, in case its
+    holder's worker dies.
+    
+    Raises:
+        HTTPException: 504 if the request's time budget runs out while waiting
+    """
+    entry = _guide_locks.get(guide_id)
+    if entry is None:
+        entry = _guide_locks[guide_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            state = get_shared_state()
+            lock_key = f"lock:guide:{guide_id}"
+            ttl = get_settings().max_request_deadline_seconds
+            while not state.add(lock_key, str(os.getpid()), ttl=ttl):
+                deadline = current_deadline()
+                if deadline is not None and deadline.expired():
+                    raise HTTPException(
+                        status_code=504,
+                        detail="Request time budget ran out while another update of this guide was running"
+                    )
+                await asyncio.sleep(_GUIDE_LOCK_POLL_SECONDS)
+            try:
+                yield
+            finally:
+                state.delete(lock_key)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _guide_locks[guide_id]
+
+
+async def _until_disconnected(request, request_id, endpoint, awaitable):
+    """
+    Await awaitable, cancelling it if the client disconnects first.
+    
+    Cancellation propagates through the SingleFlight groups: extraction and
+    Gemini work shared with other requests keeps running, the rest is
+    cancelled and its worker threads stop at their next check.
+    
+    Raises:
+        HTTPException: 499 if the client disconnected
+    """
+    task = asyncio.ensure_future(awaitable)
+    poll_interval = get_settings().disconnect_poll_seconds
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    logger.warning(f"[Request {request_id}] Client disconnected, cancelling its work")
+    metrics.increment("requests_cancelled_total", endpoint=endpoint)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    # Nobody will read this response; 499 is the conventional "client closed request" status
+    raise HTTPException(status_code=499, detail="Client closed request")
+
 
-        # Generate study guide
+def _summary_options(token_budget, summarizer):
+    """
+    Resolve the per-request compression settings.
+    
+    Returns:
+        dict: {"token_budget", "method"}, or None if compression is off
+    """
+    if token_budget is None:
+        token_budget = get_settings().summary_token_budget
+    if token_budget < 0:
+        raise HTTPException(status_code=400, detail="token_budget must not be negative")
+    method = summarizer or TEXTRANK
+    if method not in SUMMARY_METHODS:
+        raise HTTPException(status_code=400, detail=f"summarizer must be one of: {', '.join(SUMMARY_METHODS)}")
+    if not token_budget:
+        return None
+    return {"token_budget": token_budget, "method": method}
+
+
+def _require_admin(request):
+    """Reject the request unless it carries the configured admin token."""
+    token = get_settings().admin_token
+    provided = request.headers.get("x-admin-token", "")
+    if not token or not hmac.compare_digest(provided.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def _memory_budget():
+    """Create a request's MemoryBudget from the configured limit."""
+    settings = get_settings()
+    return MemoryBudget(settings.request_memory_limit_bytes, trace=settings.memory_tracemalloc)
+
+
+def _check_worker_memory(request_id):
+    """Turn new requests away while the worker's RSS is above WORKER_RSS_LIMIT_MB."""
+    limit = get_settings().worker_rss_limit_bytes
+    if not limit:
+        return
+    rss = rss_bytes()
+    if rss is not None and rss > limit:
+        metrics.increment("requests_rejected_memory_total")
+        logger.warning(f"[Request {request_id}] Rejected: worker RSS {rss / 1048576:.0f} MB is above {limit / 1048576:.0f} MB")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is low on memory, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+
+def _note_truncation(request_id, label, kept, length, notes):
+    """Describe in notes a source the memory limit cut to kept of its length characters."""
+    if kept >= length:
+        return
+    logger.warning(f"[Request {request_id}] Kept {kept}/{length} characters of {label} under the memory limit")
+    if kept:
+        notes.append(f"Truncated {label} to {kept} of {length} characters to stay within the request memory limit")
+    else:
+        notes.append(f"Dropped {label}: the request memory limit was reached")
+
+
+def _tenant(request, key_hash):
+    """Identify who Gemini calls are made for: the user's own API key, else the client address."""
+    if key_hash:
+        return f"key:{key_hash[:16]}"
+    return f"client:{request.client.host}" if request.client else "client:unknown"
+
+
+def _start_profiler(request, request_id):
+    """Start a sampling profiler if an admin asked for this request to be profiled."""
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    if not flag or flag.strip().lower() not in ("1", "true", "yes", "on"):
+        return None
+    _require_admin(request)
+    logger.info(f"[Request {request_id}] Profiling requested")
+    return SamplingProfiler(get_settings().profile_interval_seconds).start()
+
+
+def _finish_profiler(request_id, profiler, endpoint):
+    if profiler is None:
+        return
+    profiler.stop()
+    try:
+        save_profile(request_id, profiler, endpoint)
+    except OSError as e:
+        logger.error(f"[Request {request_id}] Failed to save profile: {str(e)}")
+
+
+def _request_deadline(request_id, deadline_seconds):
+    """Create the request's Deadline from the form value or the configured default."""
+    settings = get_settings()
+    seconds = settings.request_deadline_seconds
+    if deadline_seconds is not None:
+        if deadline_seconds <= 0:
+            raise HTTPException(status_code=400, detail="deadline_seconds must be positive")
+        seconds = min(deadline_seconds, settings.max_request_deadline_seconds)
+    logger.info(f"[Request {request_id}] Time budget: {seconds:.0f} seconds")
+    return Deadline(seconds)
+
+
+def _has_time_for(reserve_seconds):
+    """
+    Return True if the current request has more than reserve_seconds left.
+    
+    The reserve is capped at half the request's budget so short budgets still
+    leave room for extraction.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return True
+    return deadline.remaining() > min(reserve_seconds, deadline.budget / 2)
+
+
+def _service_unavailable(error):
+    """Map a CircuitOpenError to an HTTP 503 with a Retry-After header."""
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, round(error.retry_after)))}
+    )
+
+
+def _over_budget(error):
+    """Map a BudgetExceededError to an HTTP 429 with a Retry-After header."""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, round(error.retry_after)))}
+    )
+
+
+async def _metered(fn, *args):
+    """
+    Await fn(*args) under a Usage of its own.
+    
+    The Usage takes the tenant of the caller starting the run, whose budget
+    applies to it, but is charged by every caller sharing the run. A run
+    that fails is charged to the caller that started it.
+    
+    Returns:
+        tuple: The result of fn and the run's Usage
+    """
+    caller = current_usage()
+    run = Usage(caller.tenant, caller.shared_key) if caller is not None else Usage(None)
+    with usage_scope(run):
         try:
-            logger.info(f"[Request {request_id}] Generating study guide from topics")
-            guide = make_study_guide(topics_data, include_summary=True, include_key_points=True, api_key=api_key)
-            
-            if "error" in guide:
-                logger.error(f"[Request {request_id}] Study guide generation returned error: {guide['error']}")
-                raise HTTPException(status_code=500, detail=f"Failed to generate study guide: {guide['error']}")
-            
-            logger.info(f"[Request {request_id}] Successfully generated study guide")
-        except HTTPException:
+            return await fn(*args), run
+        except BaseException:
+            if caller is not None:
+                caller.add_usage(run)
             raise
+
+
+async def _admit_usage(request_id, tenant, key_hash):
+    """
+    Count a request in its tenant's usage and start accounting for it.
+    
+    Returns:
+        Usage: The request's usage record, or None if usage accounting is off
+    
+    Raises:
+        HTTPException: 429 if the tenant's budget is used up
+    """
+    ledger = get_usage_ledger()
+    if ledger is None:
+        return None
+    try:
+        await asyncio.to_thread(ledger.admit, tenant, tenant_budget(tenant, shared_key=not key_hash))
+    except BudgetExceededError as e:
+        metrics.increment("usage_budget_rejections_total", stage="admission")
+        logger.warning(f"[Request {request_id}] Rejected for {tenant}: {str(e)}")
+        raise _over_budget(e)
+    except Exception as e:
+        # An unavailable ledger must not take the service down with it
+        logger.warning(f"[Request {request_id}] Failed to check usage budget: {str(e)}")
+    return Usage(tenant, shared_key=not key_hash)
+
+
+async def _check_token_budget(request_id, store):
+    """
+    Refuse to start the Gemini stages for the sources in store if they would
+    overrun the current tenant's token budget.
+    """
+    usage = current_usage()
+    ledger = get_usage_ledger()
+    if usage is None or ledger is None or not store:
+        return
+    budget = tenant_budget(usage.tenant, usage.shared_key)
+    if budget is None or not budget["tokens"]:
+        return
+    try:
+        await asyncio.to_thread(ledger.check_tokens, usage.tenant, budget, usage.tokens + _input_tokens(store))
+    except BudgetExceededError as e:
+        metrics.increment("usage_budget_rejections_total", stage="generation")
+        logger.warning(f"[Request {request_id}] Not generating for {usage.tenant}: {str(e)}")
+        raise _over_budget(e)
+    except Exception as e:
+        logger.warning(f"[Request {request_id}] Failed to check token budget: {str(e)}")
+
+
+async def _record_usage(request_id, usage, budget):
+    """Add a finished request's Gemini calls, tokens and stage times to its tenant's usage."""
+    ledger = get_usage_ledger()
+    if usage is None or ledger is None:
+        return
+    if budget is not None:
+        usage.add_stages(budget.stages)
+    logger.info(
+        f"[Request {request_id}] Usage of {usage.tenant}: {usage.calls} Gemini calls ({usage.retries} retries), "
+        f"{usage.input_tokens} input and {usage.output_tokens} output tokens"
+    )
+    try:
+        await asyncio.to_thread(ledger.record, usage)
+    except Exception as e:
+        # Losing a request's usage is better than failing it
+        logger.warning(f"[Request {request_id}] Failed to record usage: {str(e)}")
+
+
+def _format_notes(notes):
+    """Render notes on dropped work as a markdown block appended to the guide."""
+    if not notes:
+        return ""
+    lines = "\n".join(f"> - {note}" for note in notes)
+    return f"\n> ⚠️ **Partial study guide:** not all of the sources could be covered.\n>\n{lines}\n"
+
+
+def _parse_sources(request_id, sources):
+    """Parse the sources JSON form field into (urls, videos, text_inputs)."""
+    try:
+        other_sources = json.loads(sources)
+        logger.debug(f"[Request {request_id}] Parsed sources JSON successfully")
+    except json.JSONDecodeError as e:
+        logger.error(f"[Request {request_id}] Failed to parse sources JSON: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in sources parameter: {str(e)}")
+
+    return other_sources.get("urls", []), other_sources.get("videos", []), other_sources.get("text", [])
+
+
+async def _spool(request_id, pdfs):
+    """Spool uploaded PDFs to disk, mapping limit violations to HTTP 413."""
+    try:
+        return await spool_uploads(pdfs, request_id)
+    except UploadLimitError as e:
+        logger.error(f"[Request {request_id}] Upload rejected: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def _release_spool(spool_dir, flights=None, key=None):
+    """Remove a spool directory once any shared pipeline using it has finished."""
+    if spool_dir is None:
+        return
+    task = flights.pending(key) if flights is not None and key else None
+    if task is not None and not task.done():
+        task.add_done_callback(lambda _: remove_spool(spool_dir))
+    else:
+        remove_spool(spool_dir)
+
+
+async def _store_result(request_id, inputs_key, result):
+    """
+    Store a complete guide in the result store and add its result ID to result.
+    
+    Partial guides are not stored: a later request with the same inputs may
+    complete them. Failing to store a guide does not fail the request.
+    """
+    if result["notes"]:
+        return result
+    try:
+        record = await asyncio.to_thread(save_result, inputs_key, result["study_guide"], result["sources"])
+    except OSError as e:
+        logger.error(f"[Request {request_id}] Failed to store result: {str(e)}")
+        return result
+    return {**result, "result_id": record["result_id"]}
+
+
+async def _record_access(request_id, resolved):
+    """Count the request's web articles and videos in the access stats, if they are enabled."""
+    stats = get_source_stats()
+    if stats is None:
+        return
+    try:
+        await asyncio.to_thread(stats.record, resolved["urls"], resolved["videos"])
+    except Exception as e:
+        # Losing a count is better than failing the request
+        logger.warning(f"[Request {request_id}] Failed to record source access: {str(e)}")
+
+
+def _with_duplicate_notes(result, duplicates):
+    """Add a note for each duplicate source that was ignored to a response."""
+    if not duplicates:
+        return result
+    notes = [f"Ignored duplicate source: {label}" for label in duplicates]
+    return {**result, "notes": notes + result["notes"]}
+
+
+def _resolve_source_id(value, known_sources):
+    """Map a source ID or an original URL to the ID of a stored source."""
+    if not isinstance(value, str):
+        return None
+    # Guides saved before URLs were canonicalized keep their normalize_url() IDs
+    candidates = [value.strip(), identify_source("url", value), f"url:{normalize_url(value)}"]
+    video_id = youtube_video_id(value) or extract_video_id(value)
+    if video_id:
+        candidates.append(f"video:{video_id}")
+    for candidate in candidates:
+        if candidate in known_sources:
+            return candidate
+    return None
+
+
+def _describe_sources(record):
+    described = []
+    for sid, src in record["sources"].items():
+        entry = {"id": sid, "kind": src["kind"], "label": src["label"]}
+        if "tokens" in src:
+            entry["tokens"] = src["tokens"]
+        described.append(entry)
+    return described
+
+
+def _source_entry(document, topics):
+    """Build the stored record of one source: its topic map, token counts and page map."""
+    entry = {"kind": document.kind, "label": document.label, "topics": topics}
+    if document.tokens:
+        entry["tokens"] = document.tokens
+    if document.page_map:
+        entry["page_map"] = document.page_map
+    return entry
+
+
+async def generate_study_guide(request_id, pdf_files, urls, videos, text_inputs, api_key, key_hash, compression=None):
+    """
+    Run the extraction and generation pipeline for one set of inputs and
+    store the guide. Used by the batch CLI (app/batch.py), which passes
+    sources resolved by resolve_sources().
+    
+    Returns:
+        dict: Study guide markdown, the stored guide ID, its sources and notes
+    
+    Raises:
+        HTTPException: If no content could be extracted, the token budget is
+            used up or generation failed
+    """
+    result = await _generate_guide_content(request_id, pdf_files, urls, videos, text_inputs, api_key, key_hash, compression)
+    return _save_new_guide(result)
+
+
+def _save_new_guide(result):
+    """
+    Store generated guide content as a new guide record of the caller's own.
+    
+    Requests coalesced on one pipeline run share its content but each gets
+    its own guide ID, so updating one request's guide leaves the others as
+    they were.
+    
+    Args:
+        result: Result of _generate_guide_content(), which is not modified
+    
+    Returns:
+        dict: Study guide markdown, the stored guide ID, its sources and notes
+    """
+    record = {**result["record"], "guide_id": new_guide_id()}
+    save_guide(record)
+    return {
+        "study_guide": result["study_guide"],
+        "guide_id": record["guide_id"],
+        "sources": _describe_sources(record),
+        "notes": result["notes"]
+    }
+
+
+async def _generate_guide_content(request_id, pdf_files, urls, videos, text_inputs, api_key, key_hash, compression=None):
+    """
+    Run the extraction and generation pipeline for one set of inputs.
+    
+    Each source extraction and Gemini call is coalesced with identical work
+    already in flight from other requests. Nothing is stored: callers keep
+    the result with _save_new_guide().
+    
+    The memory held by each stage is measured against the current
+    MemoryBudget, if any, and the Gemini stages only start if the sources
+    fit the token budget of the current Usage's tenant, if any.
+    
+    Returns:
+        dict: Study guide markdown ("study_guide"), the guide record without
+        its ID ("record": per-source topic maps, topics and guide) and notes
+    
+    Raises:
+        HTTPException: If no content could be extracted, the token budget is
+            used up or generation failed
+    """
+    notes = []
+    with memory_stage(request_id, "extract"):
+        store = await _extract_sources(request_id, pdf_files, urls, videos, text_inputs, notes)
+    with memory_stage(request_id, "normalize"):
+        await _normalize_sources(request_id, store)
+    if compression:
+        with memory_stage(request_id, "compress"):
+            await _compress_sources(request_id, store, **compression)
+
+    # Check if we have any content to process
+    if not store:
+        logger.error(f"[Request {request_id}] No content extracted from any sources")
+        if notes:
+            raise HTTPException(status_code=504, detail=f"Request time budget ran out before any source was extracted: {'; '.join(notes)}")
+        raise HTTPException(
+            status_code=400, 
+            detail="No content could be extracted from the provided sources. Please check your inputs and try again."
+        )
+
+    await _check_token_budget(request_id, store)
+
+    # ============================
+    # 5. FINAL OUTPUT GENERATION
+    # ============================
+    logger.info(f"[Request {request_id}] Starting final study guide generation")
+    logger.info(f"[Request {request_id}] Combined content length: {store.total_chars()} characters")
+
+    routing = []
+    quick = None
+    if _fits_single_call(store):
+        with memory_stage(request_id, "guide"):
+            quick = await _make_quick_guide(request_id, store, api_key, key_hash)
+    if quick is not None:
+        source_topics, guide = quick
+        store.discard_texts()
+        topics_data = merge_topic_maps(source_topics)
+    else:
+        with memory_stage(request_id, "topics"):
+            source_topics = await _extract_source_topics(request_id, store, api_key, key_hash, notes, routing)
+        # Only the topic maps are needed from here on
+        store.discard_texts()
+        topics_data = merge_topic_maps(source_topics)
+
+        with memory_stage(request_id, "guide"):
+            guide = await _make_guide(request_id, topics_data, api_key, key_hash, routing=routing, notes=notes)
+    final_output_text = _format_guide(request_id, guide) + _format_notes(notes)
+
+    # Per-source topic maps are kept for incremental updates
+    record = {
+        "sources": {
+            document.id: _source_entry(document, source_topics[document.id])
+            for document in store
+            if document.id in source_topics
+        },
+        "topics": _generated_topics(guide, topics_data),
+        "study_guide": guide
+    }
+
+    return {"study_guide": final_output_text, "record": record, "notes": notes}
+
+
+async def _extract_sources(request_id, pdf_files, urls, videos, text_inputs, notes, skip_ids=()):
+    """
+    Extract text from every source, skipping sources already in skip_ids.
+    
+    Sources are skipped once the request's remaining time falls below the
+    reserve kept for the Gemini stages; each skipped or timed-out source is
+    described in notes. Extracted text is charged to the current
+    MemoryBudget and truncated to what fits under its ceiling. With
+    EXTRACTION_QUEUE set, PDFs, URLs and videos are extracted by the
+    extraction workers (see extractionQueue).
+    
+    Returns:
+        SourceStore: The extracted source documents
+    """
+    # Log input summary
+    num_pdfs = len(pdf_files)
+    num_urls = len(urls)
+    num_videos = len(videos)
+    num_texts = len(text_inputs)
+    logger.info(f"[Request {request_id}] Processing {num_pdfs} PDFs, {num_urls} URLs, {num_videos} videos, {num_texts} text inputs")
+
+    store = SourceStore()
+    seen_ids = set(skip_ids)
+    successful_sources = 0
+    failed_sources = 0
+
+    reserve = get_settings().deadline_generation_reserve_seconds
+
+    def is_new(source_id, label):
+        if source_id in seen_ids:
+            logger.info(f"[Request {request_id}] Skipping source already present: {label}")
+            return False
+        seen_ids.add(source_id)
+        return True
+
+    def has_time(label):
+        if _has_time_for(reserve):
+            return True
+        logger.warning(f"[Request {request_id}] Skipping {label}: not enough time left in the request budget")
+        notes.append(f"Skipped {label}: not enough time left to extract it")
+        return False
+
+    def record_failure(label, error):
+        if isinstance(error, DeadlineExceeded):
+            notes.append(f"Dropped {label}: the time budget ran out while extracting it")
+
+    def add(source_id, kind, label, text):
+        nonlocal successful_sources
+        if text:
+            document = store.add(source_id, kind, label, text)
+            _note_truncation(request_id, label, len(document.text) if document else 0, len(text), notes)
+        successful_sources += 1
+
+    # ============================
+    # 1. 📄 Extract PDF content
+    # ============================
+    logger.info(f"[Request {request_id}] Starting PDF extraction ({num_pdfs} files)")
+    for idx, pdf in enumerate(pdf_files, 1):
+        source_id = identify_source("pdf", pdf)
+        if not is_new(source_id, pdf["filename"]) or not has_time(pdf["filename"]):
+            continue
+        try:
+            logger.info(f"[Request {request_id}] Processing PDF {idx}/{num_pdfs}: {pdf['filename']}")
+            content = await _extraction_flights.do(source_id, extractor("pdf", extract_pdf_text), pdf["path"])
+            add(source_id, "pdf", pdf["filename"], content)
+            logger.info(f"[Request {request_id}] Successfully processed PDF: {pdf['filename']}")
         except Exception as e:
-            logger.error(f"[Request {request_id}] Failed to generate study guide: {str(e)}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to generate study guide: {str(e)}"
-            )
+            failed_sources += 1
+            error_msg = str(e)
+            logger.error(f"[Request {request_id}] Failed to process PDF {pdf['filename']}: {error_msg}")
+            record_failure(pdf["filename"], e)
+
 
-        # Format as markdown
+    # ============================
+    # 2. 🌐 Extract URL article content
+    # ============================
+    logger.info(f"[Request {request_id}] Starting URL extraction ({num_urls} URLs)")
+    for idx, url in enumerate(urls, 1):
+        source_id = identify_source("url", url)
+        if not is_new(source_id, url) or not has_time(url):
+            continue
         try:
-            logger.info(f"[Request {request_id}] Formatting study guide as markdown")
-            final_output_text = format_study_guide_as_markdown(guide)
-            
-            if final_output_text.startswith("# Error"):
-                logger.error(f"[Request {request_id}] Markdown formatting returned error")
-                raise HTTPException(status_code=500, detail="Failed to format study guide as markdown")
-            
-            logger.info(f"[Request {request_id}] Successfully formatted study guide as markdown")
-        except HTTPException:
-            raise
+            logger.info(f"[Request {request_id}] Processing URL {idx}/{num_urls}: {url}")
+            article = await _extraction_flights.do(source_id, extractor("url", extract_web_article), url)
+            add(source_id, "url", url, article["text"])
+            logger.info(f"[Request {request_id}] Successfully processed URL: {url}")
+        except Exception as e:
+            failed_sources += 1
+            error_msg = str(e)
+            logger.error(f"[Request {request_id}] Failed to process URL {url}: {error_msg}")
+            record_failure(url, e)
+
+
+    # ============================
+    # 3. ▶️ Extract YouTube transcripts
+    # ============================
+    logger.info(f"[Request {request_id}] Starting video transcript extraction ({num_videos} videos)")
+    for idx, url in enumerate(videos, 1):
+        source_id = identify_source("video", url)
+        if not is_new(source_id, url) or not has_time(url):
+            continue
+        try:
+            logger.info(f"[Request {request_id}] Processing video {idx}/{num_videos}: {url}")
+            transcript = await _extraction_flights.do(source_id, extractor("video", get_youtube_transcript), url)
+            add(source_id, "video", url, transcript)
+            logger.info(f"[Request {request_id}] Successfully processed video: {url}")
+        except Exception as e:
+            failed_sources += 1
+            error_msg = str(e)
+            logger.error(f"[Request {request_id}] Failed to process video {url}: {error_msg}")
+            record_failure(url, e)
+
+
+    # ============================
+    # 4. 📝 Raw text input
+    # ============================
+    logger.info(f"[Request {request_id}] Processing text inputs ({num_texts} entries)")
+    for idx, t in enumerate(text_inputs, 1):
+        try:
+            if t and isinstance(t, str) and len(t.strip()) > 0:
+                source_id = identify_source("text", t)
+                if not is_new(source_id, f"text input {idx}"):
+                    continue
+                add(source_id, "text", text_label(t), t)
+                logger.debug(f"[Request {request_id}] Added text input {idx}/{num_texts}")
+            else:
+                logger.warning(f"[Request {request_id}] Skipping empty or invalid text input {idx}/{num_texts}")
+        except Exception as e:
+            failed_sources += 1
+            logger.error(f"[Request {request_id}] Error processing text input {idx}: {str(e)}")
+
+    # Log extraction summary
+    total_sources = successful_sources + failed_sources
+    logger.info(f"[Request {request_id}] Source extraction complete: {successful_sources}/{total_sources} successful, {failed_sources} failed")
+
+    return store
+
+
+async def _normalize_sources(request_id, store):
+    """
+    Normalize the extracted text of every source before topic extraction.
+    
+    Each document's text is replaced in place by its normalized form, so the
+    extracted version can be freed before the next document is normalized,
+    and it gains a page_map (PDFs) and "before"/"after" token estimates.
+    Documents left without any text are dropped.
+    """
+    for document in store:
+        result = await asyncio.to_thread(normalize_text, document.text, document.kind)
+        before, after = result["tokens_before"], result["tokens_after"]
+        metrics.increment("normalization_tokens_before_total", before, kind=document.kind)
+        metrics.increment("normalization_tokens_after_total", after, kind=document.kind)
+        saved = 100 * (before - after) / before if before else 0
+        logger.info(f"[Request {request_id}] Normalized {document.label}: ~{before} -> ~{after} tokens ({saved:.1f}% saved)")
+        if not result["text"]:
+            logger.warning(f"[Request {request_id}] Skipping {document.label}: no content left after normalization")
+            store.remove(document)
+            continue
+        store.set_text(document, result["text"])
+        document.page_map = result["page_map"]
+        document.tokens = {"before": before, "after": after}
+
+
+async def _compress_sources(request_id, store, token_budget, method):
+    """
+    Compress the sources to a combined token budget by extractive summarization.
+    
+    The budget is shared across sources so each stays represented. Each
+    document's text is replaced by its summary and the summarized size is
+    added to its tokens; documents summarized to nothing are dropped.
+    """
+    documents = list(store)
+    total = sum(document.tokens["after"] for document in documents)
+    if total <= token_budget:
+        return
+    logger.info(f"[Request {request_id}] Compressing ~{total} tokens to ~{token_budget} with {method}")
+    started = time.time()
+    texts = await asyncio.to_thread(summarize_texts, [document.text for document in documents], token_budget, method)
+    for document, text in zip(documents, texts):
+        tokens = estimate_tokens(text)
+        metrics.increment("summary_tokens_removed_total", document.tokens["after"] - tokens, method=method)
+        if not text:
+            logger.warning(f"[Request {request_id}] Skipping {document.label}: no content left after compression")
+            store.remove(document)
+            continue
+        store.set_text(document, text)
+        document.tokens = {**document.tokens, "summarized": tokens}
+    logger.info(f"[Request {request_id}] Compressed sources in {time.time() - started:.2f} seconds")
+
+
+async def _extract_source_topics(request_id, store, api_key, key_hash, notes, routing=None):
+    """
+    Extract the topic map of each source.
+    
+    Sources whose topic map is cached or already being extracted are served
+    on their own; the others are extracted together, in batches of up to
+    TOPICS_BATCH_MAX_TOKENS tokens, with one Gemini call per batch. The
+    topic map of each source in a batch is cached as if it had been
+    extracted alone.
+    
+    Model routing decisions are appended to routing, if given. Results served
+    from another request's call or the cache add no entries.
+    
+    Once at least one batch is done, the remaining sources are dropped (and
+    described in notes) when the request's time left falls below the reserve
+    kept for study guide generation.
+    
+    Returns:
+        dict: Source ID to {topic: content} map, in source order
+    """
+    source_topics = {}
+    reserve = get_settings().deadline_guide_reserve_seconds
+    documents = list(store)
+    batches = _topic_batches(documents, key_hash)
+    for idx, batch in enumerate(batches):
+        if source_topics and not _has_time_for(reserve):
+            dropped = [d.label for b in batches[idx:] for d in b]
+            logger.warning(f"[Request {request_id}] Time budget low, dropping {len(dropped)} sources before topic extraction")
+            notes.extend(f"Dropped {label}: not enough time left to analyse it" for label in dropped)
+            break
+        try:
+            if len(batch) == 1:
+                document = batch[0]
+                logger.info(f"[Request {request_id}] Extracting topics from source: {document.label}")
+                source_topics[document.id] = await _llm_flights.do(
+                    _topics_key(document, key_hash), extract_unique_topics_with_text, document.text, api_key=api_key, routing=routing
+                )
+                continue
+            logger.info(f"[Request {request_id}] Extracting topics from {len(batch)} sources in one call")
+            batch_key = f"topics-batch:{canonical_hash([[document.digest for document in batch], key_hash])}"
+            topic_maps = await _llm_flights.do(
+                batch_key, extract_topics_of_sources, [document.text for document in batch], api_key=api_key, routing=routing
+            )
+            for document, topics in zip(batch, topic_maps):
+                source_topics[document.id] = topics
+                _llm_flights.remember(_topics_key(document, key_hash), topics)
+        except DeadlineExceeded as e:
+            if not source_topics:
+                logger.error(f"[Request {request_id}] Time budget ran out before any topics were extracted")
+                raise HTTPException(status_code=504, detail=f"Request time budget ran out while extracting topics: {str(e)}")
+            dropped = [d.label for b in batches[idx:] for d in b]
+            logger.warning(f"[Request {request_id}] Time budget ran out, dropping {len(dropped)} sources")
+            notes.extend(f"Dropped {label}: the time budget ran out while analysing it" for label in dropped)
+            break
+        except CircuitOpenError as e:
+            logger.error(f"[Request {request_id}] Failing fast: {str(e)}")
+            raise _service_unavailable(e)
         except Exception as e:
-            logger.error(f"[Request {request_id}] Failed to format markdown: {str(e)}", exc_info=True)
+            logger.error(f"[Request {request_id}] Failed to extract topics: {str(e)}", exc_info=True)
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to format study guide as markdown: {str(e)}"
+                detail=f"Failed to extract topics from content: {str(e)}"
             )
+    logger.info(f"[Request {request_id}] Successfully extracted topics")
+    return {document.id: source_topics[document.id] for document in documents if document.id in source_topics}
+
+
+def _topic_batches(documents, key_hash):
+    """
+    Group documents into the batches their topics are extracted in, keeping source order within each.
+    
+    A document whose topic map is cached or in flight gets a batch of its
+    own, so it is served without a call; so does every document when
+    batching is disabled (TOPICS_BATCH_MAX_TOKENS=0).
+    """
+    limit = get_settings().topics_batch_max_tokens
+    batches = []
+    batch, tokens = [], 0
+    for document in documents:
+        key = _topics_key(document, key_hash)
+        if not limit or _llm_flights.pending(key) is not None or _llm_flights.cached(key):
+            batches.append([document])
+            continue
+        size = _document_tokens(document)
+        if batch and tokens + size > limit:
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(document)
+        tokens += size
+    if batch:
+        batches.append(batch)
+    return batches
 
-        # Log completion
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.info(f"[Request {request_id}] Request completed successfully in {duration:.2f} seconds")
-        logger.info(f"[Request {request_id}] Final output length: {len(final_output_text)} characters")
 
-        return {
-            "study_guide": final_output_text
+def _document_tokens(document):
+    """Return the estimated tokens of a source as it will be sent to Gemini."""
+    return document.tokens.get("summarized", document.tokens["after"])
+
+
+def _input_tokens(store):
+    """Return the estimated tokens of the sources as they will be sent to Gemini."""
+    return sum(_document_tokens(document) for document in store)
+
+
+def _fits_single_call(store):
+    """Return True if the sources are small enough for one combined topics and guide call."""
+    limit = get_settings().single_call_max_tokens
+    if not limit or not store:
+        return False
+    return _input_tokens(store) <= limit
+
+
+async def _make_quick_guide(request_id, store, api_key, key_hash):
+    """
+    Extract the topics and generate the guide of small sources in one Gemini call.
+    
+    Returns:
+        tuple: (source ID to {topic: content} map, study guide), or None if
+        the combined call failed and the two-call path should be used instead
+    
+    Raises:
+        HTTPException: 503 if the circuit is open, 504 if the time budget ran out
+    """
+    documents = list(store)
+    try:
+        logger.info(f"[Request {request_id}] Generating topics and study guide of {len(documents)} small sources in one call")
+        quick_key = f"quick:{canonical_hash([[document.digest for document in documents], key_hash])}"
+        result = await _llm_flights.do(
+            quick_key, make_quick_study_guide, [document.text for document in documents], api_key=api_key
+        )
+    except CircuitOpenError as e:
+        logger.error(f"[Request {request_id}] Failing fast: {str(e)}")
+        raise _service_unavailable(e)
+    except DeadlineExceeded as e:
+        logger.error(f"[Request {request_id}] Time budget ran out before the study guide was generated")
+        raise HTTPException(status_code=504, detail=f"Request time budget ran out while generating the study guide: {str(e)}")
+    except Exception as e:
+        logger.warning(f"[Request {request_id}] Single-call generation failed, falling back to separate calls: {str(e)}")
+        metrics.increment("single_call_fallbacks_total")
+        return None
+    metrics.increment("single_call_guides_total")
+    source_topics = {document.id: topics for document, topics in zip(documents, result["source_topics"])}
+    return source_topics, result["guide"]
+
+
+def _topics_key(document, key_hash):
+    """Return the key a document's topic map is coalesced and cached under."""
+    return f"topics:{canonical_hash([document.digest, key_hash])}"
+
+
+async def _make_guide(request_id, topics_data, api_key, key_hash, previous_guide=None, changed_topics=None,
+                      routing=None, notes=None):
+    """
+    Generate the study guide, coalescing identical concurrent generations.
+    
+    The topic-stage routing decisions in routing are prepended to the guide's
+    own metadata["routing"]. If the time budget runs out, a guide without
+    summaries and key points is built from the topics instead and a note is
+    added to notes.
+    """
+    try:
+        logger.info(f"[Request {request_id}] Generating study guide from topics")
+        guide_key = f"guide:{canonical_hash([topics_data, key_hash, previous_guide, changed_topics])}"
+        guide = await _llm_flights.do(
+            guide_key, make_study_guide, topics_data,
+            include_summary=True, include_key_points=True, api_key=api_key,
+            previous_guide=previous_guide, changed_topics=changed_topics
+        )
+        
+        if "error" in guide:
+            logger.error(f"[Request {request_id}] Study guide generation returned error: {guide['error']}")
+            raise HTTPException(status_code=500, detail=f"Failed to generate study guide: {guide['error']}")
+        
+        logger.info(f"[Request {request_id}] Successfully generated study guide")
+    except DeadlineExceeded as e:
+        logger.warning(f"[Request {request_id}] Time budget ran out generating the study guide, returning topics only: {str(e)}")
+        if notes is not None:
+            notes.append("Summaries and key points were skipped: the time budget ran out while generating them")
+        guide = _topics_only_guide(topics_data, previous_guide, changed_topics)
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        logger.error(f"[Request {request_id}] Failing fast: {str(e)}")
+        raise _service_unavailable(e)
+    except Exception as e:
+        logger.error(f"[Request {request_id}] Failed to generate study guide: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate study guide: {str(e)}"
+        )
+
+    if routing:
+        # The guide may be shared with other requests, so record routing on a copy
+        metadata = dict(guide.get("metadata", {}))
+        metadata["routing"] = routing + metadata.get("routing", [])
+        guide = {**guide, "metadata": metadata}
+    return guide
+
+
+def _topics_only_guide(topics_data, previous_guide=None, changed_topics=None):
+    """
+    Build a study guide without Gemini, using each topic's content directly.
+    
+    Topics unchanged since previous_guide keep their generated entries.
+    """
+    previous = {}
+    if previous_guide and changed_topics is not None:
+        previous = {
+            entry.get("topic"): entry
+            for entry in previous_guide.get("topics", [])
+            if entry.get("topic") not in changed_topics
         }
+    topics = [
+        previous.get(topic) or {"topic": topic, "original_content": content}
+        for topic, content in topics_data.items()
+    ]
+    return {
+        "overview": f"This study guide covers {len(topics)} topics. Summaries were skipped to stay within the time budget.",
+        "topics": topics,
+        "metadata": {
+            "total_topics": len(topics),
+            "includes_summary": False,
+            "includes_key_points": False,
+            "guide_type": "partial"
+        }
+    }
+
+
+def _generated_topics(guide, topics_data):
+    """
+    Return the topics whose guide entries were generated by Gemini.
     
+    Topics left without a summary by a partial guide are omitted so the next
+    update of the guide regenerates them.
+    """
+    if guide.get("metadata", {}).get("guide_type") != "partial":
+        return topics_data
+    generated = {entry.get("topic") for entry in guide.get("topics", []) if "summary" in entry}
+    return {topic: content for topic, content in topics_data.items() if topic in generated}
+
+
+def _format_guide(request_id, guide):
+    """Format the study guide as markdown, mapping failures to HTTP 500."""
+    try:
+        logger.info(f"[Request {request_id}] Formatting study guide as markdown")
+        final_output_text = format_study_guide_as_markdown(guide)
+        
+        if final_output_text.startswith("# Error"):
+            logger.error(f"[Request {request_id}] Markdown formatting returned error")
+            raise HTTPException(status_code=500, detail="Failed to format study guide as markdown")
+        
+        logger.info(f"[Request {request_id}] Successfully formatted study guide as markdown")
+        return final_output_text
     except HTTPException:
-        # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
-        # Catch any unexpected errors
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.error(f"[Request {request_id}] Unexpected error after {duration:.2f} seconds: {str(e)}", exc_info=True)
+        logger.error(f"[Request {request_id}] Failed to format markdown: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
-            detail=f"An unexpected error occurred while processing your request: {str(e)}"
+            detail=f"Failed to format study guide as markdown: {str(e)}"
         )
\ No newline at end of file
@@ -0,0 +1,291 @@
+"""
+Batch study guide generation.
+
+Runs the same pipeline as POST /api/get-output for every guide in a
+manifest, across a pool of worker processes, and writes one markdown file
+per guide. Worker processes share the Gemini rate limiter and the result
+caches through the shared state (SHARED_STATE_BACKEND), so the aggregate
+call rate stays within budget.
+
+Progress is checkpointed to <output dir>/checkpoint.jsonl after every
+guide; running the same command again skips guides that are already done.
+
+Usage:
+    python -m app.batch manifest.json --output guides/ --workers 4
+
+Manifest format (paths are relative to the manifest file):
+    {"guides": [
+        {"id": "cpsc110", "pdfs": ["cpsc110/notes.pdf"], "urls": [], "videos": [], "text": []}
+    ]}
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from fastapi import HTTPException
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+_GUIDE_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.\-]{0,127}$")
+_SOURCE_LISTS = ("pdfs", "urls", "videos", "text")
+
+
+def load_manifest(path):
+    """
+    Load and validate a batch manifest.
+
+    Args:
+        path: Path to the manifest JSON file
+
+    Returns:
+        list: Guide entries with "id" and the "pdfs" (absolute paths), "urls",
+        "videos" and "text" lists
+
+    Raises:
+        ValueError: If the manifest is malformed
+    """
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    guides = data.get("guides") if isinstance(data, dict) else data
+    if not isinstance(guides, list):
+        raise ValueError("Manifest must be a list of guides or an object with a \"guides\" list")
+
+    entries = []
+    seen = set()
+    for index, guide in enumerate(guides, 1):
+        if not isinstance(guide, dict):
+            raise ValueError(f"Guide {index} must be an object")
+        guide_id = str(guide.get("id", ""))
+        if not _GUIDE_ID.match(guide_id):
+            raise ValueError(f"Guide {index} has an invalid id {guide_id!r}: use letters, digits, '_', '.' and '-'")
+        if guide_id in seen:
+            raise ValueError(f"Duplicate guide id: {guide_id}")
+        seen.add(guide_id)
+
+        entry = {"id": guide_id}
+        for key in _SOURCE_LISTS:
+            values = guide.get(key, [])
+            if not isinstance(values, list):
+                raise ValueError(f"Guide {guide_id}: \"{key}\" must be a list")
+            entry[key] = values
+        entry["pdfs"] = [str((path.parent / pdf).resolve()) for pdf in entry["pdfs"]]
+        if not any(entry[key] for key in _SOURCE_LISTS):
+            raise ValueError(f"Guide {guide_id} has no sources")
+        entries.append(entry)
+    return entries
+
+
+def read_checkpoint(output_dir):
+    """Return the latest checkpoint record of each guide ID."""
+    path = Path(output_dir) / CHECKPOINT_FILE
+    records = {}
+    if not path.exists():
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line
+                continue
+            records[record["id"]] = record
+    return records
+
+
+def _append_checkpoint(output_dir, record):
+    path = Path(output_dir) / CHECKPOINT_FILE
+    line = json.dumps(record) + "\n"
+    with open(path, "ab+") as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Start a new line after a partial one left by an interrupted run
+                line = "\n" + line
+        f.write(line.encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_output(output_dir, guide_id, markdown):
+    """Write a guide's markdown atomically so a crash never leaves a partial file."""
+    path = Path(output_dir) / f"{guide_id}.md"
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=output_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+def _pdf_file(path):
+    """Describe a local PDF the way spool_uploads describes uploads."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return {"filename": os.path.basename(path), "path": path, "sha256": digest.hexdigest(), "size": size}
+
+
+def run_guide(entry, output_dir, api_key=None, compression=None):
+    """
+    Generate one guide and write its markdown. Runs in a worker process.
+
+    Returns:
+        dict: Checkpoint record with "id", "status" ("done" or "failed"),
+        "seconds", "sources", and "output" and "guide_id" or "error"
+    """
+    from app.api.routes import _memory_budget, generate_study_guide
+    from app.services.sourceIdentity import resolve_sources
+    from app.utils.helpers import canonical_hash
+    from app.utils.memory import memory_scope
+    from app.utils.scheduler import BULK, call_scope
+
+    started = time.time()
+    record = {"id": entry["id"], "sources": sum(len(entry[key]) for key in _SOURCE_LISTS)}
+    try:
+        pdf_files = [_pdf_file(path) for path in entry["pdfs"]]
+        resolved = resolve_sources(pdf_files, entry["urls"], entry["videos"], entry["text"])
+        api_key = api_key.strip() if api_key and api_key.strip() else None
+        key_hash = canonical_hash(api_key) if api_key else ""
+        with memory_scope(_memory_budget()), call_scope(BULK, "batch"):
+            result = asyncio.run(generate_study_guide(
+                f"batch-{entry['id']}", resolved["pdfs"], resolved["urls"], resolved["videos"], resolved["text"],
+                api_key, key_hash, compression
+            ))
+        record.update(
+            status="done",
+            output=_write_output(output_dir, entry["id"], result["study_guide"]),
+            guide_id=result["guide_id"],
+            notes=result["notes"]
+        )
+    except HTTPException as e:
+        record.update(status="failed", error=str(e.detail))
+    except Exception as e:
+        logger.error(f"[Batch {entry['id']}] Failed: {str(e)}", exc_info=True)
+        record.update(status="failed", error=str(e))
+    record["seconds"] = round(time.time() - started, 3)
+    return record
+
+
+def run_batch(entries, output_dir, workers=4, api_key=None, compression=None, retry_failed=False, report=print):
+    """
+    Generate every guide not yet completed according to the checkpoint.
+
+    Args:
+        entries: Guide entries from load_manifest()
+        output_dir: Directory for the markdown files and the checkpoint
+        workers: Number of worker processes; 0 runs guides in this process
+        api_key: Optional Gemini API key (defaults to GEMINI_API_KEY)
+        compression: Optional {"token_budget", "method"} extractive summarization settings
+        retry_failed: Also run guides whose last attempt failed
+        report: Function called with one progress line per finished guide
+
+    Returns:
+        dict: Throughput statistics
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = read_checkpoint(output_dir)
+    finished = {"done"} | (set() if retry_failed else {"failed"})
+    pending = [entry for entry in entries if checkpoint.get(entry["id"], {}).get("status") not in finished]
+    skipped = len(entries) - len(pending)
+    if skipped:
+        report(f"Resuming: {skipped} of {len(entries)} guides already processed")
+
+    records = []
+    started = time.time()
+
+    def finish(record):
+        _append_checkpoint(output_dir, record)
+        records.append(record)
+        detail = record.get("output") or record.get("error")
+        report(f"[{len(records)}/{len(pending)}] {record['id']}: {record['status']} in {record['seconds']:.1f}s ({detail})")
+
+    if workers <= 0:
+        for entry in pending:
+            finish(run_guide(entry, output_dir, api_key, compression))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_guide, entry, output_dir, api_key, compression) for entry in pending]
+            for future in as_completed(futures):
+                finish(future.result())
+
+    return throughput_stats(records, time.time() - started, skipped)
+
+
+def throughput_stats(records, elapsed, skipped=0):
+    """Summarize a batch run: counts, rates and per-guide latency percentiles."""
+    done = [r for r in records if r["status"] == "done"]
+    seconds = sorted(r["seconds"] for r in done)
+    minutes = elapsed / 60 if elapsed > 0 else 0
+
+    def quantile(q):
+        return seconds[min(len(seconds) - 1, int(round(q * (len(seconds) - 1))))] if seconds else None
+
+    return {
+        "guides": len(records),
+        "done": len(done),
+        "failed": len(records) - len(done),
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 2),
+        "guides_per_minute": round(len(done) / minutes, 2) if minutes else None,
+        "sources_per_minute": round(sum(r["sources"] for r in done) / minutes, 2) if minutes else None,
+        "mean_guide_seconds": round(statistics.mean(seconds), 2) if seconds else None,
+        "p50_guide_seconds": quantile(0.5),
+        "p95_guide_seconds": quantile(0.95),
+    }
+
+
+def format_stats(stats):
+    lines = [
+        f"Guides: {stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped from earlier runs",
+        f"Elapsed: {stats['elapsed_seconds']:.1f}s",
+    ]
+    if stats["guides_per_minute"] is not None:
+        lines.append(f"Throughput: {stats['guides_per_minute']} guides/min, {stats['sources_per_minute']} sources/min")
+    if stats["mean_guide_seconds"] is not None:
+        lines.append(
+            f"Per guide: mean {stats['mean_guide_seconds']}s, p50 {stats['p50_guide_seconds']}s, p95 {stats['p95_guide_seconds']}s"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate study guides in bulk from a manifest.")
+    parser.add_argument("manifest", help="JSON manifest listing the sources of each guide")
+    parser.add_argument("--output", "-o", required=True, help="Directory for the markdown guides and the checkpoint")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Worker processes (0 runs in this process)")
+    parser.add_argument("--api-key", default=None, help="Gemini API key (defaults to GEMINI_API_KEY)")
+    parser.add_argument("--token-budget", type=int, default=0, help="Compress each guide's sources to this many tokens")
+    parser.add_argument("--summarizer", default="textrank", choices=["textrank", "tfidf"])
+    parser.add_argument("--retry-failed", action="store_true", help="Retry guides that failed in earlier runs")
+    args = parser.parse_args(argv)
+
+    try:
+        entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Invalid manifest: {e}", file=sys.stderr)
+        return 2
+
+    compression = {"token_budget": args.token_budget, "method": args.summarizer} if args.token_budget > 0 else None
+    stats = run_batch(
+        entries, args.output, workers=args.workers, api_key=args.api_key,
+        compression=compression, retry_failed=args.retry_failed
+    )
+    print(format_stats(stats))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# Application configuration
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from dotenv import load_dotenv
+
+project_root = Path(__file__).resolve().parents[1]
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_list(name, default):
+    value = os.getenv(name) or default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _env_json(name, default):
+    value = os.getenv(name)
+    return json.loads(value) if value not in (None, "") else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class Settings:
+    """
+    Application settings, read once from the environment and the .env file.
+
+    Use get_settings() instead of instantiating this directly so the .env file
+    is only loaded once per process.
+    """
+
+    def __init__(self):
+        # Server
+        self.frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173").rstrip("/")
+        self.access_password = os.getenv("ACCESS_PASSWORD", "your_secure_password_here")
+        # Token for the /api/admin endpoints and request profiling (unset disables them)
+        self.admin_token = os.getenv("ADMIN_TOKEN", "")
+        self.prewarm_imports = _env_bool("PREWARM_IMPORTS", True)
+
+        # Gemini
+        self.gemini_api_key = os.getenv("GEMINI_API_KEY")
+        self.gemini_min_delay_seconds = _env_float("GEMINI_MIN_DELAY_SECONDS", 2.0)
+        # Models per pipeline stage, in order of preference; later ones are failovers
+        self.gemini_topic_models = _env_list("GEMINI_TOPIC_MODELS", "gemini-2.5-flash-lite,gemini-2.0-flash-lite")
+        self.gemini_guide_models = _env_list("GEMINI_GUIDE_MODELS", "gemini-2.5-flash-lite,gemini-2.5-flash")
+        self.gemini_rate_limit_cooldown_seconds = _env_float("GEMINI_RATE_LIMIT_COOLDOWN_SECONDS", 30)
+        self.gemini_server_error_cooldown_seconds = _env_float("GEMINI_SERVER_ERROR_COOLDOWN_SECONDS", 10)
+        # Per-call deadline and optional hedging of slow calls
+        self.gemini_call_timeout_seconds = _env_float("GEMINI_CALL_TIMEOUT_SECONDS", 120)
+        self.gemini_hedging = _env_bool("GEMINI_HEDGING", False)
+        self.gemini_hedge_quantile = _env_float("GEMINI_HEDGE_QUANTILE", 0.95)
+        self.gemini_hedge_min_samples = int(_env_float("GEMINI_HEDGE_MIN_SAMPLES", 20))
+        self.gemini_hedge_max_ratio = _env_float("GEMINI_HEDGE_MAX_RATIO", 0.1)
+        # Scheduling of Gemini calls: calls in flight per worker (0 = unlimited) and
+        # the queue time after which a call is served ahead of higher priorities
+        self.gemini_max_concurrent_calls = int(_env_float("GEMINI_MAX_CONCURRENT_CALLS", 8))
+        self.gemini_max_queue_seconds = _env_float("GEMINI_MAX_QUEUE_SECONDS", 30)
+        # Threads that work making Gemini calls runs on, queued calls included
+        # (0 sizes the pool from GEMINI_MAX_CONCURRENT_CALLS)
+        self.gemini_call_threads = int(_env_float("GEMINI_CALL_THREADS", 0))
+        # Adaptive concurrency: the calls in flight start at half the maximum above,
+        # grow while latency holds and are cut on 429s and when calls get slower than
+        # GEMINI_LATENCY_TOLERANCE times usual. GEMINI_MIN_DELAY_SECONDS can then be
+        # lowered, as the limit finds the quota's headroom itself
+        self.gemini_adaptive_concurrency = _env_bool("GEMINI_ADAPTIVE_CONCURRENCY", False)
+        self.gemini_min_concurrent_calls = int(_env_float("GEMINI_MIN_CONCURRENT_CALLS", 1))
+        self.gemini_latency_tolerance = _env_float("GEMINI_LATENCY_TOLERANCE", 2.0)
+
+        # Request time budget; the reserves keep time for the Gemini stages
+        self.request_deadline_seconds = _env_float("REQUEST_DEADLINE_SECONDS", 300)
+        self.max_request_deadline_seconds = _env_float("MAX_REQUEST_DEADLINE_SECONDS", 900)
+        self.deadline_generation_reserve_seconds = _env_float("DEADLINE_GENERATION_RESERVE_SECONDS", 60)
+        self.deadline_guide_reserve_seconds = _env_float("DEADLINE_GUIDE_RESERVE_SECONDS", 30)
+        # How often a running request checks whether its client has gone away
+        self.disconnect_poll_seconds = _env_float("DISCONNECT_POLL_SECONDS", 0.5)
+
+        # Circuit breakers for Gemini, web fetching and YouTube
+        self.circuit_failure_rate = _env_float("CIRCUIT_FAILURE_RATE", 0.5)
+        self.circuit_min_calls = int(_env_float("CIRCUIT_MIN_CALLS", 5))
+        self.circuit_window_seconds = _env_float("CIRCUIT_WINDOW_SECONDS", 60)
+        self.circuit_open_seconds = _env_float("CIRCUIT_OPEN_SECONDS", 30)
+        self.circuit_half_open_probes = int(_env_float("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+        # Default input token budget for extractive pre-summarization (0 disables it)
+        self.summary_token_budget = int(_env_float("SUMMARY_TOKEN_BUDGET", 0))
+        # Inputs of at most this many tokens get their topics and study guide from one
+        # Gemini call instead of two (0 disables it)
+        self.single_call_max_tokens = int(_env_float("SINGLE_CALL_MAX_TOKENS", 0))
+        # Topics of several sources are extracted in one Gemini call, in batches of up
+        # to this many tokens (0 extracts each source in a call of its own)
+        self.topics_batch_max_tokens = int(_env_float("TOPICS_BATCH_MAX_TOKENS", 32000))
+
+        # Sampling profiler for requests profiled by an admin
+        self.profile_interval_seconds = _env_float("PROFILE_INTERVAL_MS", 5) / 1000
+        self.profile_max_files = int(_env_float("PROFILE_MAX_FILES", 50))
+
+        # Memory: ceiling on the text a request holds, worker RSS above which
+        # new requests are refused (0 disables either), optional tracemalloc stats
+        self.request_memory_limit_bytes = int(_env_float("REQUEST_MEMORY_LIMIT_MB", 256) * 1024 * 1024)
+        self.worker_rss_limit_bytes = int(_env_float("WORKER_RSS_LIMIT_MB", 0) * 1024 * 1024)
+        self.memory_tracemalloc = _env_bool("MEMORY_TRACEMALLOC", False)
+
+        # Uploads
+        self.max_pdf_bytes = int(_env_float("MAX_PDF_UPLOAD_MB", 50) * 1024 * 1024)
+        self.max_request_bytes = int(_env_float("MAX_REQUEST_UPLOAD_MB", 200) * 1024 * 1024)
+
+        # Caching and shared state
+        self.extraction_cache_ttl = _env_float("EXTRACTION_CACHE_TTL_SECONDS", 86400)
+        self.llm_cache_ttl = _env_float("LLM_CACHE_TTL_SECONDS", 86400)
+        # Stored guides downloadable from /api/results expire after this long (0 keeps them)
+        self.result_ttl_seconds = _env_float("RESULT_TTL_SECONDS", 30 * 86400)
+        self.shared_state_backend = os.getenv("SHARED_STATE_BACKEND", "sqlite").lower()
+        self.shared_state_path = os.getenv("SHARED_STATE_PATH") or str(project_root / "data" / "shared_state.db")
+        self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        # Extraction on separate worker processes (python -m app.worker): unset runs it
+        # in the API process, "sqlite" queues it for workers on this host and "redis"
+        # (REDIS_URL) for workers on any node, which then need the uploads directory
+        self.extraction_queue = os.getenv("EXTRACTION_QUEUE", "").lower()
+        self.work_queue_path = os.getenv("WORK_QUEUE_PATH") or str(project_root / "data" / "work_queue.db")
+        self.work_queue_visibility_seconds = _env_float("WORK_QUEUE_VISIBILITY_SECONDS", 60)
+        self.work_queue_max_attempts = int(_env_float("WORK_QUEUE_MAX_ATTEMPTS", 3))
+        self.work_queue_poll_seconds = _env_float("WORK_QUEUE_POLL_SECONDS", 0.2)
+        # Per-source request counts that cache warming picks the most requested sources from
+        self.source_access_stats = _env_bool("SOURCE_ACCESS_STATS", False)
+        self.source_access_stats_path = (
+            os.getenv("SOURCE_ACCESS_STATS_PATH") or str(project_root / "data" / "source_access.db")
+        )
+        # Share of the Gemini call slots cache warming may use (it always gets at least one)
+        self.warming_call_share = _env_float("WARMING_CALL_SHARE", 0.25)
+        # Per-tenant usage ledger: requests, Gemini calls, retries, tokens and stage wall
+        # time per tenant and window. It is also on whenever a budget is set
+        self.usage_ledger = _env_bool("USAGE_LEDGER", False)
+        self.usage_ledger_path = os.getenv("USAGE_LEDGER_PATH") or str(project_root / "data" / "usage.db")
+        self.usage_window_seconds = _env_float("USAGE_WINDOW_SECONDS", 86400)
+        # Budgets per window of every tenant on the shared GEMINI_API_KEY (0 is unlimited)
+        self.usage_request_budget = int(_env_float("USAGE_REQUEST_BUDGET", 0))
+        self.usage_token_budget = int(_env_float("USAGE_TOKEN_BUDGET", 0))
+        # Budgets of single tenants, overriding the above, as JSON such as
+        # {"client:10.0.0.7": {"requests": 500, "tokens": 2000000}}
+        self.usage_budgets = _env_json("USAGE_BUDGETS", {})
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load the .env file (once) and return the application settings."""
+    load_dotenv(dotenv_path=project_root / ".env")
+    load_dotenv()
+    return Settings()
@@ -1,18 +1,43 @@
-from fastapi import FastAPI
+import importlib
+import threading
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api.routes import router
-import os
-from dotenv import load_dotenv
+from app.config import get_settings
+from app.utils.logger import setup_logger
 
-# Load environment variables
-load_dotenv()
+logger = setup_logger(__name__)
+settings = get_settings()
 
-app = FastAPI()
+# Heavy dependencies are imported lazily by the services on first use. After
+# startup they are imported in a background thread so the first request does
+# not pay for them, while health checks are already being answered.
+HEAVY_MODULES = ["pymupdf", "trafilatura", "youtube_transcript_api", "google.genai"]
+
+def prewarm_imports():
+    """Import the heavy service dependencies ahead of the first request."""
+    start_time = time.time()
+    for module in HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning(f"Failed to pre-warm {module}: {str(e)}")
+    logger.info(f"Pre-warmed service dependencies in {time.time() - start_time:.2f} seconds")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.prewarm_imports:
+        threading.Thread(target=prewarm_imports, name="prewarm-imports", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration - use environment variable or fallback to localhost
-frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173").rstrip("/")
 origins = [
-    frontend_url,
+    settings.frontend_url,
     "http://localhost:5173",  # Fallback Vite default port
     "http://localhost:5174",  # Fallback alternative Vite port
     "http://localhost:3000",  # Fallback alternative React port
@@ -26,6 +51,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads from the Content-Length header before the
+# multipart body is parsed. Allow some slack for form fields and boundaries.
+_MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    max_bytes = settings.max_request_bytes
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + _MULTIPART_OVERHEAD_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body exceeds the {max_bytes} byte upload limit"}
+        )
+    return await call_next(request)
+
 app.include_router(router)
 
 @app.get("/")
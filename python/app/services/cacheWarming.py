@@ -0,0 +1,215 @@
+# Cache warming
+#
+# At the start of a term the same syllabi, slides and lecture videos are
+# requested by many students at once, and whoever asks first pays for their
+# extraction and topic extraction. A warming job runs those two stages ahead
+# of time, through the same coalescing and caches as requests, for a list of
+# known sources or for the most requested ones according to the access stats
+# (see sourceStats), so the first requests find them in the cache.
+#
+# Jobs run in the background of an API process. Their Gemini calls are made
+# in the background priority class, so the scheduler serves interactive
+# requests first, and a job warms at most WARMING_CALL_SHARE of the call
+# slots' worth of sources at once, starting none while interactive calls are
+# queued. Topic maps are cached for requests that use the server's API key
+# and no token budget (compression changes the text sent to Gemini);
+# extractions are reused by every request.
+import asyncio
+import time
+import uuid
+from fastapi import HTTPException
+from app.config import get_settings
+from app.services.sourceIdentity import source_id
+from app.utils import metrics
+from app.utils.deadline import Deadline, deadline_scope
+from app.utils.helpers import canonical_hash
+from app.utils.logger import setup_logger
+from app.utils.memory import memory_scope
+from app.utils.scheduler import BACKGROUND, INTERACTIVE, call_scope, get_scheduler
+from app.utils.shared_state import cache_get, cache_set
+
+logger = setup_logger(__name__)
+
+WARMING_TENANT = "warming"
+WARMED = "warmed"
+CACHED = "cached"
+FAILED = "failed"
+
+# Seconds a job's report stays available
+_REPORT_TTL = 7 * 86400
+# Wait between checks while interactive calls are queued
+_PAUSE_SECONDS = 0.5
+
+# Running jobs of this process, so their tasks are not garbage collected
+_jobs = {}
+
+
+def warming_sources(resolved):
+    """
+    Describe the sources of resolve_sources() output that can be warmed.
+
+    Text inputs are left out: they need no extraction and are rarely repeated.
+
+    Returns:
+        list: {"id", "kind", "label", "target"} dicts
+    """
+    sources = []
+    for pdf in resolved["pdfs"]:
+        sources.append({"id": source_id("pdf", pdf), "kind": "pdf", "label": pdf["filename"], "target": pdf})
+    for kind, key in (("url", "urls"), ("video", "videos")):
+        for target in resolved[key]:
+            if isinstance(target, str) and target.strip():
+                sources.append({"id": source_id(kind, target), "kind": kind, "label": target, "target": target})
+    return sources
+
+
+def most_requested_sources(stats, limit):
+    """Describe the limit most requested sources of a SourceAccessStats as warming sources."""
+    return [
+        {"id": row["id"], "kind": row["kind"], "label": row["target"], "target": row["target"]}
+        for row in stats.top(limit)
+    ]
+
+
+def start_warming(sources, api_key=None):
+    """
+    Start warming sources in the background of the running event loop.
+
+    Args:
+        sources: Sources from warming_sources() or most_requested_sources()
+        api_key: Optional Gemini API key whose requests the topic maps are cached for
+
+    Returns:
+        tuple: (job ID, asyncio task returning the final report)
+    """
+    job_id = uuid.uuid4().hex
+    task = asyncio.ensure_future(warm_sources(job_id, sources, api_key))
+    _jobs[job_id] = task
+    task.add_done_callback(lambda _: _jobs.pop(job_id, None))
+    return job_id, task
+
+
+def warming_report(job_id):
+    """Return the latest report of a warming job, or None if it is unknown or expired."""
+    return cache_get(f"warming:{job_id}")
+
+
+async def warm_sources(job_id, sources, api_key=None):
+    """
+    Extract each source and its topic map into the caches.
+
+    Args:
+        job_id: ID the report is stored under
+        sources: Sources from warming_sources() or most_requested_sources()
+        api_key: Optional Gemini API key whose requests the topic maps are cached for
+
+    Returns:
+        dict: Report with the number of sources "warmed" (at least one stage
+        ran), already "cached" and "failed", the "coverage" (share of sources
+        now cached), "time_saved_seconds" (time the stages that ran took,
+        which the first requests for these sources no longer spend) and a
+        result per source
+    """
+    api_key = api_key.strip() if api_key and api_key.strip() else None
+    key_hash = canonical_hash(api_key) if api_key else ""
+    scheduler = get_scheduler()
+    slots = max(1, int(get_settings().warming_call_share * scheduler.stats()["limit"]))
+    semaphore = asyncio.Semaphore(slots)
+    report = {
+        "job_id": job_id,
+        "state": "running",
+        "started_at": time.time(),
+        "finished_at": None,
+        "sources": len(sources),
+        WARMED: 0,
+        CACHED: 0,
+        FAILED: 0,
+        "coverage": 0.0,
+        "time_saved_seconds": 0.0,
+        "results": [],
+    }
+    _save(report)
+    logger.info(f"[Warming {job_id}] Warming {len(sources)} sources, {slots} at a time")
+
+    async def warm(index, source):
+        async with semaphore:
+            while scheduler.stats()["waiting"][INTERACTIVE]:
+                await asyncio.sleep(_PAUSE_SECONDS)
+            result = await _warm_source(f"warm-{job_id[:8]}-{index}", source, api_key, key_hash)
+        report[result["status"]] += 1
+        report["time_saved_seconds"] = round(report["time_saved_seconds"] + result["seconds_saved"], 3)
+        report["coverage"] = round((report[WARMED] + report[CACHED]) / len(sources), 4)
+        report["results"].append(result)
+        metrics.increment("cache_warming_sources_total", status=result["status"], kind=source["kind"])
+        metrics.increment("cache_warming_seconds_saved_total", result["seconds_saved"])
+        _save(report)
+
+    with call_scope(BACKGROUND, WARMING_TENANT):
+        await asyncio.gather(*(warm(index, source) for index, source in enumerate(sources, 1)))
+
+    report.update(state="done", finished_at=time.time())
+    if not sources:
+        report["coverage"] = 1.0
+    _save(report)
+    logger.info(
+        f"[Warming {job_id}] Done in {report['finished_at'] - report['started_at']:.1f}s: "
+        f"{report[WARMED]} warmed, {report[CACHED]} already cached, {report[FAILED]} failed, "
+        f"~{report['time_saved_seconds']:.1f}s saved for first requests"
+    )
+    return report
+
+
+async def _warm_source(request_id, source, api_key, key_hash):
+    """Run the extraction and topic stages of one source, timing those that were not cached."""
+    from app.api.routes import (
+        _extract_source_topics, _extract_sources, _extraction_flights, _llm_flights, _memory_budget,
+        _normalize_sources, _topics_key
+    )
+
+    kind, target = source["kind"], source["target"]
+    result = {"id": source["id"], "kind": kind, "label": source["label"], "stages": [], "seconds_saved": 0.0}
+    notes = []
+    try:
+        deadline = Deadline(get_settings().max_request_deadline_seconds)
+        with deadline_scope(deadline), memory_scope(_memory_budget()):
+            extracted = _extraction_flights.cached(source["id"])
+            started = time.time()
+            store = await _extract_sources(
+                request_id,
+                [target] if kind == "pdf" else [],
+                [target] if kind == "url" else [],
+                [target] if kind == "video" else [],
+                [],
+                notes
+            )
+            if not store:
+                raise ValueError(notes[0] if notes else "No content could be extracted")
+            if not extracted:
+                _ran(result, "extraction", time.time() - started)
+
+            await _normalize_sources(request_id, store)
+            document = next(iter(store), None)
+            if document is None:
+                raise ValueError("No content left after normalization")
+            if not _llm_flights.cached(_topics_key(document, key_hash)):
+                started = time.time()
+                await _extract_source_topics(request_id, store, api_key, key_hash, notes)
+                _ran(result, "topics", time.time() - started)
+    except HTTPException as e:
+        result.update(status=FAILED, error=str(e.detail))
+    except Exception as e:
+        logger.warning(f"[Request {request_id}] Could not warm {source['label']}: {str(e)}")
+        result.update(status=FAILED, error=str(e))
+    else:
+        result["status"] = WARMED if result["stages"] else CACHED
+    result["seconds_saved"] = round(result["seconds_saved"], 3)
+    return result
+
+
+def _ran(result, stage, seconds):
+    result["stages"].append(stage)
+    result["seconds_saved"] += seconds
+
+
+def _save(report):
+    cache_set(f"warming:{report['job_id']}", report, _REPORT_TTL)
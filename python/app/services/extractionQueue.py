@@ -0,0 +1,93 @@
+# Extraction on worker processes
+#
+# PDF parsing and web article extraction are CPU-bound. With EXTRACTION_QUEUE
+# set, extraction of PDFs, web articles and YouTube transcripts is submitted
+# to the work queue and run by `python -m app.worker` processes instead of
+# the API process, which only waits for the result within the request's
+# deadline. Without it, extraction runs in the API process as before.
+import asyncio
+import time
+from functools import partial
+from app.config import get_settings
+from app.services.pdfExtraction import extract_pdf_text
+from app.services.webArticleExtraction import extract_web_article
+from app.services.youtubeTranscript import get_youtube_transcript
+from app.utils import metrics
+from app.utils.deadline import DeadlineExceeded, check_deadline, current_deadline
+from app.utils.logger import setup_logger
+from app.utils.work_queue import CANCELLED, DONE, FAILED, get_work_queue
+
+logger = setup_logger(__name__)
+
+# Task kind -> function extracting a source from its path or URL
+EXTRACTORS = {
+    "pdf": extract_pdf_text,
+    "url": extract_web_article,
+    "video": get_youtube_transcript,
+}
+
+
+def extractor(kind, fn):
+    """
+    Return the function that extracts a source of kind: fn itself, or one
+    that runs the extraction on the workers when EXTRACTION_QUEUE is set.
+    """
+    if get_settings().extraction_queue:
+        return partial(extract_on_worker, kind)
+    return fn
+
+
+async def extract_on_worker(kind, target):
+    """
+    Have a worker extract a source and wait for the result.
+
+    The task carries the request's deadline, so the worker gives up when the
+    request would. If the wait is abandoned (the deadline passes or every
+    caller went away), the task is cancelled.
+
+    Args:
+        kind: "pdf", "url" or "video"
+        target: Path of the PDF (readable by the workers) or URL
+
+    Returns:
+        The extraction result, as returned by the extractor
+
+    Raises:
+        DeadlineExceeded: If the request's time budget runs out first
+        ValueError: If the extraction failed on every attempt
+    """
+    settings = get_settings()
+    queue = get_work_queue()
+    deadline = current_deadline()
+    payload = {"target": target, "deadline": time.time() + deadline.remaining() if deadline else None}
+    # Queue calls block (SQLite transactions, Redis round trips): keep them off the event loop
+    task_id = await asyncio.to_thread(queue.submit, kind, payload, max_attempts=settings.work_queue_max_attempts)
+    submitted = time.time()
+    finished = False
+    try:
+        while True:
+            status = await asyncio.to_thread(queue.status, task_id)
+            if status is None or status["state"] == CANCELLED:
+                finished = True
+                raise ValueError(f"Extraction task {task_id} was lost")
+            if status["state"] in (DONE, FAILED):
+                finished = True
+                metrics.observe("extraction_task_seconds", time.time() - submitted, kind=kind)
+                if status["state"] == DONE:
+                    return status["result"]
+                error = status["error"] or {}
+                message = error.get("message") or "Extraction failed"
+                logger.warning(f"Extraction task {task_id} failed after {status['attempts']} attempts: {message}")
+                if error.get("type") == DeadlineExceeded.__name__:
+                    raise DeadlineExceeded(message)
+                raise ValueError(message)
+            check_deadline(f"the {kind} extraction task")
+            await asyncio.sleep(settings.work_queue_poll_seconds)
+    finally:
+        if finished:
+            cleanup = asyncio.to_thread(queue.forget, task_id)
+        else:
+            logger.info(f"Cancelling extraction task {task_id}: its result is no longer wanted")
+            cleanup = asyncio.to_thread(queue.cancel, task_id)
+        # Shielded: the task must be cleaned up even if this wait is being cancelled
+        await asyncio.shield(cleanup)
@@ -0,0 +1,231 @@
+# Extractive summarization service
+#
+# Compresses large inputs to a token budget on the CPU before they are sent
+# to Gemini. Sentences are scored with TF-IDF centrality or TextRank over a
+# sparse sentence-term matrix and the best ones are kept, in their original
+# order, within a per-source share of the budget so every source stays
+# represented. A source whose every sentence exceeds its share keeps the
+# start of its best sentence instead of nothing.
+import math
+import re
+from app.services.textNormalization import estimate_tokens, truncate_to_tokens
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+TFIDF = "tfidf"
+TEXTRANK = "textrank"
+METHODS = (TFIDF, TEXTRANK)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n{2,}")
+_WORD = re.compile(r"[a-z0-9]{2,}")
+_STOP_WORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how its may new now old see "
+    "two way who did get let say she too use this that with have from they will would there their what about "
+    "which when make like time just know take into year your some could them than then look only come over "
+    "also back after work first well even want because these give most is it in of on to as at be by or an "
+    "if so do we he no up my me".split()
+)
+
+# A source keeps at least this share of an equal split of the budget
+_MIN_SOURCE_SHARE = 0.5
+# Sentences this similar to an already selected one are skipped as redundant
+_REDUNDANCY_THRESHOLD = 0.8
+_SELECTION_BATCH = 256
+_TEXTRANK_DAMPING = 0.85
+_TEXTRANK_ITERATIONS = 30
+
+
+def split_sentences(text):
+    """Split text into sentences, treating blank lines as boundaries too."""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def _sentence_matrix(sentences):
+    """
+    Build the L2-normalized TF-IDF sentence-term matrix (scipy CSR).
+
+    Rows of sentences without any indexed term are all zero.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    vocabulary = {}
+    rows, cols = [], []
+    for row, sentence in enumerate(sentences):
+        for word in _WORD.findall(sentence.lower()):
+            if word in _STOP_WORDS:
+                continue
+            rows.append(row)
+            cols.append(vocabulary.setdefault(word, len(vocabulary)))
+
+    shape = (len(sentences), max(1, len(vocabulary)))
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    counts.sum_duplicates()
+    counts.data = 1 + np.log(counts.data)  # sublinear term frequency
+
+    document_frequency = np.bincount(counts.indices, minlength=shape[1])
+    idf = np.log((1 + shape[0]) / (1 + document_frequency)) + 1
+    matrix = counts @ sparse.diags(idf.astype(np.float32))
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def _tfidf_scores(matrix):
+    """Score sentences by cosine similarity to the centroid of their source."""
+    import numpy as np
+
+    centroid = np.asarray(matrix.mean(axis=0)).ravel()
+    norm = np.linalg.norm(centroid)
+    if norm == 0:
+        return np.zeros(matrix.shape[0])
+    return matrix @ (centroid / norm)
+
+
+def _textrank_scores(matrix):
+    """
+    Score sentences with TextRank over their cosine similarity graph.
+
+    The similarity matrix S·Sᵀ is never materialized: each power iteration
+    multiplies by Sᵀ and then S, so the cost stays linear in the number of
+    non-zero terms even for tens of thousands of sentences.
+    """
+    import numpy as np
+
+    n = matrix.shape[0]
+    transposed = matrix.T.tocsr()
+    self_similarity = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+
+    def similarity_times(vector):
+        # (S·Sᵀ - diag(self similarity)) @ vector
+        return matrix @ (transposed @ vector) - self_similarity * vector
+
+    degree = similarity_times(np.ones(n))
+    degree[degree <= 0] = 1
+    scores = np.full(n, 1 / n)
+    for _ in range(_TEXTRANK_ITERATIONS):
+        updated = (1 - _TEXTRANK_DAMPING) / n + _TEXTRANK_DAMPING * similarity_times(scores / degree)
+        if np.abs(updated - scores).sum() < 1e-6:
+            scores = updated
+            break
+        scores = updated
+    return scores
+
+
+def _select(sentences, matrix, scores, token_counts, budget):
+    """
+    Pick the best-scoring non-redundant sentences within budget, in original order.
+
+    Candidates are taken in batches so the redundancy check against the
+    sentences already chosen is one sparse product per batch.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    chosen = []
+    chosen_matrix = None
+    used = 0
+    smallest = min(token_counts)
+    order = np.argsort(-scores, kind="stable")
+    for start in range(0, len(order), _SELECTION_BATCH):
+        batch = order[start:start + _SELECTION_BATCH]
+        rows = matrix[batch]
+        if chosen_matrix is not None:
+            against_chosen = (rows @ chosen_matrix.T).max(axis=1).toarray().ravel()
+        else:
+            against_chosen = np.zeros(len(batch))
+        within_batch = (rows @ rows.T).toarray()
+
+        picked = []
+        for position, index in enumerate(batch):
+            cost = token_counts[index]
+            if used + cost > budget or against_chosen[position] >= _REDUNDANCY_THRESHOLD:
+                continue
+            if picked and within_batch[position, picked].max() >= _REDUNDANCY_THRESHOLD:
+                continue
+            picked.append(position)
+            chosen.append(index)
+            used += cost
+            if budget - used < smallest:
+                break
+        if picked:
+            picked_rows = rows[picked]
+            chosen_matrix = picked_rows if chosen_matrix is None else sparse.vstack([chosen_matrix, picked_rows], format="csr")
+        if budget - used < smallest:
+            break
+    return [sentences[i] for i in sorted(chosen)], used
+
+
+def allocate_budget(token_counts, budget):
+    """
+    Split a token budget across sources.
+
+    Every source gets at least half of an equal split (or all of its tokens
+    if it is smaller); the rest is shared in proportion to source size.
+
+    Returns:
+        list: The token budget of each source
+    """
+    if sum(token_counts) <= budget:
+        return list(token_counts)
+    floor = budget / len(token_counts) * _MIN_SOURCE_SHARE
+    shares = [min(tokens, floor) for tokens in token_counts]
+    remaining = budget - sum(shares)
+    excess = [tokens - share for tokens, share in zip(token_counts, shares)]
+    total_excess = sum(excess)
+    if total_excess > 0:
+        shares = [share + remaining * e / total_excess for share, e in zip(shares, excess)]
+    return [int(math.floor(share)) for share in shares]
+
+
+def summarize_texts(texts, token_budget, method=TEXTRANK):
+    """
+    Compress several texts to a combined token budget by keeping their most
+    central sentences.
+
+    Args:
+        texts: Text of each source
+        token_budget: Target total number of tokens (estimate_tokens)
+        method: TEXTRANK or TFIDF sentence scoring
+
+    Returns:
+        list: The compressed text of each source, in the same order. Texts
+        are returned unchanged when they already fit the budget; a text with
+        any sentence in it is never compressed to nothing.
+
+    Raises:
+        ValueError: If method is unknown or token_budget is not positive
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown summarization method: {method}. Use one of: {', '.join(METHODS)}")
+    if token_budget <= 0:
+        raise ValueError("token_budget must be positive")
+
+    totals = [estimate_tokens(text) for text in texts]
+    if sum(totals) <= token_budget:
+        return list(texts)
+
+    budgets = allocate_budget(totals, token_budget)
+    score = _textrank_scores if method == TEXTRANK else _tfidf_scores
+    results = []
+    for text, total, budget in zip(texts, totals, budgets):
+        if total <= budget:
+            results.append(text)
+            continue
+        sentences = split_sentences(text)
+        if not sentences:
+            results.append("")
+            continue
+        matrix = _sentence_matrix(sentences)
+        token_counts = [estimate_tokens(sentence) for sentence in sentences]
+        scores = score(matrix)
+        selected, used = _select(sentences, matrix, scores, token_counts, budget)
+        if not selected:
+            # Even the shortest sentence is over the source's share
+            selected = [truncate_to_tokens(sentences[int(scores.argmax())], max(1, budget))]
+            used = estimate_tokens(selected[0])
+        logger.debug(f"Kept {len(selected)}/{len(sentences)} sentences ({used}/{total} tokens)")
+        results.append("\n".join(selected))
+    return results
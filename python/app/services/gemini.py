@@ -1,18 +1,24 @@
-import os
 import json
 import time
 import re
-from dotenv import load_dotenv
-from google import genai
-from pathlib import Path
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.config import get_settings
 from app.utils.logger import setup_logger
+from app.utils.shared_state import get_shared_state
+from app.utils import metrics
+from app.utils.deadline import DeadlineExceeded, current_deadline, check_deadline, sleep_within_deadline
+from app.utils.cancellation import WorkCancelled, current_token
+from app.utils.circuit_breaker import CircuitOpenError, get_breaker
+from app.utils.scheduler import get_scheduler
+from app.utils.usage import current_usage
+from app.services.modelRouter import get_router, classify_error, RATE_LIMITED, SERVER_ERROR, INVALID_RESPONSE
 
 logger = setup_logger(__name__)
-project_root = Path(__file__).resolve().parents[2]
 
-# Global rate limiting - minimum time between API calls
-_last_api_call = 0
-_min_delay_between_calls = 2.0  # 2 seconds between calls
+# Global rate limiting - minimum time between API calls, shared by all worker processes
+_min_delay_between_calls = get_settings().gemini_min_delay_seconds  # 2 seconds between calls by default
 
 def _get_api_key(provided_key=None):
     """Get the Gemini API key from provided parameter or environment variables."""
@@ -23,8 +29,7 @@ def _get_api_key(provided_key=None):
             return provided_key.strip()
         
         # Fall back to environment variable
-        load_dotenv(dotenv_path=project_root / ".env")
-        api_key = os.getenv("GEMINI_API_KEY")
+        api_key = get_settings().gemini_api_key
         if not api_key:
             logger.error("GEMINI_API_KEY not found in environment variables")
             raise ValueError("GEMINI_API_KEY not found in environment variables!")
@@ -34,6 +39,13 @@ def _get_api_key(provided_key=None):
         logger.error(f"Error loading API key: {str(e)}")
         raise
 
+def _create_client(api_key):
+    """Create a Gemini client. google.genai is imported on first use as it is slow to load."""
+    from google import genai
+    # The HTTP timeout aborts the underlying request when a call misses its deadline
+    timeout_ms = int(get_settings().gemini_call_timeout_seconds * 1000)
+    return genai.Client(api_key=api_key, http_options={"timeout": timeout_ms})
+
 def _extract_retry_delay(error_message):
     """Extract retry delay from API error message."""
     try:
@@ -49,79 +61,328 @@ def _extract_retry_delay(error_message):
     return None
 
 def _rate_limit():
-    """Enforce a minimum delay between API calls."""
-    global _last_api_call
-    current_time = time.time()
-    time_since_last_call = current_time - _last_api_call
-    
-    if time_since_last_call < _min_delay_between_calls:
-        sleep_time = _min_delay_between_calls - time_since_last_call
+    """
+    Enforce a minimum delay between API calls.
+
+    The next free call slot is reserved in the shared state backend, so the
+    spacing holds across all threads and worker processes. The wait for it
+    never runs past the current request's deadline and ends early when the
+    current work is cancelled.
+
+    Raises:
+        DeadlineExceeded: If the reserved slot is not before the deadline
+        WorkCancelled: If the work is cancelled before, during or after the wait
+    """
+    if _min_delay_between_calls <= 0:
+        return
+    check_deadline("waiting for the Gemini rate limit")
+    sleep_time = get_shared_state().reserve_interval("ratelimit:gemini", _min_delay_between_calls)
+    if sleep_time > 0:
         logger.debug(f"Rate limiting: sleeping for {sleep_time:.2f}s")
-        time.sleep(sleep_time)
-    
-    _last_api_call = time.time()
+        sleep_within_deadline(sleep_time, "the Gemini rate limit gap")
+        check_deadline("the Gemini call")
+
+class GeminiTimeoutError(TimeoutError):
+    """Raised when a Gemini call does not return within its deadline."""
+
+# Gemini calls run in this pool so they can be bounded by a deadline and hedged
+_call_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini-call")
+_hedge_lock = threading.Lock()
+_CANCEL_POLL_SECONDS = 0.25  # how often a waiting call checks whether its work was cancelled
+_hedge_budget = {"calls": 0, "hedges": 0}
+
+def _reset_after_fork():
+    # A forked child (batch worker processes) inherits the pool without its
+    # threads, so anything submitted to it would never run
+    global _call_executor, _hedge_lock
+    _call_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini-call")
+    _hedge_lock = threading.Lock()
 
-def _call_gemini_with_retry(client, model, prompt, max_retries=5, initial_delay=3):
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _hedge_delay(model):
+    """
+    Return how long to wait before hedging a call to model, or None if hedging
+    is disabled or there are not enough latency samples yet.
+    """
+    settings = get_settings()
+    if not settings.gemini_hedging:
+        return None
+    if metrics.summary_count("gemini_latency_seconds", model=model) < settings.gemini_hedge_min_samples:
+        return None
+    return metrics.percentile("gemini_latency_seconds", settings.gemini_hedge_quantile, model=model)
+
+def _take_hedge_budget():
+    """Allow a hedge only while hedges stay under GEMINI_HEDGE_MAX_RATIO of all calls."""
+    with _hedge_lock:
+        if _hedge_budget["hedges"] + 1 > get_settings().gemini_hedge_max_ratio * _hedge_budget["calls"]:
+            return False
+        _hedge_budget["hedges"] += 1
+        return True
+
+def _wait_unless_cancelled(futures, timeout, token):
+    """
+    Wait like concurrent.futures.wait(FIRST_COMPLETED), returning early with
+    nothing done if token is cancelled.
+    """
+    if token is None:
+        return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    end = time.time() + timeout
+    while True:
+        remaining = max(0.0, end - time.time())
+        done, pending = wait(futures, timeout=min(remaining, _CANCEL_POLL_SECONDS), return_when=FIRST_COMPLETED)
+        if done or remaining <= _CANCEL_POLL_SECONDS or token.cancelled:
+            return done, pending
+
+def _generate_with_deadline(client, model, prompt, stage):
+    """
+    Run one generate_content call bounded by GEMINI_CALL_TIMEOUT_SECONDS.
+    
+    With hedging enabled, if the call has not returned after the model's
+    observed p95 latency a second identical call is started (budget
+    permitting) and whichever finishes first wins. The loser is cancelled if
+    it has not started yet; otherwise its result is discarded and the client
+    HTTP timeout ends it.
+    
+    The call is also bounded by the time left in the current request, and
+    is abandoned if the work it belongs to is cancelled.
+    
+    Raises:
+        GeminiTimeoutError: If no call returned before the deadline
+        DeadlineExceeded: If the request's time budget ran out first
+        WorkCancelled: If the work was cancelled while waiting
+    """
+    token = current_token()
+    timeout = get_settings().gemini_call_timeout_seconds
+    request_deadline = current_deadline()
+    limited_by_request = request_deadline is not None and request_deadline.remaining() < timeout
+    if limited_by_request:
+        timeout = request_deadline.remaining()
+    deadline = time.time() + timeout
+    with _hedge_lock:
+        _hedge_budget["calls"] += 1
+
+    primary = _call_executor.submit(client.models.generate_content, model=model, contents=prompt)
+    pending = {primary}
+    hedge = None
+
+    hedge_after = _hedge_delay(model)
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = _wait_unless_cancelled(pending, hedge_after, token)
+        if not done and not (token and token.cancelled) and _take_hedge_budget():
+            logger.info(f"Gemini call to {model} exceeded p95 latency ({hedge_after:.2f}s), sending hedge request")
+            try:
+                _rate_limit()
+            except DeadlineExceeded:
+                # No time for the rate limit gap; the primary call may still finish
+                logger.info(f"No time left for a hedge request to {model}")
+            else:
+                metrics.increment("gemini_hedges_fired_total", model=model, stage=stage)
+                hedge = _call_executor.submit(client.models.generate_content, model=model, contents=prompt)
+                pending.add(hedge)
+
+    error = None
+    while pending:
+        done, pending = _wait_unless_cancelled(pending, max(0.0, deadline - time.time()), token)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            for loser in pending:
+                loser.cancel()
+            if future is hedge:
+                metrics.increment("gemini_hedges_won_total", model=model, stage=stage)
+            return future.result()
+
+    if error is not None and not pending:
+        raise error
+    for future in pending:
+        future.cancel()
+    if token is not None and token.cancelled:
+        metrics.increment("gemini_calls_cancelled_total", model=model, stage=stage)
+        raise WorkCancelled(f"Gemini call to {model} abandoned")
+    metrics.increment("gemini_call_timeouts_total", model=model, stage=stage)
+    if limited_by_request:
+        raise DeadlineExceeded(f"Request time budget ran out while waiting for {model}")
+    raise GeminiTimeoutError(f"Gemini call to {model} timed out after {timeout:.0f}s")
+
+def _record_route(routing, stage, model, outcome, attempt, latency=None):
+    """Append one routing decision to the caller's routing log, if any."""
+    if routing is not None:
+        routing.append({
+            "stage": stage,
+            "model": model,
+            "attempt": attempt + 1,
+            "outcome": outcome,
+            "latency": round(latency, 3) if latency is not None else None
+        })
+
+def _record_usage(attempt, latency, input_chars, response=None):
+    """
+    Add one attempt to the current request's Usage, if any.
+    
+    Tokens are taken from the response's usage metadata, or estimated at
+    about four characters a token when it has none. Failed attempts are
+    counted without tokens.
+    """
+    usage = current_usage()
+    if usage is None or latency is None:
+        return
+    input_tokens = output_tokens = 0
+    if response is not None:
+        meta = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(meta, "prompt_token_count", None)
+        output_tokens = getattr(meta, "candidates_token_count", None)
+        if input_tokens is None:
+            input_tokens = input_chars // 4
+        if output_tokens is None:
+            output_tokens = len(getattr(response, "text", None) or "") // 4
+    usage.add_call(latency, input_tokens, output_tokens, retry=attempt > 0)
+
+def _call_gemini_with_retry(client, model, prompt, max_retries=5, initial_delay=3, stage="default", routing=None):
     """
     Call Gemini API with intelligent retry logic for rate limits.
     
+    When several models are given, a model that returns 429 or a 5xx error is
+    put in cooldown and the next attempt fails over to another model right
+    away instead of sleeping. Sleeping only happens when every model is
+    cooling down. Retries are abandoned when their wait would run past the
+    current request's deadline.
+    
+    Attempts go through the "gemini" circuit breaker: once server errors and
+    timeouts dominate, calls fail fast until a probe call succeeds again.
+    
+    Each attempt first waits for a slot from the call scheduler, by the
+    priority and tenant of the current call_scope(); the slot is given back
+    before any retry backoff. Latencies, 429s and timeouts are reported to
+    the scheduler, which adapts its number of slots to them when adaptive
+    concurrency is enabled.
+    
+    Every attempt that reaches Gemini is added to the current request's
+    Usage (see app/utils/usage), with the tokens it was charged for.
+    
     Args:
         client: Gemini client instance
-        model: Model name to use
+        model: Model name to use, or a list of model names in order of preference
         prompt: Prompt to send
         max_retries: Maximum number of retry attempts
         initial_delay: Initial delay in seconds between retries
+        stage: Pipeline stage name used for routing metrics
+        routing: Optional list that receives one entry per attempt (model, outcome, latency)
         
     Returns:
         Response from Gemini API
         
     Raises:
+        CircuitOpenError: If the Gemini circuit is open
         Exception: If all retries fail
     """
+    models = [model] if isinstance(model, str) else list(model)
+    router = get_router()
+    breaker = get_breaker("gemini")
+    scheduler = get_scheduler()
+    # Scheduling cost: thousands of prompt tokens, at about four characters a token
+    cost = max(1.0, len(prompt) / 4000)
+
     for attempt in range(max_retries):
+        current_model = router.order(models)[0]
+        started = None
+        allowed = False
         try:
-            # Enforce rate limiting between calls
-            _rate_limit()
-            
-            logger.debug(f"Gemini API call attempt {attempt + 1}/{max_retries}")
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt
-            )
+            check_deadline(f"Gemini call attempt {attempt + 1}")
+            with scheduler.slot(cost) as call:
+                breaker.allow()
+                allowed = True
+
+                # Enforce rate limiting between calls
+                _rate_limit()
+
+                logger.debug(f"Gemini API call attempt {attempt + 1}/{max_retries} using {current_model}")
+                started = time.time()
+                try:
+                    response = _generate_with_deadline(client, current_model, prompt, stage)
+                except Exception as e:
+                    if isinstance(e, GeminiTimeoutError) or classify_error(e) == RATE_LIMITED:
+                        call.record(time.time() - started, overloaded=True)
+                    raise
+                call.record(time.time() - started, key=(current_model, stage))
+            latency = time.time() - started
+            breaker.record_success()
             
             if response and hasattr(response, 'text'):
-                logger.debug(f"Gemini API call succeeded on attempt {attempt + 1}")
+                logger.debug(f"Gemini API call succeeded on attempt {attempt + 1} using {current_model}")
+                router.record_success(current_model, stage, latency)
+                _record_route(routing, stage, current_model, "ok", attempt, latency)
+                _record_usage(attempt, latency, len(prompt), response)
                 return response
             else:
                 logger.warning(f"Gemini API returned invalid response on attempt {attempt + 1}")
+                router.record_failure(current_model, stage, INVALID_RESPONSE, latency=latency)
+                _record_route(routing, stage, current_model, INVALID_RESPONSE, attempt, latency)
+                _record_usage(attempt, latency, len(prompt))
                 if attempt < max_retries - 1:
                     delay = initial_delay * (2 ** attempt)
                     logger.info(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
+                    sleep_within_deadline(delay)
                     continue
                 else:
                     raise ValueError("Gemini API returned invalid response after all retries")
                     
+        except CircuitOpenError:
+            raise
+        except WorkCancelled:
+            if allowed:
+                # Also frees a half-open probe slot taken before the rate limit gap
+                breaker.release()
+            if started is None:
+                # The work was cancelled before this call was made
+                metrics.increment("gemini_calls_cancelled_total", model=current_model, stage=stage)
+            raise
         except Exception as e:
+            if isinstance(e, DeadlineExceeded):
+                if allowed:
+                    breaker.release()
+                raise
+            if isinstance(e, ValueError) and "invalid response" in str(e):
+                raise
             error_str = str(e)
+            latency = time.time() - started if started else None
+            failure = classify_error(e)
+            if started is not None:
+                if failure == SERVER_ERROR:
+                    breaker.record_failure()
+                else:
+                    # The service answered; rate limits are per API key and handled by the router
+                    breaker.record_success()
+            retry_delay = _extract_retry_delay(error_str) if failure == RATE_LIMITED else None
+            router.record_failure(current_model, stage, failure, retry_after=retry_delay, latency=latency)
+            _record_route(routing, stage, current_model, failure, attempt, latency)
+            _record_usage(attempt, latency, len(prompt))
+
+            # Fail over to another model right away on 429 and 5xx errors
+            if failure in (RATE_LIMITED, SERVER_ERROR) and attempt < max_retries - 1:
+                alternate = next((m for m in router.order(models) if m != current_model and router.is_available(m)), None)
+                if alternate:
+                    logger.warning(f"{failure} from {current_model}, failing over to {alternate} (attempt {attempt + 1}/{max_retries})")
+                    metrics.increment("gemini_failovers_total", from_model=current_model, to_model=alternate, stage=stage)
+                    continue
             
             # Check if this is a rate limit error (429)
-            if '429' in error_str or 'RESOURCE_EXHAUSTED' in error_str or 'quota' in error_str.lower():
-                # Extract the retry delay from the error message
-                retry_delay = _extract_retry_delay(error_str)
-                
+            if failure == RATE_LIMITED:
                 if retry_delay and attempt < max_retries - 1:
                     # Add a small buffer to the suggested delay
                     wait_time = retry_delay + 2
                     logger.warning(f"Rate limit hit (429). Waiting {wait_time:.1f}s as suggested by API (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
+                    sleep_within_deadline(wait_time)
                     continue
                 elif attempt < max_retries - 1:
                     # Use exponential backoff if we can't extract delay
                     delay = initial_delay * (2 ** attempt)
                     wait_time = max(delay, 45)  # Wait at least 45 seconds for rate limits
                     logger.warning(f"Rate limit hit (429). Waiting {wait_time:.1f}s (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
+                    sleep_within_deadline(wait_time)
                     continue
                 else:
                     logger.error(f"Rate limit exceeded after all retries: {error_str}")
@@ -132,14 +393,14 @@ def _call_gemini_with_retry(client, model, prompt, max_retries=5, initial_delay=
             if attempt < max_retries - 1:
                 delay = initial_delay * (2 ** attempt)
                 logger.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+                sleep_within_deadline(delay)
             else:
                 logger.error(f"All {max_retries} Gemini API attempts failed")
                 raise
     
     raise Exception("Failed to get valid response from Gemini API")
 
-def extract_unique_topics_with_text(text, api_key=None):
+def extract_unique_topics_with_text(text, api_key=None, routing=None):
     """
     Extract main topics from large text using the Gemini 2.5-pro model.
     Returns a JSON object where each topic maps to its unique corresponding text.
@@ -148,6 +409,7 @@ def extract_unique_topics_with_text(text, api_key=None):
     Args:
         text (str): The large text to process
         api_key (str, optional): User-provided API key, uses environment key if not provided
+        routing (list, optional): Receives the model routing decisions made for this call
 
     Returns:
         dict: JSON object with topics as keys and unique text snippets as values
@@ -185,13 +447,15 @@ Return ONLY the JSON object, no other text."""
 
     try:
         logger.debug("Initializing Gemini API client for topic extraction")
-        client = genai.Client(api_key=_get_api_key(api_key))
+        client = _create_client(_get_api_key(api_key))
         
         logger.info("Sending request to Gemini API for topic extraction")
         response = _call_gemini_with_retry(
             client=client,
-            model="gemini-2.5-flash-lite",
-            prompt=prompt
+            model=get_router().models_for("topics"),
+            prompt=prompt,
+            stage="topics",
+            routing=routing
         )
 
         # Extract the JSON from the response
@@ -224,24 +488,170 @@ Return ONLY the JSON object, no other text."""
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error: {str(e)}")
         raise ValueError(f"Failed to parse JSON from Gemini response: {str(e)}")
-    except ValueError:
+    except (ValueError, DeadlineExceeded, WorkCancelled):
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error during topic extraction: {str(e)}", exc_info=True)
+        raise ValueError(f"Failed to extract topics: {str(e)}")
+
+def extract_topics_of_sources(texts, api_key=None, routing=None):
+    """
+    Extract the topics of several sources in ONE API call.
+
+    Replaces one extract_unique_topics_with_text() call per source. The model
+    sees all sources at once, so a topic they share gets the same name and
+    content repeated across them is removed; it attributes the content of
+    each topic to the sources it comes from, so per-source topic maps can
+    still be stored for incremental updates.
+
+    Args:
+        texts (list): Text of each source
+        api_key (str, optional): User-provided API key, uses environment key if not provided
+        routing (list, optional): Receives the model routing decisions made for this call
+
+    Returns:
+        list: A {topic: content} map per text, in the order of texts
+    """
+    logger.info(f"Starting topic extraction from {len(texts)} sources in one call")
+
+    if not texts or not all(isinstance(text, str) and text for text in texts):
+        raise ValueError("Texts must be non-empty strings")
+
+    sources = "".join(f"SOURCE {index}:\n{text}\n\n" for index, text in enumerate(texts, 1))
+    prompt = f"""You are a study guide assistant specialized in content deduplication and topic extraction.
+
+Analyze the following sources together and:
+1. Identify all main topics covered; a topic covered by several sources gets ONE name
+2. Extract ALL unique text content related to each topic (be comprehensive)
+3. Remove exact duplicates or near-identical phrases, also across sources
+4. Keep different explanations of the same concept if they provide unique value
+5. Consolidate related information under the most appropriate topic
+
+Return ONLY a valid JSON object where:
+- Keys are the main topics (clear, concise topic names)
+- Values map the number of each source that covers the topic to its consolidated unique text about it, e.g. {{"1": "...", "3": "..."}}
+
+SOURCES FOR TOPIC EXTRACTION:
+{sources}Return ONLY the JSON object, no other text."""
+
+    try:
+        client = _create_client(_get_api_key(api_key))
+        logger.info("Sending multi-source topic extraction request to Gemini API")
+        response = _call_gemini_with_retry(
+            client=client,
+            model=get_router().models_for("topics"),
+            prompt=prompt,
+            stage="topics",
+            routing=routing
+        )
+        data = _parse_json_response(response.text.strip())
+        if not isinstance(data, dict):
+            raise ValueError("Response is not a JSON object")
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {str(e)}")
+        raise ValueError(f"Failed to parse JSON from Gemini response: {str(e)}")
+    except (ValueError, DeadlineExceeded, WorkCancelled):
         raise
     except Exception as e:
         logger.error(f"Unexpected error during topic extraction: {str(e)}", exc_info=True)
         raise ValueError(f"Failed to extract topics: {str(e)}")
 
-def make_study_guide(topics_data, include_summary=True, include_key_points=True, api_key=None):
+    source_topics = [{} for _ in texts]
+    for name, content in data.items():
+        if not isinstance(content, dict):
+            # Content without attribution belongs to the first source
+            content = {"1": content}
+        for number, text in content.items():
+            index = int(number) - 1 if str(number).isdigit() and 0 < int(number) <= len(texts) else 0
+            text = text if isinstance(text, str) else json.dumps(text, ensure_ascii=False)
+            if not text:
+                continue
+            topics_map = source_topics[index]
+            topics_map[name] = f"{topics_map[name]}\n\n{text}" if name in topics_map else text
+    logger.info(f"Successfully extracted {len(data)} topics from {len(texts)} sources")
+    return source_topics
+
+def _topic_key(name):
+    """Normalize a topic name for matching across guide versions."""
+    return " ".join(str(name).split()).casefold()
+
+def _merge_guide_topics(previous_guide, partial_guide, topics_data, changed_topics):
+    """
+    Combine regenerated topic entries with the reused entries of a previous guide.
+
+    Entries are matched by normalized topic name; regenerated entries whose name
+    was altered by the model are assigned to the remaining changed topics in order.
+    The result follows the order of topics_data.
+    """
+    previous = {_topic_key(e.get("topic", "")): e for e in previous_guide.get("topics", [])}
+    regenerated = {}
+    unmatched = []
+    wanted = {_topic_key(name) for name in changed_topics}
+    for entry in partial_guide.get("topics", []):
+        key = _topic_key(entry.get("topic", ""))
+        if key in wanted and key not in regenerated:
+            regenerated[key] = entry
+        else:
+            unmatched.append(entry)
+
+    topics = []
+    changed = set(changed_topics)
+    for name in topics_data:
+        key = _topic_key(name)
+        if name in changed:
+            entry = regenerated.get(key) or (unmatched.pop(0) if unmatched else None)
+        else:
+            entry = previous.get(key)
+        entry = dict(entry) if entry else {"topic": name, "original_content": topics_data[name]}
+        entry["topic"] = name
+        topics.append(entry)
+
+    return {
+        "overview": partial_guide.get("overview") or previous_guide.get("overview", ""),
+        "topics": topics
+    }
+
+def _guide_type(total_content_length):
+    """Choose the depth of the guide from the length of the topic content."""
+    # Adaptive guide generation based on content size
+    if total_content_length < 2000:
+        return "concise"
+    if total_content_length < 10000:
+        return "standard"
+    return "comprehensive"
+
+def _parse_json_response(response_text):
+    """Parse a JSON response, also when the model wrapped it in a markdown code block."""
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        logger.warning("Failed to parse JSON directly, attempting to extract from markdown code blocks")
+        if "```json" in response_text:
+            return json.loads(response_text.split("```json")[1].split("```")[0].strip())
+        if "```" in response_text:
+            return json.loads(response_text.split("```")[1].split("```")[0].strip())
+        raise
+
+def make_study_guide(topics_data, include_summary=True, include_key_points=True, api_key=None,
+                     previous_guide=None, changed_topics=None):
     """
     Generate a comprehensive study guide from topic data using a SINGLE API call.
 
+    When a previous guide for the same corpus is supplied together with the
+    list of changed topics, only those topics are sent to Gemini and the other
+    entries are reused from the previous guide.
+
     Args:
         topics_data (dict): Dictionary with topics as keys and content as values
         include_summary (bool): Whether to generate a summary for each topic
         include_key_points (bool): Whether to extract key points for each topic
         api_key (str, optional): User-provided API key, uses environment key if not provided
+        previous_guide (dict, optional): Earlier study guide to update incrementally
+        changed_topics (list, optional): Topics in topics_data that are new or whose content changed
 
     Returns:
-        dict: A structured study guide with formatted content
+        dict: A structured study guide with formatted content. metadata["routing"]
+        lists the model used for each Gemini attempt.
     """
     logger.info("Starting study guide generation")
     
@@ -257,25 +667,40 @@ def make_study_guide(topics_data, include_summary=True, include_key_points=True,
         raise ValueError("topics_data must be a dictionary")
 
     try:
-        logger.debug("Initializing Gemini API client for study guide generation")
-        client = genai.Client(api_key=_get_api_key(api_key))
-
         # Determine the depth and complexity of the guide based on content length
         total_content_length = sum(len(str(content)) for content in topics_data.values())
         num_topics = len(topics_data)
 
-        # Adaptive guide generation based on content size
-        if total_content_length < 2000:
-            guide_type = "concise"
-        elif total_content_length < 10000:
-            guide_type = "standard"
-        else:
-            guide_type = "comprehensive"
+        guide_type = _guide_type(total_content_length)
+
+        metadata = {
+            "total_topics": num_topics,
+            "guide_type": guide_type,
+            "content_length": total_content_length,
+            "routing": []
+        }
+
+        # Incremental update: only regenerate new or changed topics
+        incremental = bool(previous_guide) and "topics" in previous_guide and changed_topics is not None
+        prompt_topics = topics_data
+        if incremental:
+            changed_topics = [name for name in changed_topics if name in topics_data]
+            prompt_topics = {name: topics_data[name] for name in changed_topics}
+            metadata["regenerated_topics"] = len(prompt_topics)
+            if not prompt_topics:
+                logger.info("No topics changed, reusing previous study guide entries")
+                study_guide_data = _merge_guide_topics(previous_guide, {}, topics_data, [])
+                study_guide_data["metadata"] = metadata
+                return study_guide_data
+            logger.info(f"Incremental update: regenerating {len(prompt_topics)}/{num_topics} topics")
+
+        logger.debug("Initializing Gemini API client for study guide generation")
+        client = _create_client(_get_api_key(api_key))
         
-        logger.info(f"Generating {guide_type} study guide for {num_topics} topics ({total_content_length} characters) in SINGLE API call")
+        logger.info(f"Generating {guide_type} study guide for {len(prompt_topics)} topics ({total_content_length} characters) in SINGLE API call")
 
         # Build the batch prompt for ALL topics at once
-        topics_json = json.dumps(topics_data, indent=2)
+        topics_json = json.dumps(prompt_topics, indent=2)
 
         batch_prompt = f"""You are a study guide assistant. Process ALL the following topics in one comprehensive analysis.
 
@@ -316,6 +741,11 @@ Instructions:
             batch_prompt += """
 - For each topic, extract 3-7 key points depending on content length"""
 
+        if incremental:
+            all_topic_names = ", ".join(topics_data.keys())
+            batch_prompt += f"""
+- The complete study guide covers these topics: {all_topic_names}. Write the overview for the complete guide, not only the topics above"""
+
         batch_prompt += """
 - Create an overall overview for the entire study guide
 - Ensure the JSON is valid and properly formatted
@@ -327,8 +757,10 @@ Return ONLY the JSON object, no markdown code blocks or additional text."""
             logger.info(f"Sending batch request to Gemini API for all {num_topics} topics")
             response = _call_gemini_with_retry(
                 client=client,
-                model="gemini-2.5-flash-lite",
-                prompt=batch_prompt
+                model=get_router().models_for("guide"),
+                prompt=batch_prompt,
+                stage="guide",
+                routing=metadata["routing"]
             )
 
             response_text = response.text.strip()
@@ -351,12 +783,11 @@ Return ONLY the JSON object, no markdown code blocks or additional text."""
                     logger.error(f"Failed to parse JSON from response. Preview: {response_text[:500]}")
                     raise ValueError(f"Failed to parse JSON from Gemini response")
 
+            if incremental:
+                study_guide_data = _merge_guide_topics(previous_guide, study_guide_data, topics_data, changed_topics)
+
             # Add metadata
-            study_guide_data["metadata"] = {
-                "total_topics": num_topics,
-                "guide_type": guide_type,
-                "content_length": total_content_length
-            }
+            study_guide_data["metadata"] = metadata
 
             logger.info(f"Successfully generated complete study guide with {num_topics} topics in single API call")
             return study_guide_data
@@ -368,12 +799,119 @@ Return ONLY the JSON object, no markdown code blocks or additional text."""
             logger.error(f"Error generating batch study guide: {str(e)}")
             raise
 
-    except ValueError:
+    except (ValueError, DeadlineExceeded, WorkCancelled):
         raise
     except Exception as e:
         logger.error(f"Unexpected error generating study guide: {str(e)}", exc_info=True)
         raise ValueError(f"Failed to generate study guide: {str(e)}")
 
+def make_quick_study_guide(texts, api_key=None, routing=None):
+    """
+    Extract the topics of short sources and write their study guide in ONE API call.
+
+    For small inputs this replaces extract_unique_topics_with_text() followed
+    by make_study_guide(), saving a round trip and a rate limit gap. The
+    model attributes the content of each topic to the sources it comes from,
+    so per-source topic maps can still be stored for incremental updates.
+
+    Args:
+        texts (list): Text of each source
+        api_key (str, optional): User-provided API key, uses environment key if not provided
+        routing (list, optional): Receives the model routing decisions made for this call
+
+    Returns:
+        dict: "source_topics", a {topic: content} map per text, and "guide",
+        the study guide in the structure make_study_guide() returns
+    """
+    logger.info(f"Starting single-call study guide generation for {len(texts)} sources")
+
+    if not texts or not all(isinstance(text, str) and text for text in texts):
+        raise ValueError("Texts must be non-empty strings")
+
+    sources = "".join(f"SOURCE {index}:\n{text}\n\n" for index, text in enumerate(texts, 1))
+    prompt = f"""You are a study guide assistant. The following sources are short, so identify their topics and write the complete study guide in one step.
+
+SOURCES TO ANALYZE:
+{sources}Return ONLY valid JSON with the following structure, no additional text.
+
+Required JSON structure:
+{{
+  "overview": "A brief 2-3 sentence overview of what this study guide covers and what students will learn",
+  "topics": [
+    {{
+      "topic": "topic name",
+      "content": {{"1": "all unique text content of source 1 about this topic"}},
+      "summary": "A 2-3 sentence summary capturing the main ideas",
+      "key_points": ["key point 1", "key point 2", "key point 3"]
+    }}
+  ]
+}}
+
+Instructions:
+- Identify all main topics covered (clear, concise topic names) and consolidate related information under the most appropriate topic
+- In "content", map the number of each source that covers the topic to ALL of its unique text about it; remove only exact duplicates or near-identical phrases
+- For each topic, create a clear 2-3 sentence summary of the main ideas
+- For each topic, extract 3-7 key points depending on content length
+- Create an overall overview for the entire study guide
+- Ensure the JSON is valid and properly formatted
+
+Return ONLY the JSON object, no markdown code blocks or additional text."""
+
+    metadata = {"routing": [], "single_call": True}
+    try:
+        key = _get_api_key(api_key)
+        client = _create_client(key)
+        logger.info("Sending combined topic and study guide request to Gemini API")
+        response = _call_gemini_with_retry(
+            client=client,
+            model=get_router().models_for("quick"),
+            prompt=prompt,
+            stage="quick",
+            routing=metadata["routing"]
+        )
+        data = _parse_json_response(response.text.strip())
+        if not isinstance(data, dict) or not isinstance(data.get("topics"), list):
+            raise ValueError("Response has no topics list")
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {str(e)}")
+        raise ValueError(f"Failed to parse study guide JSON: {str(e)}")
+    except (ValueError, DeadlineExceeded, WorkCancelled):
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error generating single-call study guide: {str(e)}", exc_info=True)
+        raise ValueError(f"Failed to generate study guide: {str(e)}")
+
+    source_topics = [{} for _ in texts]
+    topics = []
+    for entry in data["topics"]:
+        if not isinstance(entry, dict) or not entry.get("topic"):
+            continue
+        name = str(entry["topic"])
+        content = entry.pop("content", None)
+        if not isinstance(content, dict):
+            # Content without attribution belongs to the first source
+            content = {"1": content or entry.get("original_content", "")}
+        parts = []
+        for number, text in content.items():
+            index = int(number) - 1 if str(number).isdigit() and 0 < int(number) <= len(texts) else 0
+            text = text if isinstance(text, str) else json.dumps(text, ensure_ascii=False)
+            if not text:
+                continue
+            topics_map = source_topics[index]
+            topics_map[name] = f"{topics_map[name]}\n\n{text}" if name in topics_map else text
+            parts.append(text)
+        entry["original_content"] = "\n\n".join(parts)
+        topics.append(entry)
+    if not topics:
+        raise ValueError("Response has no topics")
+
+    total_content_length = sum(len(entry["original_content"]) for entry in topics)
+    metadata.update(total_topics=len(topics), guide_type=_guide_type(total_content_length),
+                    content_length=total_content_length)
+    guide = {"overview": data.get("overview", ""), "topics": topics, "metadata": metadata}
+    logger.info(f"Successfully generated study guide with {len(topics)} topics in a single API call")
+    return {"source_topics": source_topics, "guide": guide}
+
 
 def format_study_guide_as_markdown(study_guide):
     """
@@ -0,0 +1,107 @@
+# Persistent study guide store
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+project_root = Path(__file__).resolve().parents[2]
+
+GUIDE_DIR = project_root / "data" / "guides"
+_GUIDE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def new_guide_id() -> str:
+    """Generate a new random guide ID."""
+    return uuid.uuid4().hex
+
+
+def _guide_path(guide_id: str) -> Path:
+    if not isinstance(guide_id, str) or not _GUIDE_ID_PATTERN.match(guide_id):
+        raise ValueError(f"Invalid guide ID: {guide_id}")
+    return GUIDE_DIR / f"{guide_id}.json"
+
+
+def save_guide(record: dict) -> None:
+    """
+    Persist a guide record atomically.
+
+    A record holds the guide ID, the per-source topic maps, the merged topics
+    and the generated study guide, so later updates only need to process the
+    sources that changed.
+
+    Args:
+        record: Guide record with at least "guide_id", "sources", "topics" and "study_guide"
+    """
+    path = _guide_path(record["guide_id"])
+    GUIDE_DIR.mkdir(parents=True, exist_ok=True)
+    record["updated_at"] = time.time()
+    record.setdefault("created_at", record["updated_at"])
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=GUIDE_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved guide {record['guide_id']} with {len(record['sources'])} sources and {len(record['topics'])} topics")
+
+
+def load_guide(guide_id: str) -> dict:
+    """
+    Load a persisted guide record.
+
+    Raises:
+        ValueError: If the guide ID is malformed
+        FileNotFoundError: If no guide with this ID exists
+    """
+    path = _guide_path(guide_id)
+    if not path.exists():
+        logger.warning(f"Guide not found: {guide_id}")
+        raise FileNotFoundError(f"Guide not found: {guide_id}")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge_topic_maps(source_topics: dict) -> dict:
+    """
+    Merge per-source topic maps into one topic map.
+
+    Topics whose names match (ignoring case and whitespace) are combined, with
+    their content joined in source order. The first spelling seen is kept.
+    Paragraphs a topic already has (ignoring case and whitespace) are not
+    added again, so text repeated across sources appears once.
+
+    Args:
+        source_topics: Mapping of source ID to that source's {topic: content} map, in source order
+
+    Returns:
+        dict: Merged {topic: content} map
+    """
+    paragraphs = {}
+    names = {}
+    for topics in source_topics.values():
+        for name, content in (topics or {}).items():
+            key = _normalized(name)
+            content = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+            if key not in names:
+                names[key] = name
+                paragraphs[key] = {}
+            for paragraph in _PARAGRAPH_BREAK.split(content):
+                if paragraph.strip():
+                    paragraphs[key].setdefault(_normalized(paragraph), paragraph.strip())
+    return {names[key]: "\n\n".join(parts.values()) for key, parts in paragraphs.items()}
+
+
+def _normalized(text) -> str:
+    return " ".join(str(text).split()).casefold()
+
+
+def diff_topics(old_topics: dict, new_topics: dict) -> list:
+    """
+    Return the topics in new_topics that are new or whose content changed.
+    """
+    return [name for name, content in new_topics.items() if old_topics.get(name) != content]
@@ -0,0 +1,129 @@
+# Gemini model routing service
+import threading
+import time
+from app.config import get_settings
+from app.utils import metrics
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+RATE_LIMITED = "rate_limited"
+SERVER_ERROR = "server_error"
+CLIENT_ERROR = "client_error"
+INVALID_RESPONSE = "invalid_response"
+
+
+class ModelRouter:
+    """
+    Choose which Gemini model serves each call.
+
+    Every pipeline stage has an ordered list of models. A model that returns
+    429 or a 5xx error is put in a cooldown, and calls fail over to the next
+    model of the stage instead of waiting. Latency and error counts are
+    tracked per model and exported as metrics.
+    """
+
+    def __init__(self, stage_models, rate_limit_cooldown=30.0, server_error_cooldown=10.0):
+        self.stage_models = stage_models
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.server_error_cooldown = server_error_cooldown
+        self._cooldown_until = {}
+        self._lock = threading.Lock()
+
+    def models_for(self, stage):
+        """Return the configured models for a pipeline stage."""
+        return list(self.stage_models.get(stage) or self.stage_models["default"])
+
+    def is_available(self, model):
+        """Return True if the model is not cooling down after a failure."""
+        with self._lock:
+            return self._cooldown_until.get(model, 0) <= time.time()
+
+    def order(self, models):
+        """
+        Order models for the next attempt: available models in configured order,
+        then cooling-down models by the time their cooldown ends.
+        """
+        now = time.time()
+        with self._lock:
+            available = [m for m in models if self._cooldown_until.get(m, 0) <= now]
+            cooling = sorted((m for m in models if m not in available), key=lambda m: self._cooldown_until[m])
+        return available + cooling
+
+    def record_success(self, model, stage, latency):
+        metrics.increment("gemini_calls_total", model=model, stage=stage, outcome="ok")
+        metrics.observe("gemini_latency_seconds", latency, model=model)
+
+    def record_failure(self, model, stage, kind, retry_after=None, latency=None):
+        """Record a failed call and put the model in cooldown for rate limits and server errors."""
+        metrics.increment("gemini_calls_total", model=model, stage=stage, outcome=kind)
+        if latency is not None:
+            metrics.observe("gemini_latency_seconds", latency, model=model)
+
+        cooldown = 0
+        if kind == RATE_LIMITED:
+            cooldown = retry_after or self.rate_limit_cooldown
+        elif kind == SERVER_ERROR:
+            cooldown = self.server_error_cooldown
+        if cooldown:
+            with self._lock:
+                self._cooldown_until[model] = max(self._cooldown_until.get(model, 0), time.time() + cooldown)
+            metrics.increment("gemini_model_cooldowns_total", model=model, reason=kind)
+            logger.info(f"Model {model} cooling down for {cooldown:.1f}s after {kind}")
+
+    def stats(self):
+        """Return per-model availability, call counts and latency percentiles."""
+        now = time.time()
+        models = sorted({m for models in self.stage_models.values() for m in models})
+        result = {}
+        for model in models:
+            with self._lock:
+                cooldown = max(0.0, self._cooldown_until.get(model, 0) - now)
+            result[model] = {
+                "cooldown_seconds": round(cooldown, 1),
+                "ok": sum(metrics.get_counter("gemini_calls_total", model=model, stage=s, outcome="ok") for s in self.stage_models),
+                "p50_latency": metrics.percentile("gemini_latency_seconds", 0.5, model=model),
+                "p95_latency": metrics.percentile("gemini_latency_seconds", 0.95, model=model)
+            }
+        return result
+
+
+def classify_error(error):
+    """
+    Classify a Gemini API exception.
+
+    Returns:
+        str: RATE_LIMITED, SERVER_ERROR or CLIENT_ERROR
+    """
+    if isinstance(error, TimeoutError):
+        return SERVER_ERROR
+    code = getattr(error, "code", None)
+    error_str = str(error)
+    if code == 429 or '429' in error_str or 'RESOURCE_EXHAUSTED' in error_str or 'quota' in error_str.lower():
+        return RATE_LIMITED
+    if (isinstance(code, int) and 500 <= code < 600) or any(
+            marker in error_str for marker in ("500", "502", "503", "504", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")):
+        return SERVER_ERROR
+    return CLIENT_ERROR
+
+
+_router = None
+
+
+def get_router():
+    """Return the process-wide model router built from the settings."""
+    global _router
+    if _router is None:
+        settings = get_settings()
+        _router = ModelRouter(
+            {
+                "default": settings.gemini_topic_models,
+                "topics": settings.gemini_topic_models,
+                "guide": settings.gemini_guide_models,
+                # Topics and guide of small inputs in one call (see make_quick_study_guide)
+                "quick": settings.gemini_guide_models,
+            },
+            rate_limit_cooldown=settings.gemini_rate_limit_cooldown_seconds,
+            server_error_cooldown=settings.gemini_server_error_cooldown_seconds
+        )
+    return _router
@@ -1,19 +1,30 @@
-import pymupdf as pdf
 import re
 from app.utils.logger import setup_logger
+from app.utils.cancellation import WorkCancelled
+from app.utils.deadline import DeadlineExceeded, check_deadline
 
 logger = setup_logger(__name__)
 
-async def extract_pdf_text(pdf_file):
+def extract_pdf_text(pdf_file):
     """
     Extract text from a PDF file.
     
+    Parsing is CPU-bound and blocking: callers on the event loop run it in a
+    worker thread (SingleFlight does), where the deadline and cancellation
+    checks between pages see the request's Deadline and CancelToken.
+    
     Args:
         pdf_file: Can be either a file path (str) or an UploadFile object
     
     Returns:
         str: Extracted text from all pages
+
+    Raises:
+        DeadlineExceeded: If the request's time budget runs out while reading pages
+        WorkCancelled: If the work is cancelled while reading pages
     """
+    import pymupdf as pdf  # Imported on first use to keep application start-up fast
+
     filename = pdf_file if isinstance(pdf_file, str) else getattr(pdf_file, 'filename', 'unknown')
     logger.info(f"Starting PDF text extraction for: {filename}")
     
@@ -36,7 +47,7 @@ async def extract_pdf_text(pdf_file):
             logger.debug(f"Processing uploaded PDF file: {filename}")
             try:
                 # Read file contents as bytes
-                content = await pdf_file.read()
+                content = pdf_file.file.read()
                 content_size = len(content)
                 logger.info(f"Read {content_size} bytes from uploaded file: {filename}")
                 
@@ -63,6 +74,11 @@ async def extract_pdf_text(pdf_file):
         
         for page_num, page in enumerate(doc, start=1):
             logger.debug(f"Extracting text from page {page_num}/{page_count} of {filename}")
+            try:
+                check_deadline(f"page {page_num}/{page_count} of {filename}")
+            except (DeadlineExceeded, WorkCancelled):
+                doc.close()
+                raise
             
             try:
                 # Extract page text with formatting preserved
@@ -85,7 +101,7 @@ async def extract_pdf_text(pdf_file):
         logger.info(f"Successfully extracted {text_length} characters from {page_count} pages of {filename}")
         return final_text
         
-    except FileNotFoundError:
+    except (FileNotFoundError, DeadlineExceeded, WorkCancelled):
         raise
     except PermissionError:
         raise
@@ -0,0 +1,90 @@
+# Request profile store
+#
+# Profiles of admin-profiled requests are kept as collapsed-stack files
+# named after the request ID, next to a small JSON summary. Only the most
+# recent PROFILE_MAX_FILES profiles are kept.
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+project_root = Path(__file__).resolve().parents[2]
+
+PROFILE_DIR = project_root / "data" / "profiles"
+_PROFILE_ID_PATTERN = re.compile(r"^[0-9A-Za-z_\-]{1,64}$")
+
+
+def profile_path(profile_id: str) -> Path:
+    """
+    Return the collapsed-stack file of a profile.
+
+    Raises:
+        ValueError: If the profile ID is malformed
+    """
+    if not isinstance(profile_id, str) or not _PROFILE_ID_PATTERN.match(profile_id):
+        raise ValueError(f"Invalid profile ID: {profile_id}")
+    return PROFILE_DIR / f"{profile_id}.collapsed"
+
+
+def _write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=PROFILE_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def save_profile(profile_id, profiler, endpoint):
+    """
+    Store a finished profile and drop the oldest ones beyond PROFILE_MAX_FILES.
+
+    Args:
+        profile_id: ID of the profiled request
+        profiler: Stopped SamplingProfiler
+        endpoint: Name of the profiled endpoint
+
+    Returns:
+        dict: The profile summary
+    """
+    path = profile_path(profile_id)
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    summary = {
+        "profile_id": profile_id,
+        "endpoint": endpoint,
+        "created_at": profiler.started_at,
+        "duration_seconds": round(profiler.duration, 3),
+        "samples": profiler.samples,
+        "interval_seconds": profiler.interval,
+        "top_functions": [{"function": name, "samples": count} for name, count in profiler.top_functions()],
+    }
+    _write_atomic(path, profiler.collapsed())
+    _write_atomic(path.with_suffix(".json"), json.dumps(summary))
+    logger.info(f"Saved profile {profile_id} ({profiler.samples} samples over {profiler.duration:.2f}s)")
+    _prune(get_settings().profile_max_files)
+    return summary
+
+
+def list_profiles():
+    """Return the summaries of stored profiles, newest first."""
+    if not PROFILE_DIR.exists():
+        return []
+    summaries = []
+    for path in PROFILE_DIR.glob("*.json"):
+        try:
+            summaries.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return sorted(summaries, key=lambda s: s.get("created_at") or 0, reverse=True)
+
+
+def _prune(max_files):
+    for summary in list_profiles()[max_files:]:
+        path = profile_path(summary["profile_id"])
+        for stale in (path, path.with_suffix(".json")):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
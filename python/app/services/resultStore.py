@@ -0,0 +1,184 @@
+# Content-addressed study guide results
+#
+# Every complete guide generated by /api/get-output is kept under the hash
+# of its canonical inputs and generation options (the identities of its
+# sources, the API key and the compression settings) together with the hash
+# of its markdown, so it can be downloaded again or shared from
+# GET /api/results/{result_id} without being regenerated. A guide generated
+# anew for the same inputs, once the LLM result cache has expired, gets an
+# ID of its own, so an ID always serves the same bytes and its ETag (the
+# hash of the markdown) never changes. Compressed copies are written once,
+# when the guide is stored: gzip always, brotli when the brotli package is
+# installed. Results expire RESULT_TTL_SECONDS after they were stored.
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+try:
+    import brotli  # Optional dependency: brotli-encoded results are offered only when installed
+except ImportError:
+    brotli = None
+
+logger = setup_logger(__name__)
+project_root = Path(__file__).resolve().parents[2]
+
+RESULT_DIR = project_root / "data" / "results"
+_RESULT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Most of the size reduction of the maximum levels for a fraction of their time
+_GZIP_LEVEL = 9
+_BROTLI_QUALITY = 9
+# Expired results are removed by save_result at most this often
+_PRUNE_INTERVAL_SECONDS = 300
+_last_prune = 0.0
+
+
+def _result_path(result_id: str, suffix: str) -> Path:
+    if not isinstance(result_id, str) or not _RESULT_ID_PATTERN.match(result_id):
+        raise ValueError(f"Invalid result ID: {result_id}")
+    return RESULT_DIR / f"{result_id}{suffix}"
+
+
+def _suffix(encoding):
+    return {None: ".md", "gzip": ".md.gz", "br": ".md.br"}[encoding]
+
+
+def _write_atomic(path, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=RESULT_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def result_id_for(inputs_key: str, markdown: str) -> str:
+    """Return the result ID of a guide: the hash of its inputs key and of its markdown."""
+    digest = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{inputs_key}:{digest}".encode("utf-8")).hexdigest()
+
+
+def save_result(inputs_key: str, markdown: str, sources: list) -> dict:
+    """
+    Store a generated guide's markdown and its compressed copies.
+
+    Args:
+        inputs_key: Hash of the canonical inputs and generation options
+        markdown: The study guide markdown
+        sources: The guide's sources, as described in the response
+
+    Returns:
+        dict: The result record ("result_id", "sha256", "bytes", "encodings"
+        with the size of each compressed copy, "sources", "created_at"); the
+        existing one if the same guide was already stored for these inputs
+    """
+    result_id = result_id_for(inputs_key, markdown)
+    meta_path = _result_path(result_id, ".json")
+    if meta_path.exists():
+        try:
+            return load_result(result_id)
+        except FileNotFoundError:
+            pass  # Expired: stored again below
+    RESULT_DIR.mkdir(parents=True, exist_ok=True)
+
+    body = markdown.encode("utf-8")
+    encoded = {"gzip": gzip.compress(body, compresslevel=_GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encoded = {"br": brotli.compress(body, quality=_BROTLI_QUALITY), **encoded}
+    _write_atomic(_result_path(result_id, _suffix(None)), body)
+    for encoding, data in encoded.items():
+        _write_atomic(_result_path(result_id, _suffix(encoding)), data)
+
+    record = {
+        "result_id": result_id,
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "bytes": len(body),
+        # Most preferred first
+        "encodings": {encoding: len(data) for encoding, data in encoded.items()},
+        "sources": sources,
+        "created_at": time.time(),
+    }
+    # Written last: a result without its record is never served
+    _write_atomic(meta_path, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    sizes = ", ".join(f"{encoding} {size}" for encoding, size in record["encodings"].items())
+    logger.info(f"Stored result {result_id[:16]}: {len(body)} bytes ({sizes})")
+    _prune_if_due(record["created_at"])
+    return record
+
+
+def load_result(result_id: str) -> dict:
+    """
+    Load a stored result's record.
+
+    Raises:
+        ValueError: If the result ID is malformed
+        FileNotFoundError: If no result with this ID is stored or it has expired
+    """
+    path = _result_path(result_id, ".json")
+    if not path.exists():
+        raise FileNotFoundError(f"Result not found: {result_id}")
+    with open(path, encoding="utf-8") as f:
+        record = json.load(f)
+    if _expired(record, time.time()):
+        raise FileNotFoundError(f"Result not found: {result_id}")
+    return record
+
+
+def read_result(result_id: str, encoding=None) -> bytes:
+    """Return a stored result's markdown, encoded with encoding ("br", "gzip" or None)."""
+    with open(_result_path(result_id, _suffix(encoding)), "rb") as f:
+        return f.read()
+
+
+def result_etag(record: dict, encoding=None) -> str:
+    """Return the strong ETag of a result's representation in encoding."""
+    return f'"{record["sha256"]}-{encoding}"' if encoding else f'"{record["sha256"]}"'
+
+
+def _expired(record, now):
+    ttl = get_settings().result_ttl_seconds
+    return bool(ttl) and record.get("created_at", 0) + ttl <= now
+
+
+def _prune_if_due(now):
+    global _last_prune
+    if now - _last_prune < _PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = now
+    prune_results(now)
+
+
+def prune_results(now=None):
+    """
+    Remove the results older than RESULT_TTL_SECONDS, with their compressed copies.
+
+    Returns:
+        int: The number of results removed
+    """
+    if not get_settings().result_ttl_seconds or not RESULT_DIR.exists():
+        return 0
+    now = time.time() if now is None else now
+    removed = 0
+    for meta_path in RESULT_DIR.glob("*.json"):
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not _expired(record, now):
+            continue
+        result_id = meta_path.name[:-len(".json")]
+        # The record goes first, so a half-removed result is never served
+        for suffix in (".json", _suffix(None), _suffix("gzip"), _suffix("br")):
+            try:
+                (RESULT_DIR / f"{result_id}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} expired results")
+    return removed
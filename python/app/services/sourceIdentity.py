@@ -0,0 +1,241 @@
+# Source identity service
+#
+# Every source gets a stable identity ("pdf:<sha256>", "url:<canonical url>",
+# "video:<video id>", "text:<hash>") that does not depend on how the user
+# wrote it. Identities are used to drop duplicate sources before anything is
+# fetched and as the keys of extraction caching and request coalescing.
+import hashlib
+import re
+from itertools import islice
+from json.encoder import encode_basestring
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Query parameters that identify the referrer or campaign, not the content
+TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "twclid", "ttclid", "li_fat_id",
+    "igshid", "igsh", "si", "ref_src", "ref_url", "spm",
+    "_ga", "_gl", "_hsenc", "_hsmi", "mkt_tok", "oly_anon_id", "oly_enc_id", "vero_id", "wickedid",
+})
+TRACKING_PREFIXES = ("utm_", "mc_", "pk_", "mtm_", "hsa_")
+
+_YOUTUBE_HOSTS = frozenset({
+    "youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com", "youtu.be",
+})
+_VIDEO_ID = re.compile(r"^[A-Za-z0-9_\-]{11}$")
+_VIDEO_PATH_PREFIXES = ("embed", "shorts", "live", "v", "e")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_WORD = re.compile(r"\S+")
+_WHITESPACE = re.compile(r"\s")
+# Characters of a text input processed at a time when hashing it
+_TEXT_SLICE = 1 << 20
+
+
+def clean_url(url: str) -> str:
+    """
+    Remove everything from a URL that does not change the page it points to.
+
+    Lowercases the scheme and host, drops default ports, the fragment,
+    tracking parameters and a trailing slash, and sorts the remaining query
+    parameters. The scheme is kept, so the result is safe to fetch.
+
+    Returns:
+        str: The cleaned URL, or the stripped input if it cannot be parsed
+    """
+    if not url or not isinstance(url, str):
+        return ""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if port and port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    path = parts.path.rstrip("/") if parts.path != "/" else ""
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def canonical_url(url: str) -> str:
+    """
+    Return the identity form of a URL: clean_url() with https and without "www.".
+
+    Only used for comparing URLs; fetch clean_url() instead, since a site
+    may not serve https.
+    """
+    cleaned = clean_url(url)
+    parts = urlsplit(cleaned)
+    if parts.scheme not in ("http", "https"):
+        return cleaned
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return urlunsplit(("https", host, parts.path, parts.query, ""))
+
+
+def youtube_video_id(url: str) -> str:
+    """
+    Return the video ID of a YouTube video URL, or "" for any other URL.
+
+    Handles watch, youtu.be, embed, shorts and live links on youtube.com,
+    m.youtube.com, music.youtube.com and youtube-nocookie.com.
+    """
+    if not url or not isinstance(url, str):
+        return ""
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return ""
+    host = (parts.hostname or "").removeprefix("www.")
+    if host not in _YOUTUBE_HOSTS:
+        return ""
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if host == "youtu.be":
+        candidate = segments[0] if segments else ""
+    elif segments[:1] == ["watch"]:
+        candidate = dict(parse_qsl(parts.query)).get("v", "")
+    elif len(segments) >= 2 and segments[0] in _VIDEO_PATH_PREFIXES:
+        candidate = segments[1]
+    else:
+        candidate = ""
+    return candidate if _VIDEO_ID.match(candidate) else ""
+
+
+def video_url(video_id: str) -> str:
+    """Return the canonical watch URL of a YouTube video."""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def _collapsed_pieces(text):
+    """
+    Yield the pieces of " ".join(text.split()) a slice of text at a time,
+    without building the word list or the joined string.
+    """
+    start, length, first = 0, len(text), True
+    while start < length:
+        # Cut slices at whitespace so no word is split between two of them
+        cut = _WHITESPACE.search(text, min(length, start + _TEXT_SLICE))
+        end = cut.start() if cut else length
+        words = text[start:end].split()
+        if words:
+            if not first:
+                yield " "
+            yield " ".join(words)
+            first = False
+        start = end + 1 if cut else end
+
+
+def text_source_id(text: str) -> str:
+    """
+    Identity of a text input; whitespace differences do not matter.
+
+    Equal to the canonical_hash() of the whitespace-collapsed text, computed
+    a slice at a time since text inputs can be large.
+    """
+    digest = hashlib.sha256(b'"')
+    for piece in _collapsed_pieces(text):
+        digest.update(encode_basestring(piece)[1:-1].encode("utf-8"))
+    digest.update(b'"')
+    return f"text:{digest.hexdigest()[:32]}"
+
+
+def text_label(text: str) -> str:
+    """Label of a text input: its first 60 characters with whitespace collapsed."""
+    return " ".join(match.group() for match in islice(_WORD.finditer(text), 60))[:60]
+
+
+def resolve_sources(pdf_files, urls, videos, text_inputs):
+    """
+    Assign every source its identity and drop duplicates, before any fetch.
+
+    YouTube video links given as URLs are treated as videos. URLs and videos
+    are rewritten to the form that is fetched: clean_url() for pages and the
+    canonical watch URL for videos. Invalid entries (not strings, or without
+    a video ID) are kept so extraction reports them as failed.
+
+    Args:
+        pdf_files: Spooled PDFs with "filename" and "sha256"
+        urls: Web page URLs
+        videos: YouTube video URLs
+        text_inputs: Raw text inputs
+
+    Returns:
+        dict: "pdfs", "urls", "videos" and "text" lists with duplicates
+        removed, "ids" with the identity of every remaining source in order,
+        "duplicates" with the inputs that were dropped and "unresolved" with
+        the invalid entries that were kept
+    """
+    seen = set()
+    resolved = {"pdfs": [], "urls": [], "videos": [], "text": [], "ids": [], "duplicates": [], "unresolved": []}
+
+    def keep_unresolved(kind, value):
+        resolved[kind].append(value)
+        resolved["unresolved"].append(value)
+
+    def add(kind, source_id, value, label):
+        if source_id in seen:
+            logger.info(f"Dropping duplicate source {label} ({source_id})")
+            resolved["duplicates"].append(label)
+            return
+        seen.add(source_id)
+        resolved[kind].append(value)
+        resolved["ids"].append(source_id)
+
+    for pdf in pdf_files:
+        add("pdfs", f"pdf:{pdf['sha256']}", pdf, pdf["filename"])
+
+    for url in urls:
+        if not isinstance(url, str) or not url.strip():
+            keep_unresolved("urls", url)
+            continue
+        video_id = youtube_video_id(url)
+        if video_id:
+            logger.info(f"Treating YouTube link given as a URL as a video: {url}")
+            add("videos", f"video:{video_id}", video_url(video_id), url)
+        else:
+            add("urls", f"url:{canonical_url(url)}", clean_url(url), url)
+
+    for url in videos:
+        video_id = youtube_video_id(url) if isinstance(url, str) else ""
+        if not video_id:
+            keep_unresolved("videos", url)
+            continue
+        add("videos", f"video:{video_id}", video_url(video_id), url)
+
+    for text in text_inputs:
+        if not isinstance(text, str) or not text.strip():
+            keep_unresolved("text", text)
+            continue
+        add("text", text_source_id(text), text, text_label(text))
+
+    return resolved
+
+
+def source_id(kind, value):
+    """
+    Return the identity of one source.
+
+    Args:
+        kind: "pdf" (value is the spooled file dict), "url", "video" or "text"
+        value: The source as given
+
+    Returns:
+        str: The source identity
+    """
+    if kind == "pdf":
+        return f"pdf:{value['sha256']}"
+    if kind == "text":
+        return text_source_id(value)
+    if kind == "video":
+        video_id = youtube_video_id(value)
+        return f"video:{video_id}" if video_id else f"video:{canonical_url(value)}"
+    return f"url:{canonical_url(value)}"
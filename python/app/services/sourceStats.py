@@ -0,0 +1,123 @@
+# Source access statistics
+#
+# With SOURCE_ACCESS_STATS set, every web article and YouTube video a request
+# asks for is counted under its canonical source ID, in an SQLite database
+# (WAL mode) shared by the API processes of one host. The most requested
+# sources are what cache warming (cacheWarming) prepares by default. Uploaded
+# PDFs and text inputs are not counted: they are not kept, so they could not
+# be extracted again ahead of a request.
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from app.config import get_settings
+from app.services.sourceIdentity import source_id
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Kinds of sources that can be fetched again from what is recorded
+COUNTED_KINDS = ("url", "video")
+
+
+class SourceAccessStats:
+    """Per-source request counts in an SQLite database."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS access (id TEXT PRIMARY KEY, kind TEXT NOT NULL, target TEXT NOT NULL, "
+                "count INTEGER NOT NULL, first_seen REAL NOT NULL, last_seen REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS access_count ON access (count)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def record(self, urls=(), videos=()):
+        """
+        Count one request for each of the given sources.
+
+        Args:
+            urls: Web page URLs, as resolved by resolve_sources()
+            videos: YouTube video URLs, as resolved by resolve_sources()
+        """
+        now = time.time()
+        rows = [
+            (source_id(kind, target), kind, target, now, now)
+            for kind, targets in (("url", urls), ("video", videos))
+            for target in targets
+            if isinstance(target, str) and target.strip()
+        ]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO access (id, kind, target, count, first_seen, last_seen) VALUES (?, ?, ?, 1, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET count = count + 1, target = excluded.target, "
+                    "last_seen = excluded.last_seen",
+                    rows
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def top(self, limit, since=None):
+        """
+        Return the most requested sources.
+
+        Args:
+            limit: Number of sources to return
+            since: Optional timestamp; only sources requested since then are returned
+
+        Returns:
+            list: {"id", "kind", "target", "count", "last_seen"} dicts, most requested first
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, kind, target, count, last_seen FROM access WHERE last_seen >= ? "
+                "ORDER BY count DESC, last_seen DESC LIMIT ?",
+                (since or 0, limit)
+            ).fetchall()
+        return [
+            {"id": sid, "kind": kind, "target": target, "count": count, "last_seen": last_seen}
+            for sid, kind, target, count, last_seen in rows
+        ]
+
+
+_stats = None
+_stats_lock = threading.Lock()
+
+
+def get_source_stats():
+    """Return the process-wide access stats, or None if SOURCE_ACCESS_STATS is off."""
+    global _stats
+    settings = get_settings()
+    if not settings.source_access_stats:
+        return None
+    with _stats_lock:
+        if _stats is None:
+            _stats = SourceAccessStats(settings.source_access_stats_path)
+        return _stats
+
+
+def set_source_stats(stats):
+    """Replace the process-wide access stats (used by tests and tools)."""
+    global _stats
+    _stats = stats
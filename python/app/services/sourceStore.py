@@ -0,0 +1,98 @@
+# Source document store
+#
+# Holds the extracted text of every source of one request exactly once.
+# Pipeline stages are handed the documents themselves rather than copies of
+# their text, and replace a document's text in place, so each previous
+# version can be freed as soon as the stage is done with it instead of once
+# the whole stage has finished.
+from app.utils.helpers import text_digest
+from app.utils.logger import setup_logger
+from app.utils.memory import current_budget, text_bytes
+
+logger = setup_logger(__name__)
+
+
+class SourceDocument:
+    """
+    One extracted source: its identity, label and current text, plus what
+    the stages learned about it ("page_map" and "tokens").
+    """
+
+    __slots__ = ("id", "kind", "label", "text", "page_map", "tokens", "_digest")
+
+    def __init__(self, source_id, kind, label, text):
+        self.id = source_id
+        self.kind = kind
+        self.label = label
+        self.text = text
+        self.page_map = []
+        self.tokens = {}
+        self._digest = None
+
+    @property
+    def digest(self):
+        """SHA-256 of the current text, computed once per version of it."""
+        if self._digest is None:
+            self._digest = text_digest(self.text)
+        return self._digest
+
+
+class SourceStore:
+    """
+    The source documents of one request, in order.
+
+    Texts are charged to the MemoryBudget that is current when the store is
+    created, if any: add() truncates a text to what fits, set_text() accounts
+    the replacement and remove() and discard_texts() release it.
+    """
+
+    def __init__(self):
+        self._documents = []
+        self._budget = current_budget()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __iter__(self):
+        # Iterate over a snapshot, so stages may remove documents as they go
+        return iter(list(self._documents))
+
+    def add(self, source_id, kind, label, text):
+        """
+        Add a source document.
+
+        Returns:
+            SourceDocument: The document, whose text may have been truncated
+            to fit the memory budget, or None if none of the text fits
+        """
+        if self._budget is not None:
+            text = self._budget.fit(text, label)
+        if not text:
+            return None
+        document = SourceDocument(source_id, kind, label, text)
+        self._documents.append(document)
+        return document
+
+    def set_text(self, document, text):
+        """Replace a document's text, releasing the previous version."""
+        if self._budget is not None:
+            self._budget.replace(document.text, text, document.label)
+        document.text = text
+        document._digest = None
+
+    def remove(self, document):
+        """Drop a document and release its text."""
+        self._documents.remove(document)
+        if self._budget is not None:
+            self._budget.release(text_bytes(document.text))
+
+    def discard_texts(self):
+        """Release every text once no stage needs it anymore; identities and metadata are kept."""
+        for document in self._documents:
+            if self._budget is not None:
+                self._budget.release(text_bytes(document.text))
+            document.text = ""
+
+    def total_chars(self):
+        """Total length of the documents' texts."""
+        return sum(len(document.text) for document in self._documents)
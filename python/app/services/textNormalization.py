@@ -0,0 +1,210 @@
+# Text normalization service
+#
+# Extracted text is sent to Gemini as-is, so anything that is not content
+# costs tokens: the page banners added by extract_pdf_text, running headers
+# and footers repeated on every page, page numbers, words split by
+# hyphenated line breaks and whitespace runs. This stage removes them while
+# keeping a map from the normalized text back to the original pages.
+# Pasted text and transcripts are not layout output: they only lose trailing
+# whitespace and blank line runs, so indented code keeps its shape.
+import re
+from collections import Counter
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Page banner written by extract_pdf_text: a rule of "=", "Page N", a rule of "="
+_PAGE_BANNER = re.compile(r"\n={60}\nPage (\d+)\n={60}\n\n")
+
+# A running header or footer line must repeat on at least this share of pages
+_REPEATED_LINE_SHARE = 0.5
+_MIN_PAGES_FOR_REPEATS = 3
+# Lines at each end of a page that are checked for headers and footers
+_EDGE_LINES = 3
+
+_PAGE_NUMBER_LINE = re.compile(r"^(page\s*)?[-–—(\[]?\s*\d{1,4}\s*[-–—)\]]?(\s*(of|/)\s*\d{1,4})?$", re.IGNORECASE)
+_DECORATIVE_LINE = re.compile(r"^[\W_]{3,}$")
+_HYPHENATED_BREAK = re.compile(r"(\w)-\n[ \t]*([a-z])")
+_TRANSCRIPT_MARKER = re.compile(r"\[(music|applause|laughter|inaudible|silence|cheering)\]", re.IGNORECASE)
+# Source kinds whose text comes from page layout (PDF pages, web page extraction)
+_LAYOUT_KINDS = ("pdf", "url")
+_TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]{1,4}")
+# Above this length pieces are counted one by one instead of listed, as the
+# list would take many times the memory of the text itself
+_COUNT_PIECES_FROM = 65536
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of LLM tokens in text.
+
+    Counts pieces of up to four word or punctuation characters, which is
+    close to how subword tokenizers split English text.
+    """
+    if len(text) < _COUNT_PIECES_FROM:
+        return len(_TOKEN_PIECE.findall(text))
+    return sum(1 for _ in _TOKEN_PIECE.finditer(text))
+
+
+def truncate_to_tokens(text, tokens):
+    """Return the start of text that estimate_tokens() counts as at most tokens."""
+    for count, piece in enumerate(_TOKEN_PIECE.finditer(text), 1):
+        if count == tokens:
+            return text[:piece.end()]
+    return text if tokens > 0 else ""
+
+
+def split_pdf_pages(text):
+    """
+    Split text produced by extract_pdf_text into its pages.
+
+    Returns:
+        list: (page_number, page_text) tuples; a single (None, text) tuple if
+        the text has no page banners
+    """
+    return list(_iter_pdf_pages(text))
+
+
+def _iter_pdf_pages(text):
+    """Yield the (page_number, page_text) tuples of split_pdf_pages() one at a time."""
+    # Text before the first banner belongs to no page and is dropped
+    banner = None
+    for match in _PAGE_BANNER.finditer(text):
+        if banner is not None:
+            yield int(banner.group(1)), text[banner.end():match.start()]
+        banner = match
+    if banner is None:
+        yield None, text
+    else:
+        yield int(banner.group(1)), text[banner.end():]
+
+
+def _edge_key(line):
+    """Normalize a line for header/footer matching; digits vary (page numbers, dates)."""
+    return re.sub(r"\d+", "#", " ".join(line.split()).casefold())
+
+
+def _find_repeated_edges(pages):
+    """
+    Return the normalized header and footer lines that repeat across pages.
+
+    pages is an iterable of page texts, read once.
+    """
+    headers = Counter()
+    footers = Counter()
+    page_count = 0
+    for page_text in pages:
+        page_count += 1
+        content = [line for line in page_text.split("\n") if line.strip()]
+        headers.update({_edge_key(line) for line in content[:_EDGE_LINES]})
+        footers.update({_edge_key(line) for line in content[-_EDGE_LINES:]})
+    if page_count < _MIN_PAGES_FOR_REPEATS:
+        return set(), set()
+    threshold = max(_MIN_PAGES_FOR_REPEATS, int(page_count * _REPEATED_LINE_SHARE))
+    return (
+        {key for key, count in headers.items() if count >= threshold},
+        {key for key, count in footers.items() if count >= threshold},
+    )
+
+
+def _strip_edges(lines, headers, footers):
+    """Drop running headers, footers and page numbers from the ends of a page."""
+    def is_boilerplate(line, repeated):
+        stripped = line.strip()
+        return not stripped or _PAGE_NUMBER_LINE.match(stripped) or _edge_key(line) in repeated
+
+    start, checked = 0, 0
+    while start < len(lines) and checked < _EDGE_LINES and is_boilerplate(lines[start], headers):
+        checked += bool(lines[start].strip())
+        start += 1
+    end, checked = len(lines), 0
+    while end > start and checked < _EDGE_LINES and is_boilerplate(lines[end - 1], footers):
+        checked += bool(lines[end - 1].strip())
+        end -= 1
+    return lines[start:end]
+
+
+def _clean_block(text):
+    """Rejoin hyphenated words and collapse whitespace and decorative lines."""
+    text = _HYPHENATED_BREAK.sub(r"\1\2", text)
+    lines = []
+    for line in text.split("\n"):
+        line = " ".join(line.split())
+        if _DECORATIVE_LINE.match(line):
+            continue
+        lines.append(line)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _trim_block(text):
+    """Drop trailing whitespace and collapse blank line runs, keeping indentation."""
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip("\n")
+
+
+def normalize_text(text, kind="text"):
+    """
+    Normalize extracted text to reduce the tokens it costs as LLM input.
+
+    PDF text loses its page banners, running headers/footers (lines repeated
+    at the top or bottom of at least half the pages) and page numbers.
+    Transcripts lose [Music]-style markers. PDF and web article text has
+    hyphenated line breaks rejoined and whitespace and decorative rule lines
+    collapsed; other text, such as pasted code, keeps its lines and
+    indentation and only loses trailing whitespace and blank line runs.
+
+    Args:
+        text: Extracted text of one source
+        kind: Source kind ("pdf", "url", "video" or "text")
+
+    Returns:
+        dict: The normalized "text", a "page_map" of {"page", "start", "end"}
+        character ranges in the normalized text (PDFs only), and "tokens_before"
+        and "tokens_after" estimates
+    """
+    tokens_before = estimate_tokens(text)
+    page_map = []
+
+    if kind == "pdf":
+        # Pages are sliced out of the text one at a time, in two passes, so
+        # only the cleaned blocks are held besides the text
+        headers, footers = _find_repeated_edges(page_text for _, page_text in _iter_pdf_pages(text))
+        if headers or footers:
+            logger.debug(f"Removing {len(headers)} running headers and {len(footers)} footers")
+        blocks = []
+        offset = 0
+        for page_number, page_text in _iter_pdf_pages(text):
+            lines = page_text.split("\n")
+            block = _clean_block("\n".join(_strip_edges(lines, headers, footers)))
+            if not block:
+                continue
+            if blocks:
+                offset += 2  # the "\n\n" joining pages
+            if page_number is not None:
+                page_map.append({"page": page_number, "start": offset, "end": offset + len(block)})
+            blocks.append(block)
+            offset += len(block)
+        normalized = "\n\n".join(blocks)
+    elif kind in _LAYOUT_KINDS:
+        normalized = _clean_block(text)
+    else:
+        if kind == "video":
+            # Transcripts are runs of words: close the gaps markers leave
+            text = "\n".join(" ".join(line.split()) for line in _TRANSCRIPT_MARKER.sub("", text).split("\n"))
+        normalized = _trim_block(text)
+
+    tokens_after = estimate_tokens(normalized)
+    return {
+        "text": normalized,
+        "page_map": page_map,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after
+    }
+
+
+def page_for_offset(page_map, offset):
+    """Return the page number containing a character offset of normalized text, or None."""
+    for entry in page_map:
+        if entry["start"] <= offset < entry["end"]:
+            return entry["page"]
+    return None
@@ -0,0 +1,111 @@
+# Upload ingestion service
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+project_root = Path(__file__).resolve().parents[2]
+
+UPLOAD_DIR = project_root / "uploads"
+CHUNK_SIZE = 1024 * 1024  # 1 MB per read
+
+
+class UploadLimitError(ValueError):
+    """Raised when an upload exceeds the per-file or per-request byte limit."""
+
+
+async def spool_uploads(uploads, request_id, max_file_bytes=None, max_request_bytes=None):
+    """
+    Copy uploaded files to a per-request spool directory.
+
+    This is a spool copy, not streaming ingestion: the multipart parser has
+    already read the request body into its own temporary files by the time
+    the route runs. Each upload is copied from there in fixed-size chunks,
+    hashed on the fly and checked against the byte limits while it is being
+    read, so no whole file is held in memory and the copy stops at the first
+    byte over a limit. Files whose content was already seen in this request
+    are dropped. The spool directory is only created for the first upload.
+
+    Args:
+        uploads: List of UploadFile objects
+        request_id: Request ID used to name the spool directory
+        max_file_bytes: Per-file limit (default: MAX_PDF_UPLOAD_MB)
+        max_request_bytes: Limit for all files together (default: MAX_REQUEST_UPLOAD_MB)
+
+    Returns:
+        tuple: (spool directory path, or None without uploads, list of dicts
+        with filename, path, sha256 and size)
+
+    Raises:
+        UploadLimitError: If a limit is exceeded (the spool directory is removed)
+    """
+    max_file_bytes = max_file_bytes or get_settings().max_pdf_bytes
+    max_request_bytes = max_request_bytes or get_settings().max_request_bytes
+
+    spool_dir = None
+    spooled = []
+    seen_hashes = {}
+    total_bytes = 0
+
+    try:
+        for upload in uploads:
+            filename = getattr(upload, "filename", None) or "unknown"
+
+            # Reject early when the multipart parser already knows the size
+            known_size = getattr(upload, "size", None)
+            if known_size is not None and known_size > max_file_bytes:
+                raise UploadLimitError(f"File {filename} is {known_size} bytes, exceeding the {max_file_bytes} byte limit per file")
+
+            if spool_dir is None:
+                UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+                spool_dir = Path(tempfile.mkdtemp(prefix=f"{request_id}-", dir=UPLOAD_DIR))
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=spool_dir)
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_file_bytes:
+                        raise UploadLimitError(f"File {filename} exceeds the {max_file_bytes} byte limit per file")
+                    if total_bytes + size > max_request_bytes:
+                        raise UploadLimitError(f"Uploaded files exceed the {max_request_bytes} byte limit per request")
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            sha256 = digest.hexdigest()
+            if sha256 in seen_hashes:
+                os.remove(tmp_path)
+                logger.warning(f"[Request {request_id}] Skipping duplicate upload {filename} (same content as {seen_hashes[sha256]})")
+                continue
+
+            path = spool_dir / f"{sha256}.pdf"
+            os.replace(tmp_path, path)
+            seen_hashes[sha256] = filename
+            total_bytes += size
+            spooled.append({
+                "filename": filename,
+                "path": str(path),
+                "sha256": sha256,
+                "size": size
+            })
+            logger.info(f"[Request {request_id}] Spooled {filename} ({size} bytes, sha256 {sha256[:12]})")
+    except BaseException:
+        remove_spool(spool_dir)
+        raise
+
+    return spool_dir, spooled
+
+
+def remove_spool(spool_dir):
+    """Delete a spool directory created by spool_uploads (None is ignored)."""
+    if spool_dir is None:
+        return
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    logger.debug(f"Removed upload spool directory: {spool_dir}")
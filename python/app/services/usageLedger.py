@@ -0,0 +1,270 @@
+# Per-tenant usage ledger and budgets
+#
+# Requests, Gemini calls, retries, input and output tokens and the wall time
+# of every pipeline stage are added up per tenant and budget window (a day
+# by default), in an SQLite database (WAL mode) shared by the API processes
+# of one host. A tenant is the user's own API key or, on our shared
+# GEMINI_API_KEY, the client address (see routes._tenant).
+#
+# Budgets cap what one tenant may use of the shared key per window, so one
+# heavy user cannot exhaust its quota for everyone: the request budget is
+# checked and counted when a request is admitted, the token budget again
+# with the request's estimated input before its Gemini stages start. Tokens
+# are recorded when requests finish, so concurrent requests of one tenant
+# can overrun the token budget by what they have in flight.
+#
+# Identical requests coalesced on one pipeline run are each charged the
+# run's full Gemini calls and tokens, whoever started it: riding along on
+# another tenant's run costs the same as running it, so it cannot be used
+# to get around a budget. Summed over tenants, the ledger can therefore
+# exceed what the key actually consumed. Calls answered from the LLM result
+# cache cost nothing, and stage wall time is charged to the request that
+# ran the stages.
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_COUNTERS = ("requests", "rejected", "calls", "retries", "input_tokens", "output_tokens", "gemini_seconds")
+
+
+class BudgetExceededError(ValueError):
+    """Raised instead of starting work a tenant has no budget left for."""
+
+    def __init__(self, tenant, what, used, limit, retry_after):
+        self.tenant = tenant
+        self.what = what
+        self.retry_after = retry_after
+        super().__init__(
+            f"Usage budget of {limit} {what} per window used up ({used} used); "
+            f"try again in {max(1, round(retry_after))} seconds or provide your own API key."
+        )
+
+
+def tenant_budget(tenant, shared_key):
+    """
+    Return the budget that applies to a tenant.
+
+    Budgets set for the tenant in USAGE_BUDGETS take precedence; otherwise
+    tenants on the shared key get USAGE_REQUEST_BUDGET and USAGE_TOKEN_BUDGET
+    and tenants with their own key are not limited.
+
+    Returns:
+        dict: {"requests", "tokens"} limits per window (0 is unlimited), or
+        None if the tenant is not limited
+    """
+    settings = get_settings()
+    budget = settings.usage_budgets.get(tenant)
+    if budget is None:
+        if not shared_key:
+            return None
+        budget = {"requests": settings.usage_request_budget, "tokens": settings.usage_token_budget}
+    budget = {"requests": int(budget.get("requests") or 0), "tokens": int(budget.get("tokens") or 0)}
+    return budget if budget["requests"] or budget["tokens"] else None
+
+
+class UsageLedger:
+    """Per-tenant usage per budget window in an SQLite database."""
+
+    def __init__(self, path, window_seconds=86400):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage (tenant TEXT NOT NULL, window_start INTEGER NOT NULL, "
+                "requests INTEGER NOT NULL DEFAULT 0, rejected INTEGER NOT NULL DEFAULT 0, "
+                "calls INTEGER NOT NULL DEFAULT 0, retries INTEGER NOT NULL DEFAULT 0, "
+                "input_tokens INTEGER NOT NULL DEFAULT 0, output_tokens INTEGER NOT NULL DEFAULT 0, "
+                "gemini_seconds REAL NOT NULL DEFAULT 0, PRIMARY KEY (tenant, window_start))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_stages (tenant TEXT NOT NULL, window_start INTEGER NOT NULL, "
+                "stage TEXT NOT NULL, seconds REAL NOT NULL, PRIMARY KEY (tenant, window_start, stage))"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _window(self, now):
+        window_start = int(now // self.window_seconds * self.window_seconds)
+        return window_start, window_start + self.window_seconds - now
+
+    def _transaction(self, work):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _used(conn, tenant, window_start):
+        row = conn.execute(
+            "SELECT requests, input_tokens + output_tokens FROM usage WHERE tenant = ? AND window_start = ?",
+            (tenant, window_start)
+        ).fetchone()
+        return row or (0, 0)
+
+    @staticmethod
+    def _add(conn, tenant, window_start, **counts):
+        columns = ", ".join(counts)
+        updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in counts)
+        conn.execute(
+            f"INSERT INTO usage (tenant, window_start, {columns}) VALUES (?, ?{', ?' * len(counts)}) "
+            f"ON CONFLICT(tenant, window_start) DO UPDATE SET {updates}",
+            (tenant, window_start, *counts.values())
+        )
+
+    def admit(self, tenant, budget=None, now=None):
+        """
+        Count a new request of tenant, unless its budget is used up.
+
+        The check and the count are one transaction, so concurrent requests
+        cannot overrun the request budget.
+
+        Args:
+            tenant: The tenant making the request
+            budget: {"requests", "tokens"} limits from tenant_budget(), or None
+            now: Optional timestamp (defaults to the current time)
+
+        Raises:
+            BudgetExceededError: If the tenant has used up its requests or tokens
+                in the current window (the request is counted as rejected)
+        """
+        window_start, retry_after = self._window(time.time() if now is None else now)
+
+        def admit_request(conn):
+            requests, tokens = self._used(conn, tenant, window_start)
+            error = None
+            if budget and budget["requests"] and requests >= budget["requests"]:
+                error = BudgetExceededError(tenant, "requests", requests, budget["requests"], retry_after)
+            elif budget and budget["tokens"] and tokens >= budget["tokens"]:
+                error = BudgetExceededError(tenant, "tokens", tokens, budget["tokens"], retry_after)
+            self._add(conn, tenant, window_start, **({"rejected": 1} if error else {"requests": 1}))
+            return error
+
+        error = self._transaction(admit_request)
+        if error is not None:
+            raise error
+
+    def check_tokens(self, tenant, budget, estimated_tokens, now=None):
+        """
+        Raise BudgetExceededError if tenant cannot afford estimated_tokens more.
+
+        Args:
+            tenant: The tenant making the request
+            budget: {"requests", "tokens"} limits from tenant_budget(), or None
+            estimated_tokens: Input tokens the request is about to send to Gemini
+            now: Optional timestamp (defaults to the current time)
+        """
+        if not budget or not budget["tokens"]:
+            return
+        window_start, retry_after = self._window(time.time() if now is None else now)
+        with self._lock:
+            _, tokens = self._used(self._connection(), tenant, window_start)
+        if tokens + estimated_tokens > budget["tokens"]:
+            raise BudgetExceededError(tenant, "tokens", tokens + estimated_tokens, budget["tokens"], retry_after)
+
+    def record(self, usage, now=None):
+        """
+        Add a finished request's Gemini calls, tokens and stage times to its tenant.
+
+        Args:
+            usage: The request's Usage record
+            now: Optional timestamp (defaults to the current time)
+        """
+        window_start, _ = self._window(time.time() if now is None else now)
+        summary = usage.summary()
+
+        def add_usage(conn):
+            self._add(
+                conn, usage.tenant, window_start,
+                **{name: summary[name] for name in _COUNTERS[2:]}
+            )
+            conn.executemany(
+                "INSERT INTO usage_stages (tenant, window_start, stage, seconds) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(tenant, window_start, stage) DO UPDATE SET seconds = seconds + excluded.seconds",
+                [(usage.tenant, window_start, name, seconds) for name, seconds in summary["stage_seconds"].items()]
+            )
+
+        self._transaction(add_usage)
+
+    def report(self, tenant=None, now=None):
+        """
+        Return every tenant's usage in the current window.
+
+        Args:
+            tenant: Optional tenant to report on alone
+            now: Optional timestamp (defaults to the current time)
+
+        Returns:
+            list: One dict per tenant with the counters, "tokens" and
+            "stage_seconds", heaviest token users first
+        """
+        window_start, _ = self._window(time.time() if now is None else now)
+        condition, params = ("AND tenant = ?", (window_start, tenant)) if tenant else ("", (window_start,))
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                f"SELECT tenant, {', '.join(_COUNTERS)} FROM usage WHERE window_start = ? {condition}", params
+            ).fetchall()
+            stages = conn.execute(
+                f"SELECT tenant, stage, seconds FROM usage_stages WHERE window_start = ? {condition}", params
+            ).fetchall()
+        report = {
+            row[0]: {"tenant": row[0], **dict(zip(_COUNTERS, row[1:])), "stage_seconds": {}}
+            for row in rows
+        }
+        for name, stage, seconds in stages:
+            if name in report:
+                report[name]["stage_seconds"][stage] = round(seconds, 3)
+        for entry in report.values():
+            entry["tokens"] = entry["input_tokens"] + entry["output_tokens"]
+            entry["gemini_seconds"] = round(entry["gemini_seconds"], 3)
+        return sorted(report.values(), key=lambda entry: (-entry["tokens"], -entry["requests"], entry["tenant"]))
+
+    def window_start(self, now=None):
+        """Return the start timestamp of the current budget window."""
+        return self._window(time.time() if now is None else now)[0]
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """Return the process-wide usage ledger, or None if usage accounting is off."""
+    global _ledger
+    settings = get_settings()
+    budgets = settings.usage_request_budget or settings.usage_token_budget or settings.usage_budgets
+    if not settings.usage_ledger and not budgets:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger(settings.usage_ledger_path, settings.usage_window_seconds)
+        return _ledger
+
+
+def set_usage_ledger(ledger):
+    """Replace the process-wide usage ledger (used by tests and tools)."""
+    global _ledger
+    _ledger = ledger
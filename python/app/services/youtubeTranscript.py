@@ -1,12 +1,8 @@
 import re
-import youtube_transcript_api as yta
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api._errors import (
-    TranscriptsDisabled, 
-    NoTranscriptFound, 
-    VideoUnavailable
-)
 from app.utils.logger import setup_logger
+from app.utils.cancellation import WorkCancelled
+from app.utils.deadline import DeadlineExceeded, check_deadline
+from app.utils.circuit_breaker import CircuitOpenError, get_breaker
 
 logger = setup_logger(__name__)
 
@@ -72,6 +68,9 @@ def get_youtube_transcript(
     Returns:
         str: Formatted transcript text
     """
+    import youtube_transcript_api as yta  # Imported on first use to keep application start-up fast
+    import youtube_transcript_api._errors
+
     logger.info(f"Starting YouTube transcript extraction for URL: {url}")
     
     if not url or not isinstance(url, str):
@@ -85,7 +84,11 @@ def get_youtube_transcript(
 
     logger.info(f"Processing YouTube video ID: {video_id}")
     
+    breaker = get_breaker("youtube")
+    # Before the breaker admits the call: running out of time says nothing about YouTube
+    check_deadline(f"fetching the transcript of {video_id}")
     try:
+        breaker.allow()
         logger.debug(f"Fetching transcript listings for video ID: {video_id}")
         ytt_api = yta.YouTubeTranscriptApi()
         listings = ytt_api.list(video_id)
@@ -113,12 +116,14 @@ def get_youtube_transcript(
 
         # Fetch the actual transcript
         logger.debug(f"Fetching transcript data for video {video_id}")
+        check_deadline(f"downloading the transcript of {video_id}")
         transcript = transcript_obj.fetch()
         
         if not transcript:
             logger.error(f"Transcript fetch returned empty data for video {video_id}")
             raise ValueError("Transcript data is empty")
         
+        breaker.record_success()
         logger.info(f"Successfully fetched transcript with {len(transcript)} entries for video {video_id}")
 
         # Format transcript
@@ -147,18 +152,34 @@ def get_youtube_transcript(
         logger.info(f"Successfully extracted {transcript_length} characters from YouTube video {video_id}")
         return formatted_transcript
     
+    except CircuitOpenError:
+        raise
+    except (DeadlineExceeded, WorkCancelled):
+        # DeadlineExceeded is a TimeoutError, an OSError: it must not count as a YouTube failure
+        breaker.release()
+        raise
+    except (yta._errors.RequestBlocked, yta._errors.YouTubeRequestFailed, OSError) as e:
+        # Throttling and network errors count against the YouTube circuit
+        breaker.record_failure()
+        logger.error(f"YouTube request failed for video {video_id}: {str(e)}")
+        raise ValueError(f"Failed to fetch transcript: YouTube request failed or was blocked.")
     except yta._errors.TranscriptsDisabled:
+        breaker.record_success()
         logger.error(f"Transcripts are disabled for video {video_id}")
         raise ValueError(f"Transcripts are disabled for this video.")
     except yta._errors.NoTranscriptFound:
+        breaker.record_success()
         logger.error(f"No transcript found for video {video_id}")
         raise ValueError(f"No transcript available for this video.")
     except yta._errors.VideoUnavailable:
+        breaker.record_success()
         logger.error(f"Video {video_id} is unavailable")
         raise ValueError(f"This video is unavailable. It may be private, deleted, or restricted.")
     except ValueError:
         # Re-raise ValueError as-is (already logged)
+        breaker.release()
         raise
     except Exception as e:
+        breaker.release()
         logger.error(f"Unexpected error fetching transcript for video {video_id}: {str(e)}", exc_info=True)
         raise ValueError(f"Failed to fetch transcript: {str(e)}")
\ No newline at end of file
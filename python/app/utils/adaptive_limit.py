@@ -0,0 +1,125 @@
+# Adaptive concurrency limit
+#
+# How many Gemini calls a worker can have in flight before the service starts
+# answering 429 or slowing down depends on the quota left and on the load of
+# the moment, so a fixed number is either too cautious or too aggressive.
+# The limit here is found by AIMD instead: it grows by one for every limit's
+# worth of calls that complete at the usual latency, and is cut by a factor
+# when the service pushes back, settling just below the point where it does.
+import threading
+from app.utils import metrics
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AdaptiveLimit:
+    """
+    AIMD limit on the number of calls in flight.
+
+    Completed calls report their latency and whether the service was
+    overloaded (a 429 or a timeout). A 429 multiplies the limit by backoff;
+    recent latency above latency_tolerance times the usual latency of the
+    same kind of call multiplies it by latency_backoff. Calls that started
+    before the last decrease cannot cause another one, so a burst of failures
+    from one overload is only counted once. Otherwise the limit grows by
+    1/limit per call, but only while at least half of it is in use, so it
+    does not drift up while the worker is idle.
+
+    Recent and usual latency are moving averages, the usual one rising only
+    with calls made at the minimum limit. Queuing that builds up as the limit
+    grows therefore still shows as a slowdown, while a service that became
+    slower for good is relearned once the limit has been cut to the minimum.
+
+    Args:
+        initial: Starting limit
+        minimum: Lowest limit
+        maximum: Highest limit
+        latency_tolerance: Latency, as a multiple of the usual, that counts as a spike
+        backoff: Factor applied to the limit on a 429
+        latency_backoff: Factor applied to the limit on a latency spike
+    """
+
+    # Weight of a new sample in the recent latency, and of the recent latency in the usual
+    _RECENT_SMOOTHING = 0.2
+    _USUAL_SMOOTHING = 0.1
+
+    def __init__(self, initial=4, minimum=1, maximum=8, latency_tolerance=2.0, backoff=0.5, latency_backoff=0.9):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self._value = float(min(max(initial, self.minimum), self.maximum))
+        self._latencies = {}  # key -> (recent, usual) latency
+        self._last_decrease = float("-inf")
+        self._lock = threading.Lock()
+        metrics.set_gauge("gemini_concurrency_limit", self.limit)
+
+    @property
+    def limit(self):
+        """The number of calls currently allowed in flight."""
+        return int(self._value)
+
+    def record(self, started, latency, in_flight, overloaded=False, key=None):
+        """
+        Adjust the limit after a call.
+
+        Args:
+            started: time.monotonic() when the call started
+            latency: Seconds the call took
+            in_flight: Calls in flight when it completed, itself included
+            overloaded: Whether the service answered 429 or the call timed out
+            key: Kind of call (e.g. model and stage) whose latencies are comparable
+
+        Returns:
+            int: The new limit
+        """
+        with self._lock:
+            previous = self.limit
+            reason = None
+            if overloaded:
+                reason = self._decrease(started, latency, self.backoff, "the service pushed back")
+            else:
+                recent, usual = self._latencies.get(key, (latency, latency))
+                recent += self._RECENT_SMOOTHING * (latency - recent)
+                if recent > usual * self.latency_tolerance:
+                    reason = self._decrease(
+                        started, latency, self.latency_backoff, f"calls slowed to {recent:.1f}s from {usual:.1f}s"
+                    )
+                elif in_flight * 2 >= self._value:
+                    self._value = min(self.maximum, self._value + 1 / self._value)
+                # The usual latency only rises with calls made at the minimum limit,
+                # so latency the limit itself caused does not become the usual
+                if recent < usual or in_flight <= self.minimum:
+                    usual += self._USUAL_SMOOTHING * (recent - usual)
+                self._latencies[key] = (recent, usual)
+            limit = self.limit
+        if limit != previous:
+            metrics.set_gauge("gemini_concurrency_limit", limit)
+            if reason:
+                metrics.increment("gemini_concurrency_decreases_total")
+                logger.info(f"Lowered the Gemini concurrency limit to {limit} after {reason}")
+        return limit
+
+    def _decrease(self, started, latency, factor, reason):
+        if started < self._last_decrease:
+            return None
+        self._value = max(float(self.minimum), self._value * factor)
+        self._last_decrease = started + latency
+        return reason
+
+    def stats(self):
+        """Return the current limit, its bounds and the usual latency of each kind of call."""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "latency_seconds": {
+                    "/".join(map(str, key)) if isinstance(key, tuple) else str(key): {
+                        "recent": round(recent, 3), "usual": round(usual, 3)
+                    }
+                    for key, (recent, usual) in self._latencies.items()
+                },
+            }
@@ -0,0 +1,56 @@
+# Cooperative cancellation of abandoned work
+#
+# Cancelling an asyncio task does not stop a blocking function it started
+# with asyncio.to_thread. A CancelToken is made current for such work through
+# a context variable (copied into the worker thread); the task sets it when
+# it is cancelled and the blocking code stops at its next check.
+import contextvars
+import threading
+from contextlib import contextmanager
+
+
+class WorkCancelled(Exception):
+    """Raised in blocking code whose result is no longer wanted."""
+
+
+class CancelToken:
+    """A flag shared between a task and the worker threads it started."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, seconds) -> bool:
+        """Sleep for up to seconds; return True early if the token is cancelled."""
+        return self._event.wait(seconds)
+
+
+_current_token = contextvars.ContextVar("current_cancel_token", default=None)
+
+
+def current_token():
+    """Return the CancelToken of the current work, or None."""
+    return _current_token.get()
+
+
+@contextmanager
+def cancel_scope(token):
+    """Make token current for the duration of the block."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def raise_if_cancelled(what="operation"):
+    """Raise WorkCancelled if the current work has been cancelled."""
+    token = current_token()
+    if token is not None and token.cancelled:
+        raise WorkCancelled(f"Work cancelled before {what}")
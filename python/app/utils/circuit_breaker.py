@@ -0,0 +1,190 @@
+# Circuit breakers for external backends
+#
+# A breaker watches the outcomes of calls to one backend over a sliding
+# window. When the failure rate crosses the threshold it opens and calls fail
+# fast instead of piling up retries; after a cool-off it lets a few probe
+# calls through (half-open) and closes again once one succeeds. State is per
+# worker process and exported as the circuit_state gauge.
+import threading
+import time
+from collections import deque
+from app.config import get_settings
+from app.utils import metrics
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Values of the circuit_state gauge
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_MAX_BREAKERS = 1000  # Per-host breakers beyond this are pruned when closed
+
+
+class CircuitOpenError(ValueError):
+    """Raised instead of calling a backend whose circuit is open."""
+
+    def __init__(self, backend, retry_after):
+        self.backend = backend
+        self.retry_after = retry_after
+        super().__init__(
+            f"{backend} is temporarily unavailable after repeated failures; "
+            f"try again in {max(1, round(retry_after))} seconds."
+        )
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one backend.
+
+    Callers ask allow() before each call and report the outcome with
+    record_success() or record_failure(). Outcomes that say nothing about the
+    backend's health (a cancelled call, for example) are reported with
+    release() so a half-open probe slot is freed.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=5, window_seconds=60.0, open_seconds=30.0, half_open_probes=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._state = CLOSED
+        self._outcomes = deque()  # (timestamp, failed)
+        self._opened_at = 0.0
+        self._probes = deque()  # start times of probes in flight
+        self._lock = threading.Lock()
+        metrics.set_gauge("circuit_state", _STATE_VALUES[CLOSED], backend=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._state
+
+    def allow(self):
+        """
+        Admit one call to the backend.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with all probe slots taken
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN:
+                # Probes that never reported back free their slot after open_seconds
+                while self._probes and now - self._probes[0] > self.open_seconds:
+                    self._probes.popleft()
+                if len(self._probes) < self.half_open_probes:
+                    self._probes.append(now)
+                    logger.info(f"Circuit {self.name} half-open, letting a probe call through")
+                    return
+                retry_after = self.open_seconds
+            else:
+                retry_after = self._opened_at + self.open_seconds - now
+        metrics.increment("circuit_rejections_total", backend=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED, now)
+                self._outcomes.clear()
+            self._outcomes.append((now, False))
+            self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN, now)
+                return
+            self._outcomes.append((now, True))
+            self._trim(now)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for _, failed in self._outcomes if failed)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._transition(OPEN, now)
+
+    def release(self):
+        """Report a call that ended without telling anything about the backend."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            self._trim(now)
+            failures = sum(1 for _, failed in self._outcomes if failed)
+            return {
+                "state": self._state,
+                "calls": len(self._outcomes),
+                "failures": failures,
+                "open_for_seconds": round(max(0.0, self._opened_at + self.open_seconds - now), 1) if self._state == OPEN else 0
+            }
+
+    def _advance(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+
+    def _trim(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _transition(self, state, now):
+        if state == OPEN:
+            self._opened_at = now
+            logger.warning(f"Circuit {self.name} opened, failing fast for {self.open_seconds:.0f}s")
+        else:
+            logger.info(f"Circuit {self.name} is now {state}")
+        self._state = state
+        self._probes.clear()
+        metrics.set_gauge("circuit_state", _STATE_VALUES[state], backend=self.name)
+        metrics.increment("circuit_transitions_total", backend=self.name, state=state)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the process-wide breaker for a backend, creating it from the settings."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            if len(_breakers) >= _MAX_BREAKERS:
+                for key in [k for k, b in _breakers.items() if b.state == CLOSED]:
+                    del _breakers[key]
+            settings = get_settings()
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate=settings.circuit_failure_rate,
+                min_calls=settings.circuit_min_calls,
+                window_seconds=settings.circuit_window_seconds,
+                open_seconds=settings.circuit_open_seconds,
+                half_open_probes=settings.circuit_half_open_probes
+            )
+        return breaker
+
+
+def breaker_stats():
+    """Return the state of every breaker, for /api/metrics."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+def reset_breakers():
+    """Forget all breakers (used by tests)."""
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,95 @@
+# Request deadline budget
+#
+# A Deadline is created per request and made current through a context
+# variable, so every stage and service (including work running in threads
+# started with asyncio.to_thread) can see how much time is left.
+import contextvars
+import time
+from contextlib import contextmanager
+
+from app.utils.cancellation import current_token, raise_if_cancelled
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request's time budget does not allow more work."""
+
+
+class Deadline:
+    """A point in time by which a request must be answered."""
+
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, seconds: float) -> float:
+        """Return seconds, reduced to the remaining time if that is shorter."""
+        return min(seconds, self.remaining())
+
+    def check(self, what="operation"):
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceeded(f"Request time budget of {self.budget:.0f}s exhausted before {what}")
+
+
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def current_deadline():
+    """Return the Deadline of the current request, or None outside a request."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Make deadline current for the duration of the block."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def check_deadline(what="operation"):
+    """
+    Raise DeadlineExceeded if the current request is out of time.
+
+    Also raises WorkCancelled if the current work was cancelled, so every
+    deadline check doubles as a cancellation point.
+    """
+    raise_if_cancelled(what)
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check(what)
+
+
+def cap_timeout(seconds):
+    """Cap a timeout to the time left in the current request, if any."""
+    deadline = current_deadline()
+    return deadline.cap(seconds) if deadline is not None else seconds
+
+
+def sleep_within_deadline(seconds, what="retrying"):
+    """
+    Sleep for seconds, unless that would run past the current request's deadline.
+
+    The sleep ends early if the current work is cancelled.
+
+    Raises:
+        DeadlineExceeded: If the sleep would not finish before the deadline
+        WorkCancelled: If the work is cancelled before or during the sleep
+    """
+    deadline = current_deadline()
+    if deadline is not None and seconds >= deadline.remaining():
+        raise DeadlineExceeded(f"Not enough time left in the request budget for {what} ({seconds:.0f}s wait)")
+    token = current_token()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        raise_if_cancelled(what)
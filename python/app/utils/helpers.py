@@ -1 +1,69 @@
 # Helper functions
+import hashlib
+import json
+from urllib.parse import urlsplit, urlunsplit
+
+
+def canonical_hash(value) -> str:
+    """
+    Compute a stable SHA-256 hex digest for a JSON-serializable value.
+
+    Dictionaries are serialized with sorted keys so logically equal inputs
+    always produce the same digest.
+
+    Args:
+        value: Any JSON-serializable value (str, list, dict, ...)
+
+    Returns:
+        str: Hex digest of the canonical JSON encoding
+    """
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# Characters encoded at a time by text_digest
+_DIGEST_SLICE = 1 << 20
+
+
+def text_digest(text) -> str:
+    """
+    Compute the SHA-256 hex digest of a text without an encoded copy of it.
+
+    The text is encoded and hashed in slices, so hashing a large source only
+    allocates a slice at a time.
+
+    Args:
+        text: A string, or a sequence of strings hashed as their concatenation
+
+    Returns:
+        str: Hex digest of the UTF-8 encoding of the text
+    """
+    digest = hashlib.sha256()
+    for part in ((text,) if isinstance(text, str) else text):
+        for start in range(0, len(part), _DIGEST_SLICE):
+            digest.update(part[start:start + _DIGEST_SLICE].encode("utf-8"))
+    return digest.hexdigest()
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL for use as a lookup key.
+
+    Lowercases the scheme and host, drops the fragment and any trailing slash
+    on the path. The query string is kept as-is.
+
+    Args:
+        url: URL to normalize
+
+    Returns:
+        str: Normalized URL, or the stripped input if it cannot be parsed
+    """
+    if not url or not isinstance(url, str):
+        return ""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    path = parts.path.rstrip("/") if parts.path != "/" else ""
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
@@ -0,0 +1,184 @@
+# Request memory accounting
+#
+# A MemoryBudget is created per pipeline run and made current through a
+# context variable, like the request Deadline. Every stage charges the text
+# it keeps alive (extracted, normalized and compressed sources) so the
+# request's working set is known and can be capped before the worker runs
+# out of memory. Stages also record the process RSS and, when enabled, the
+# tracemalloc peak, which are process-wide and so include concurrent
+# requests.
+import contextvars
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from app.utils import metrics
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class MemoryLimitExceeded(MemoryError):
+    """Raised when a request would hold more memory than its ceiling allows."""
+
+
+def rss_bytes():
+    """Return the resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def text_bytes(text):
+    """Memory held by a string."""
+    return sys.getsizeof(text) if text else 0
+
+
+class MemoryBudget:
+    """
+    Bytes of data a request keeps alive, with an optional ceiling.
+
+    Args:
+        limit_bytes: Ceiling on the accounted bytes (0 disables it)
+        trace: Also record the tracemalloc peak of every stage
+    """
+
+    def __init__(self, limit_bytes=0, trace=False):
+        self.limit = limit_bytes
+        self.trace = trace
+        self.used = 0
+        self.peak = 0
+        self.stages = {}
+        self._stage_peak = 0
+
+    def remaining(self):
+        """Bytes that can still be charged (None without a ceiling)."""
+        return max(0, self.limit - self.used) if self.limit else None
+
+    def charge(self, nbytes, what="data"):
+        """
+        Account nbytes more held by the request.
+
+        Raises:
+            MemoryLimitExceeded: If this would exceed the ceiling
+        """
+        if self.limit and self.used + nbytes > self.limit:
+            raise MemoryLimitExceeded(
+                f"Holding {what} ({nbytes / _MB:.1f} MB) would exceed the request memory limit of {self.limit / _MB:.0f} MB"
+            )
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+        self._stage_peak = max(self._stage_peak, self.used)
+
+    def release(self, nbytes):
+        """Account nbytes no longer held."""
+        self.used = max(0, self.used - nbytes)
+
+    def replace(self, old_text, new_text, what="data"):
+        """Account a text being replaced by a new version of it."""
+        self.release(text_bytes(old_text))
+        self.charge(text_bytes(new_text), what)
+
+    def fit(self, text, what="data"):
+        """
+        Charge text, truncated to what still fits under the ceiling.
+
+        Returns:
+            str: text, or its longest prefix that fits ("" if nothing fits)
+        """
+        size = text_bytes(text)
+        remaining = self.remaining()
+        if remaining is None or size <= remaining:
+            self.charge(size, what)
+            return text
+        # Strings store every character with the same width
+        width = max(1, (size - sys.getsizeof("")) // max(1, len(text)))
+        keep = max(0, (remaining - sys.getsizeof("") - 64) // width)
+        truncated = text[:keep]
+        if truncated:
+            self.charge(text_bytes(truncated), what)
+        return truncated
+
+    @contextmanager
+    def stage(self, request_id, name):
+        """
+        Measure one pipeline stage: the peak of accounted bytes, the RSS
+        change and, with tracing on, the tracemalloc peak. The figures are
+        logged, observed as metrics and kept in stages[name].
+        """
+        self._stage_peak = self.used
+        rss_before = rss_bytes()
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        started = time.time()
+        try:
+            yield self
+        finally:
+            rss_after = rss_bytes()
+            stats = {"accounted_peak_bytes": self._stage_peak, "seconds": round(time.time() - started, 3)}
+            if rss_after is not None:
+                stats["rss_bytes"] = rss_after
+                if rss_before is not None:
+                    stats["rss_delta_bytes"] = rss_after - rss_before
+                metrics.set_gauge("process_rss_bytes", rss_after)
+            if self.trace and tracemalloc.is_tracing():
+                stats["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                metrics.observe("request_traced_peak_bytes", stats["traced_peak_bytes"], stage=name)
+            metrics.observe("request_memory_peak_bytes", self._stage_peak, stage=name)
+            self.stages[name] = stats
+            logger.info(f"[Request {request_id}] Memory after {name}: {_describe(stats)}")
+
+
+def _describe(stats):
+    parts = [f"accounted peak {stats['accounted_peak_bytes'] / _MB:.1f} MB"]
+    if "rss_bytes" in stats:
+        delta = stats.get("rss_delta_bytes")
+        change = f" ({delta / _MB:+.1f} MB)" if delta is not None else ""
+        parts.append(f"RSS {stats['rss_bytes'] / _MB:.1f} MB{change}")
+    if "traced_peak_bytes" in stats:
+        parts.append(f"traced peak {stats['traced_peak_bytes'] / _MB:.1f} MB")
+    return ", ".join(parts)
+
+
+_current_budget = contextvars.ContextVar("current_memory_budget", default=None)
+
+
+def current_budget():
+    """Return the MemoryBudget of the current request, or None outside a request."""
+    return _current_budget.get()
+
+
+@contextmanager
+def memory_scope(budget):
+    """Make budget current for the duration of the block."""
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+@contextmanager
+def memory_stage(request_id, name):
+    """Measure a stage against the current budget; does nothing outside a request."""
+    budget = current_budget()
+    if budget is None:
+        yield None
+        return
+    with budget.stage(request_id, name):
+        yield budget
@@ -0,0 +1,99 @@
+# In-process metrics registry
+#
+# Counters, gauges and latency summaries keyed by name and labels. Values are
+# per worker process; /api/metrics returns a snapshot.
+import threading
+from collections import deque
+
+_SUMMARY_WINDOW = 500  # Recent samples kept per summary for percentiles
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_summaries = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add value to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Record one sample (e.g. a latency in seconds) in a summary."""
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = {"count": 0, "sum": 0.0, "samples": deque(maxlen=_SUMMARY_WINDOW)}
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["samples"].append(value)
+
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def percentile(name, q, **labels):
+    """Return the q-th percentile (0-1) of the recent samples of a summary, or None."""
+    with _lock:
+        summary = _summaries.get(_key(name, labels))
+        samples = list(summary["samples"]) if summary else []
+    return _percentile(samples, q)
+
+
+def summary_count(name, **labels):
+    """Return the number of samples ever recorded in a summary."""
+    with _lock:
+        summary = _summaries.get(_key(name, labels))
+        return summary["count"] if summary else 0
+
+
+def get_counter(name, **labels):
+    """Return the current value of a counter."""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def snapshot():
+    """Return all metrics as a JSON-serializable dict."""
+    with _lock:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(_counters.items())]
+        gauges = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(_gauges.items())]
+        summaries = []
+        for (n, l), s in sorted(_summaries.items()):
+            samples = list(s["samples"])
+            summaries.append({
+                "name": n,
+                "labels": dict(l),
+                "count": s["count"],
+                "sum": round(s["sum"], 6),
+                "p50": _percentile(samples, 0.5),
+                "p95": _percentile(samples, 0.95),
+                "p99": _percentile(samples, 0.99)
+            })
+    return {"counters": counters, "gauges": gauges, "summaries": summaries}
+
+
+def reset():
+    """Clear all metrics (used by tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _summaries.clear()
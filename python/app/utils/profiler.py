@@ -0,0 +1,114 @@
+# Sampling profiler for single requests.
+# A background thread samples the stacks of all other threads at a fixed
+# interval and counts them in collapsed-stack form ("thread;outer;inner N"),
+# which flamegraph.pl and speedscope read directly. Nothing runs unless a
+# profiler is started.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Leaf frames of threads that are blocked waiting, not working
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+_MAX_DEPTH = 128
+
+
+def _frame_label(code):
+    """Label a frame as "qualified.name (path:first line)"; ';' would split the stack."""
+    path = code.co_filename
+    if path.startswith(project_root):
+        path = os.path.relpath(path, project_root)
+    elif "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    else:
+        path = os.path.basename(path)
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _thread_label(name):
+    # Pool threads are numbered; group them by pool
+    return name.rstrip("0123456789").rstrip("_-") or name
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler over all threads of the process.
+
+    Only threads that are running (not blocked on a lock, queue or
+    selector) are counted, so the profile shows where wall time went in
+    busy threads. Work of other requests handled by the same worker at the
+    same time is included, under the same thread names.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._counts = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.time() - self.started_at
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = self._stack(frame)
+                if stack:
+                    self._counts[(_thread_label(names.get(ident, "thread")),) + stack] += 1
+            self.samples += 1
+
+    def _stack(self, frame):
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+            return None
+        labels = []
+        while frame is not None and len(labels) < _MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+    def collapsed(self):
+        """Return the profile in collapsed-stack format, heaviest stacks first."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self._counts.most_common())
+
+    def top_functions(self, limit=10):
+        """Return the functions most often found running (self samples, at the top of the stack)."""
+        leaves = Counter()
+        for stack, count in self._counts.items():
+            leaves[stack[-1]] += count
+        return leaves.most_common(limit)
@@ -0,0 +1,78 @@
+# HTTP response helpers
+#
+# JSON responses carry whole study guides, often 100KB+ of markdown, so they
+# are serialized with orjson when it is installed, several times faster than
+# the json module. Stored results are served conditionally (If-None-Match)
+# and in the best content coding the client accepts among those available.
+import json
+from starlette.responses import JSONResponse
+
+try:
+    import orjson  # Optional dependency: faster serialization of large responses
+except ImportError:
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """Serialize content to compact UTF-8 JSON, with orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            # Values orjson rejects (e.g. non-string keys, huge integers)
+            pass
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def negotiate_encoding(accept_encoding, available):
+    """
+    Choose the content coding to respond with.
+
+    Args:
+        accept_encoding: The request's Accept-Encoding header
+        available: Codings the body is available in, most preferred first
+
+    Returns:
+        str: One of available, or None to send the body unencoded
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    best = None
+    for coding in available:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    return best[0] if best else None
+
+
+def etag_matches(if_none_match, etags):
+    """
+    Return True if an If-None-Match header matches one of etags.
+
+    The comparison is weak, as RFC 9110 requires for If-None-Match: a W/
+    prefix is ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = {etag.removeprefix("W/") for etag in etags}
+    return any(tag.strip().removeprefix("W/") in opaque for tag in if_none_match.split(","))
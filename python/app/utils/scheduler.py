@@ -0,0 +1,301 @@
+# Gemini call scheduler
+#
+# Every Gemini call of a worker process waits here for one of
+# GEMINI_MAX_CONCURRENT_CALLS slots before it goes on to the rate limiter.
+# Queued calls are served by priority class (interactive requests before
+# background work before bulk jobs) and, within a class, by weighted fair
+# queuing across tenants (API keys or clients), so one tenant's large
+# requests cannot crowd out everyone else's. A call queued for longer than
+# GEMINI_MAX_QUEUE_SECONDS is served next regardless of its class, so lower
+# classes are never starved. With GEMINI_ADAPTIVE_CONCURRENCY the number of
+# slots itself adapts to how the service responds (see adaptive_limit).
+#
+# Calls wait for their slot blocking a thread, so work that makes Gemini
+# calls runs on a pool of its own (get_call_executor) rather than the event
+# loop's default executor: a backlog of queued calls must not starve the
+# extraction, normalization and storage work other requests hand to
+# asyncio.to_thread.
+import contextvars
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from app.config import get_settings
+from app.utils import metrics
+from app.utils.adaptive_limit import AdaptiveLimit
+from app.utils.deadline import check_deadline
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+
+# How often a queued call rechecks its deadline, cancellation and age
+_POLL_SECONDS = 0.25
+# Finish tags kept per class before those of idle tenants are dropped
+_MAX_TENANTS = 1000
+
+_current_class = contextvars.ContextVar("current_call_class", default=(BACKGROUND, "default"))
+
+
+def current_call_class():
+    """Return the (priority, tenant) Gemini calls are currently made for."""
+    return _current_class.get()
+
+
+@contextmanager
+def call_scope(priority, tenant):
+    """Make Gemini calls made in the block queue with priority on behalf of tenant."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown call priority: {priority}")
+    token = _current_class.set((priority, tenant or "default"))
+    try:
+        yield
+    finally:
+        _current_class.reset(token)
+
+
+class _Waiter:
+    """A queued call, and once admitted its ticket."""
+
+    __slots__ = ("priority", "tenant", "finish", "seq", "enqueued_at", "held", "latency", "overloaded", "key", "ended")
+
+    def __init__(self, priority, tenant, finish, seq):
+        self.priority = priority
+        self.tenant = tenant
+        self.finish = finish
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.held = False
+        self.latency = None
+        self.overloaded = False
+        self.key = None
+        self.ended = None
+
+    def record(self, latency, overloaded=False, key=None):
+        """
+        Report how the call went, for the adaptive limit.
+
+        Args:
+            latency: Seconds the call to the service took
+            overloaded: Whether the service answered 429 or the call timed out
+            key: Kind of call (e.g. model and stage) whose latencies are comparable
+        """
+        self.latency = latency
+        self.overloaded = overloaded
+        self.key = key
+        self.ended = time.monotonic()
+
+
+class CallScheduler:
+    """
+    Admits at most max_concurrent calls at a time.
+
+    Within a priority class, calls are ordered by self-clocked fair queuing:
+    a call's finish tag is the later of the class's virtual time and the
+    tenant's previous finish tag, plus its cost divided by the tenant's
+    weight. Tenants thereby share the slots in proportion to their weights,
+    measured in cost (the size of the prompts), not in number of calls.
+
+    With an AdaptiveLimit, the calls admitted at once follow its limit
+    (max_concurrent is then only the ceiling it was built with), fed by the
+    outcomes callers record() on their tickets.
+
+    Args:
+        max_concurrent: Calls admitted at once (0 admits every call immediately)
+        max_queue_seconds: Wait after which a call is served before any other class
+        weights: Optional {tenant: weight}; tenants not listed weigh 1
+        limit: Optional AdaptiveLimit that sets the calls admitted at once
+    """
+
+    def __init__(self, max_concurrent=8, max_queue_seconds=30.0, weights=None, limit=None):
+        self.max_concurrent = max_concurrent
+        self.limit = limit
+        self.max_queue_seconds = max_queue_seconds
+        self.weights = dict(weights or {})
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = []
+        self._virtual = dict.fromkeys(PRIORITIES, 0.0)
+        self._finish = {priority: {} for priority in PRIORITIES}
+        self._seq = itertools.count()
+        self._dispatched = dict.fromkeys(PRIORITIES, 0)
+        self._promoted = dict.fromkeys(PRIORITIES, 0)
+
+    def acquire(self, cost=1.0):
+        """
+        Wait for a call slot for the current priority and tenant.
+
+        Args:
+            cost: Relative size of the call, e.g. its prompt in thousands of tokens
+
+        Returns:
+            A ticket to pass to release()
+
+        Raises:
+            DeadlineExceeded: If the request's time budget runs out while queued
+            WorkCancelled: If the work is cancelled while queued
+        """
+        priority, tenant = current_call_class()
+        if not self.max_concurrent:
+            return _Waiter(priority, tenant, 0.0, 0)
+        with self._cond:
+            waiter = self._enqueue(priority, tenant, cost)
+            try:
+                while not (self._running < self._capacity() and self._next() is waiter):
+                    check_deadline(f"a Gemini call slot ({priority})")
+                    self._cond.wait(_POLL_SECONDS)
+            except BaseException:
+                self._waiting.remove(waiter)
+                self._gauge(priority)
+                self._cond.notify_all()
+                raise
+            self._waiting.remove(waiter)
+            self._running += 1
+            waiter.held = True
+            self._virtual[priority] = max(self._virtual[priority], waiter.finish)
+            self._dispatched[priority] += 1
+            waited = time.monotonic() - waiter.enqueued_at
+            promoted = waited >= self.max_queue_seconds
+            if promoted:
+                self._promoted[priority] += 1
+            self._gauge(priority)
+        metrics.observe("gemini_queue_seconds", waited, priority=priority)
+        if promoted:
+            metrics.increment("gemini_queue_promotions_total", priority=priority)
+            logger.warning(f"Served a {priority} Gemini call of {tenant} after {waited:.1f}s in the queue")
+        return waiter
+
+    def release(self, ticket):
+        """Free the slot of a call admitted by acquire(), passing what it recorded to the adaptive limit."""
+        if not ticket.held:
+            return
+        with self._cond:
+            if self.limit is not None and ticket.latency is not None:
+                self.limit.record(
+                    ticket.ended - ticket.latency, ticket.latency, self._running, ticket.overloaded, ticket.key
+                )
+            ticket.held = False
+            self._running -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cost=1.0):
+        """Hold a call slot for the duration of the block, which receives the ticket."""
+        ticket = self.acquire(cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        """Return the slots in use, the queue per class and the calls dispatched and promoted."""
+        with self._cond:
+            waiting = dict.fromkeys(PRIORITIES, 0)
+            for waiter in self._waiting:
+                waiting[waiter.priority] += 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "limit": self._capacity(),
+                "adaptive": self.limit.stats() if self.limit is not None else None,
+                "running": self._running,
+                "waiting": waiting,
+                "tenants_waiting": len({waiter.tenant for waiter in self._waiting}),
+                "dispatched": dict(self._dispatched),
+                "promoted": dict(self._promoted),
+            }
+
+    def _capacity(self):
+        return self.limit.limit if self.limit is not None else self.max_concurrent
+
+    def _enqueue(self, priority, tenant, cost):
+        finishes = self._finish[priority]
+        if len(finishes) > _MAX_TENANTS:
+            # Tenants whose last finish tag is in the past start from the virtual time anyway
+            for idle in [t for t, finish in finishes.items() if finish <= self._virtual[priority]]:
+                del finishes[idle]
+        start = max(self._virtual[priority], finishes.get(tenant, 0.0))
+        finish = start + max(cost, 0.0) / self.weights.get(tenant, 1.0)
+        finishes[tenant] = finish
+        waiter = _Waiter(priority, tenant, finish, next(self._seq))
+        self._waiting.append(waiter)
+        self._gauge(priority)
+        return waiter
+
+    def _next(self):
+        """Return the queued call to serve next."""
+        oldest = min(self._waiting, key=lambda w: w.seq)
+        if time.monotonic() - oldest.enqueued_at >= self.max_queue_seconds:
+            return oldest
+        for priority in PRIORITIES:
+            queued = [w for w in self._waiting if w.priority == priority]
+            if queued:
+                return min(queued, key=lambda w: (w.finish, w.seq))
+        return None
+
+    def _gauge(self, priority):
+        metrics.set_gauge(
+            "gemini_queue_depth", sum(1 for w in self._waiting if w.priority == priority), priority=priority
+        )
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_call_executor = None
+
+
+def get_scheduler():
+    """Return the process-wide call scheduler built from the settings."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            settings = get_settings()
+            limit = None
+            if settings.gemini_adaptive_concurrency and settings.gemini_max_concurrent_calls:
+                limit = AdaptiveLimit(
+                    initial=settings.gemini_max_concurrent_calls // 2,
+                    minimum=settings.gemini_min_concurrent_calls,
+                    maximum=settings.gemini_max_concurrent_calls,
+                    latency_tolerance=settings.gemini_latency_tolerance
+                )
+            _scheduler = CallScheduler(
+                max_concurrent=settings.gemini_max_concurrent_calls,
+                max_queue_seconds=settings.gemini_max_queue_seconds,
+                limit=limit
+            )
+        return _scheduler
+
+
+def get_call_executor():
+    """
+    Return the process-wide thread pool that work making Gemini calls runs on.
+
+    It is sized from GEMINI_CALL_THREADS or, by default, from several times
+    the call slots, so enough calls reach the scheduler's queue for their
+    priorities to decide which is served first.
+    """
+    global _call_executor
+    with _scheduler_lock:
+        if _call_executor is None:
+            settings = get_settings()
+            threads = settings.gemini_call_threads or max(16, 4 * settings.gemini_max_concurrent_calls)
+            _call_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="gemini-work")
+        return _call_executor
+
+
+def reset_scheduler():
+    """Forget the scheduler and its pool so the next use rebuilds them from the settings (used by tests)."""
+    global _scheduler, _scheduler_lock, _call_executor
+    _scheduler = None
+    _call_executor = None
+    _scheduler_lock = threading.Lock()
+
+
+# A forked child (batch worker processes) must not inherit slots held by
+# threads that do not exist in it, nor a pool without its threads
+os.register_at_fork(after_in_child=reset_scheduler)
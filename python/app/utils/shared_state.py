@@ -0,0 +1,230 @@
+# Shared state for coordinating worker processes.
+# Uvicorn workers do not share memory, so the Gemini rate limiter, the result
+# caches and the single-flight locks go through a small key/value backend:
+# SQLite in WAL mode (default), Redis or a client with the same get/set/delete
+# calls, or plain process memory for single-worker runs and tests.
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+class MemoryStateBackend:
+    """Process-local backend. Only coordinates threads within one worker."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            now = time.time()
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def reserve_interval(self, name, min_interval):
+        with self._lock:
+            now = time.time()
+            last = float(self._live(name, now) or 0)
+            slot = max(now, last + min_interval)
+            self._data[name] = (str(slot), None)
+            return slot - now
+
+
+class SQLiteStateBackend:
+    """SQLite (WAL mode) backend shared by all worker processes on one host."""
+
+    _CLEANUP_EVERY = 500
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # Connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, fn):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, time.time())
+                self._writes += 1
+                if self._writes % self._CLEANUP_EVERY == 0:
+                    conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _get(conn, key, now):
+        row = conn.execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, key):
+        with self._lock:
+            return self._get(self._connection(), key, time.time())
+
+    def set(self, key, value, ttl=None):
+        def op(conn, now):
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+        self._write(op)
+
+    def add(self, key, value, ttl=None):
+        def op(conn, now):
+            if self._get(conn, key, now) is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+            return True
+        return self._write(op)
+
+    def delete(self, key):
+        self._write(lambda conn, now: conn.execute("DELETE FROM kv WHERE key = ?", (key,)))
+
+    def reserve_interval(self, name, min_interval):
+        def op(conn, now):
+            last = float(self._get(conn, name, now) or 0)
+            slot = max(now, last + min_interval)
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, NULL)", (name, str(slot)))
+            return slot - now
+        return self._write(op)
+
+
+class RedisStateBackend:
+    """
+    Backend for Redis or any client exposing redis-py's get/set/delete.
+
+    Only plain GET, SET (with NX/PX) and DEL are used, so a small local
+    stand-in can replace a real server in tests.
+    """
+
+    def __init__(self, client, lock_poll_interval=0.005):
+        self.client = client
+        self.lock_poll_interval = lock_poll_interval
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis  # Optional dependency, only needed for this backend
+        except ImportError:
+            raise ValueError("The redis package is required for SHARED_STATE_BACKEND=redis")
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def reserve_interval(self, name, min_interval):
+        lock_key = f"{name}:lock"
+        while not self.add(lock_key, "1", ttl=5):
+            time.sleep(self.lock_poll_interval)
+        try:
+            now = time.time()
+            last = float(self.get(name) or 0)
+            slot = max(now, last + min_interval)
+            self.set(name, str(slot))
+            return slot - now
+        finally:
+            self.delete(lock_key)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_shared_state():
+    """
+    Return the process-wide shared state backend, creating it on first use.
+
+    The backend is chosen by SHARED_STATE_BACKEND ("sqlite", "redis" or
+    "memory"); SHARED_STATE_PATH and REDIS_URL configure the first two.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                settings = get_settings()
+                if settings.shared_state_backend == "redis":
+                    _backend = RedisStateBackend.from_url(settings.redis_url)
+                elif settings.shared_state_backend == "memory":
+                    _backend = MemoryStateBackend()
+                else:
+                    _backend = SQLiteStateBackend(settings.shared_state_path)
+                logger.info(f"Using {type(_backend).__name__} for shared state")
+    return _backend
+
+
+def set_shared_state(backend):
+    """Replace the process-wide backend (used by tests and tools)."""
+    global _backend
+    _backend = backend
+
+
+def cache_get(key):
+    """Return the JSON-decoded cached value for key, or None."""
+    value = get_shared_state().get(f"cache:{key}")
+    return json.loads(value) if value is not None else None
+
+
+def cache_set(key, value, ttl):
+    """Store a JSON-serializable value in the shared cache for ttl seconds."""
+    get_shared_state().set(f"cache:{key}", json.dumps(value, ensure_ascii=False), ttl=ttl)
@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import functools
+import os
+from app.utils.logger import setup_logger
+from app.utils.shared_state import get_shared_state, cache_get, cache_set
+from app.utils.cancellation import CancelToken, cancel_scope
+from app.utils import metrics
+
+logger = setup_logger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight computation.
+
+    The first caller for a key (the leader) starts the work; callers arriving
+    while it is still running (followers) await the same result instead of
+    repeating it. Once the computation finishes the key is released, so later
+    calls start fresh.
+
+    With cache_ttl set, results are also kept in the shared state cache and a
+    shared lock stops other worker processes from starting the same work;
+    they wait for the cached result instead. Cached results must be
+    JSON-serializable.
+
+    When every caller waiting for a key has been cancelled (for example
+    because their clients disconnected), the computation is cancelled too.
+    Blocking functions see this through the current CancelToken.
+
+    Blocking functions run on the event loop's default executor, or on the
+    pool returned by executor, if given.
+    """
+
+    def __init__(self, name: str, cache_ttl=None, lock_ttl=600, poll_interval=0.2, executor=None):
+        self.name = name
+        self.cache_ttl = cache_ttl
+        self.executor = executor
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._waiters = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cache_hits = 0
+
+    def in_flight(self) -> int:
+        """Return the number of keys currently being computed."""
+        return len(self._calls)
+
+    def pending(self, key: str):
+        """Return the in-flight task for key, or None if nothing is running."""
+        return self._calls.get(key)
+
+    def cached(self, key: str) -> bool:
+        """Return True if a result for key is in the shared state cache."""
+        return bool(self.cache_ttl) and cache_get(f"{self.name}:{key}") is not None
+
+    def remember(self, key: str, result) -> None:
+        """Cache result under key as if it had been computed for it (no-op without cache_ttl)."""
+        if self.cache_ttl:
+            cache_set(f"{self.name}:{key}", result, self.cache_ttl)
+
+    async def do(self, key: str, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) once per key among concurrent callers.
+
+        Args:
+            key: Canonical key identifying the computation
+            fn: Coroutine function, or a blocking function which is run in a worker thread
+            *args, **kwargs: Arguments passed to fn by the leader
+
+        Returns:
+            The result of the shared computation (exceptions are shared too)
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.followers += 1
+            logger.info(f"[{self.name}] Joining in-flight computation for key {key[:80]}")
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(self._run(key, fn, args, kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+        return await self._wait(key, task)
+
+    async def _wait(self, key, task):
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    logger.info(f"[{self.name}] All callers went away, cancelling computation for key {key[:80]}")
+                    metrics.increment("flight_cancellations_total", flight=self.name)
+                    task.cancel()
+
+    async def _call(self, fn, args, kwargs):
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        token = CancelToken()
+        with cancel_scope(token):
+            try:
+                if self.executor is None:
+                    return await asyncio.to_thread(fn, *args, **kwargs)
+                # Like asyncio.to_thread, the function sees the caller's context variables
+                call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+                return await asyncio.get_running_loop().run_in_executor(self.executor(), call)
+            except asyncio.CancelledError:
+                # The worker thread keeps running; ask it to stop at its next check
+                token.cancel()
+                raise
+
+    async def _run(self, key, fn, args, kwargs):
+        if not self.cache_ttl:
+            return await self._call(fn, args, kwargs)
+
+        state = get_shared_state()
+        cache_key = f"{self.name}:{key}"
+        lock_key = f"lock:{self.name}:{key}"
+
+        # Another worker may already hold the lock for this key; wait for its result
+        while True:
+            cached = cache_get(cache_key)
+            if cached is not None:
+                self.cache_hits += 1
+                logger.info(f"[{self.name}] Cache hit for key {key[:80]}")
+                return cached
+            if state.add(lock_key, str(os.getpid()), ttl=self.lock_ttl):
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            result = await self._call(fn, args, kwargs)
+            cache_set(cache_key, result, self.cache_ttl)
+            return result
+        finally:
+            state.delete(lock_key)
+
+    def _release(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every waiter went away
+        if not task.cancelled():
+            task.exception()
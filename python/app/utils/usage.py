@@ -0,0 +1,94 @@
+# Per-request usage accounting
+#
+# A Usage record is created per request and made current through a context
+# variable, like the request Deadline and MemoryBudget. Every Gemini attempt
+# made on the request's behalf adds its call, retry, tokens and latency;
+# the request adds the wall time of its pipeline stages when it finishes.
+# Records are aggregated per tenant by the usage ledger (usageLedger).
+import contextvars
+import threading
+from contextlib import contextmanager
+
+
+class Usage:
+    """What one request consumed of the Gemini API and of the worker's time."""
+
+    def __init__(self, tenant, shared_key=True):
+        self.tenant = tenant
+        # True when calls are made with our GEMINI_API_KEY rather than the user's own
+        self.shared_key = shared_key
+        self.calls = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.gemini_seconds = 0.0
+        self.stage_seconds = {}
+        self._lock = threading.Lock()
+
+    def add_call(self, seconds, input_tokens=0, output_tokens=0, retry=False):
+        """
+        Record one Gemini attempt.
+
+        Args:
+            seconds: Latency of the attempt
+            input_tokens: Prompt tokens it was charged for (0 if it failed)
+            output_tokens: Response tokens it was charged for (0 if it failed)
+            retry: True if it repeated an earlier attempt of the same call
+        """
+        with self._lock:
+            self.calls += 1
+            self.retries += 1 if retry else 0
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.gemini_seconds += seconds
+
+    def add_usage(self, other):
+        """Add the Gemini calls, retries, tokens and latency recorded in another Usage."""
+        summary = other.summary()
+        with self._lock:
+            self.calls += summary["calls"]
+            self.retries += summary["retries"]
+            self.input_tokens += summary["input_tokens"]
+            self.output_tokens += summary["output_tokens"]
+            self.gemini_seconds += summary["gemini_seconds"]
+
+    def add_stages(self, stages):
+        """Add the wall time of pipeline stages, as measured by MemoryBudget.stages."""
+        with self._lock:
+            for name, stats in stages.items():
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + stats.get("seconds", 0.0)
+
+    @property
+    def tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def summary(self):
+        """Return the recorded figures as a dict."""
+        with self._lock:
+            return {
+                "tenant": self.tenant,
+                "calls": self.calls,
+                "retries": self.retries,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "gemini_seconds": round(self.gemini_seconds, 3),
+                "stage_seconds": {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+            }
+
+
+_current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+def current_usage():
+    """Return the Usage of the current request, or None outside an accounted request."""
+    return _current_usage.get()
+
+
+@contextmanager
+def usage_scope(usage):
+    """Make usage current for the duration of the block."""
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
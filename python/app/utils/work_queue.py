@@ -0,0 +1,468 @@
+# Durable work queue
+#
+# Lets CPU-heavy work run in separate worker processes, on this host or on
+# other nodes, instead of inside the API process. A producer submits a task
+# and polls for its result. A worker claims a task, which hides it from other
+# workers for a visibility timeout that the worker extends with heartbeats
+# while it works, and acknowledges it with a result or an error. Failed tasks
+# are retried with backoff up to max_attempts; a task whose worker died
+# reappears once its lease expires and counts as a failed attempt.
+#
+# Backends: SQLite (default), shared by the processes of one host, and Redis
+# or any client with redis-py's string and sorted-set calls, shared by nodes.
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Task:
+    """A task claimed by a worker; lease identifies this claim of it."""
+
+    __slots__ = ("id", "kind", "payload", "attempts", "max_attempts", "lease")
+
+    def __init__(self, task_id, kind, payload, attempts, max_attempts, lease):
+        self.id = task_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+
+def error_record(error):
+    """Describe an exception as a task error: its type name and message."""
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+class _WorkQueue:
+    """
+    Operations shared by the backends.
+
+    Args:
+        result_ttl: Seconds a finished task's record is kept for its producer
+        retry_delay: Backoff before the first retry, doubled on each later one
+    """
+
+    def __init__(self, result_ttl=3600.0, retry_delay=1.0):
+        self.result_ttl = result_ttl
+        self.retry_delay = retry_delay
+
+    def _backoff(self, attempts):
+        return self.retry_delay * (2 ** max(0, attempts - 1))
+
+    def _expired_lease_error(self, attempts):
+        return {"type": "WorkerLost", "message": f"The worker stopped responding (attempt {attempts})"}
+
+
+class SQLiteWorkQueue(_WorkQueue):
+    """Work queue in an SQLite database (WAL mode) shared by the processes of one host."""
+
+    _CLEANUP_EVERY = 200
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # Connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                "state TEXT NOT NULL, attempts INTEGER NOT NULL, max_attempts INTEGER NOT NULL, "
+                "visible_at REAL NOT NULL, lease TEXT, result TEXT, error TEXT, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (state, visible_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, fn):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, time.time())
+                self._writes += 1
+                if self._writes % self._CLEANUP_EVERY == 0:
+                    conn.execute("DELETE FROM tasks WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def submit(self, kind, payload, max_attempts=3):
+        """
+        Queue a task.
+
+        Args:
+            kind: Name of the handler that runs it
+            payload: JSON-serializable task arguments
+            max_attempts: Attempts before the task fails for good
+
+        Returns:
+            str: Task id
+        """
+        task_id = uuid.uuid4().hex
+
+        def op(conn, now):
+            conn.execute(
+                "INSERT INTO tasks (id, kind, payload, state, attempts, max_attempts, visible_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, ?)",
+                (task_id, kind, json.dumps(payload), QUEUED, max_attempts, now)
+            )
+        self._write(op)
+        return task_id
+
+    def claim(self, kinds=None, visibility_timeout=60.0):
+        """
+        Lease the oldest task that is ready, requeueing tasks whose lease expired.
+
+        Args:
+            kinds: Optional task kinds this worker handles
+            visibility_timeout: Seconds the task stays hidden from other workers
+
+        Returns:
+            Task: The claimed task, or None if none is ready
+        """
+        def op(conn, now):
+            self._requeue_expired(conn, now)
+            query = "SELECT id, kind, payload, attempts, max_attempts FROM tasks WHERE state = ? AND visible_at <= ?"
+            args = [QUEUED, now]
+            if kinds:
+                query += f" AND kind IN ({','.join('?' * len(kinds))})"
+                args.extend(kinds)
+            row = conn.execute(query + " ORDER BY visible_at LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+            task_id, kind, payload, attempts, max_attempts = row
+            lease = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE tasks SET state = ?, attempts = ?, visible_at = ?, lease = ? WHERE id = ?",
+                (LEASED, attempts + 1, now + visibility_timeout, lease, task_id)
+            )
+            return Task(task_id, kind, json.loads(payload), attempts + 1, max_attempts, lease)
+        return self._write(op)
+
+    def _requeue_expired(self, conn, now):
+        rows = conn.execute(
+            "SELECT id, attempts, max_attempts FROM tasks WHERE state = ? AND visible_at <= ?", (LEASED, now)
+        ).fetchall()
+        for task_id, attempts, max_attempts in rows:
+            logger.warning(f"Lease of task {task_id} expired after attempt {attempts}/{max_attempts}")
+            if attempts >= max_attempts:
+                conn.execute(
+                    "UPDATE tasks SET state = ?, lease = NULL, error = ?, expires_at = ? WHERE id = ?",
+                    (FAILED, json.dumps(self._expired_lease_error(attempts)), now + self.result_ttl, task_id)
+                )
+            else:
+                conn.execute("UPDATE tasks SET state = ?, lease = NULL WHERE id = ?", (QUEUED, task_id))
+
+    def heartbeat(self, task, visibility_timeout=60.0):
+        """
+        Extend the lease of a task being worked on.
+
+        Returns:
+            bool: False if the task was cancelled or claimed by another worker,
+            in which case the work should stop
+        """
+        def op(conn, now):
+            cursor = conn.execute(
+                "UPDATE tasks SET visible_at = ? WHERE id = ? AND state = ? AND lease = ?",
+                (now + visibility_timeout, task.id, LEASED, task.lease)
+            )
+            return cursor.rowcount == 1
+        return self._write(op)
+
+    def complete(self, task, result):
+        """
+        Acknowledge a task with its JSON-serializable result.
+
+        A late result is still accepted if the task was requeued after its
+        lease expired but has not finished since.
+
+        Returns:
+            bool: Whether the result was stored
+        """
+        def op(conn, now):
+            cursor = conn.execute(
+                "UPDATE tasks SET state = ?, lease = NULL, result = ?, expires_at = ? WHERE id = ? AND state IN (?, ?)",
+                (DONE, json.dumps(result), now + self.result_ttl, task.id, QUEUED, LEASED)
+            )
+            return cursor.rowcount == 1
+        return self._write(op)
+
+    def fail(self, task, error, retry=True):
+        """
+        Report that an attempt failed; the task is retried after a backoff
+        unless retry is False or it has used all of its attempts.
+
+        Args:
+            task: The claimed task
+            error: Error record, see error_record()
+            retry: Whether another attempt could succeed
+
+        Returns:
+            bool: Whether the task will be retried
+        """
+        def op(conn, now):
+            if retry and task.attempts < task.max_attempts:
+                cursor = conn.execute(
+                    "UPDATE tasks SET state = ?, lease = NULL, visible_at = ?, error = ? WHERE id = ? AND lease = ?",
+                    (QUEUED, now + self._backoff(task.attempts), json.dumps(error), task.id, task.lease)
+                )
+                return cursor.rowcount == 1
+            conn.execute(
+                "UPDATE tasks SET state = ?, lease = NULL, error = ?, expires_at = ? WHERE id = ? AND lease = ?",
+                (FAILED, json.dumps(error), now + self.result_ttl, task.id, task.lease)
+            )
+            return False
+        return self._write(op)
+
+    def cancel(self, task_id):
+        """Cancel a task that has not finished; a worker running it stops at its next heartbeat."""
+        self._write(lambda conn, now: conn.execute(
+            "UPDATE tasks SET state = ?, lease = NULL, expires_at = ? WHERE id = ? AND state IN (?, ?)",
+            (CANCELLED, now + self.result_ttl, task_id, QUEUED, LEASED)
+        ))
+
+    def status(self, task_id):
+        """
+        Return a task's state, attempts, and its result or last error, or None
+        if it does not exist (anymore).
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT state, attempts, result, error FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        state, attempts, result, error = row
+        return {
+            "state": state,
+            "attempts": attempts,
+            "result": json.loads(result) if result is not None else None,
+            "error": json.loads(error) if error is not None else None,
+        }
+
+    def forget(self, task_id):
+        """Delete a task's record once its producer has its outcome."""
+        self._write(lambda conn, now: conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,)))
+
+    def stats(self):
+        """Return the number of tasks in each state (only queued and leased ones with Redis)."""
+        with self._lock:
+            rows = self._connection().execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        counts = dict.fromkeys((QUEUED, LEASED, *FINISHED), 0)
+        counts.update(rows)
+        return counts
+
+
+class RedisWorkQueue(_WorkQueue):
+    """
+    Work queue in Redis, or any client exposing redis-py's get/set/delete and
+    zadd/zrem/zrangebyscore/zcard, shared by worker processes on any node.
+
+    Each task is a JSON record under its own key. Tasks ready to run are in
+    one sorted set per kind, scored by when they become visible; claimed
+    tasks are in a sorted set scored by when their lease expires. A claim
+    adds the task to the leased set before removing it from the ready set
+    and only proceeds if it was the one to remove it, so no lock is needed
+    and a worker that dies halfway leaves the task to be requeued.
+    """
+
+    def __init__(self, client, prefix="workqueue", **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis  # Optional dependency, only needed for this backend
+        except ImportError:
+            raise ValueError("The redis package is required for the redis work queue")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, task_id):
+        return f"{self.prefix}:task:{task_id}"
+
+    def _ready(self, kind):
+        return f"{self.prefix}:ready:{kind}"
+
+    @property
+    def _leased(self):
+        return f"{self.prefix}:leased"
+
+    @property
+    def _kinds(self):
+        return f"{self.prefix}:kinds"
+
+    def _load(self, task_id):
+        value = self.client.get(self._key(task_id))
+        if value is None:
+            return None
+        return json.loads(value.decode("utf-8") if isinstance(value, bytes) else value)
+
+    def _store(self, record, ttl=None):
+        self.client.set(self._key(record["id"]), json.dumps(record), px=int(ttl * 1000) if ttl else None)
+
+    @staticmethod
+    def _text(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def submit(self, kind, payload, max_attempts=3):
+        task_id = uuid.uuid4().hex
+        record = {
+            "id": task_id, "kind": kind, "payload": payload, "state": QUEUED, "attempts": 0,
+            "max_attempts": max_attempts, "lease": None, "result": None, "error": None,
+        }
+        self._store(record)
+        self.client.zadd(self._kinds, {kind: 0})
+        self.client.zadd(self._ready(kind), {task_id: time.time()})
+        return task_id
+
+    def claim(self, kinds=None, visibility_timeout=60.0):
+        now = time.time()
+        self._requeue_expired(now)
+        if not kinds:
+            kinds = [self._text(kind) for kind in self.client.zrangebyscore(self._kinds, "-inf", "+inf")]
+        for kind in kinds:
+            for task_id in self.client.zrangebyscore(self._ready(kind), "-inf", now, start=0, num=10):
+                task_id = self._text(task_id)
+                self.client.zadd(self._leased, {task_id: now + visibility_timeout})
+                if not self.client.zrem(self._ready(kind), task_id):
+                    continue  # Another worker claimed it first
+                record = self._load(task_id)
+                if record is None or record["state"] != QUEUED:
+                    self.client.zrem(self._leased, task_id)
+                    continue
+                record.update(state=LEASED, attempts=record["attempts"] + 1, lease=uuid.uuid4().hex)
+                self._store(record)
+                return Task(task_id, kind, record["payload"], record["attempts"], record["max_attempts"], record["lease"])
+        return None
+
+    def _requeue_expired(self, now):
+        for task_id in self.client.zrangebyscore(self._leased, "-inf", now):
+            task_id = self._text(task_id)
+            if not self.client.zrem(self._leased, task_id):
+                continue  # Another worker is requeueing it
+            record = self._load(task_id)
+            if record is None or record["state"] not in (QUEUED, LEASED):
+                continue
+            logger.warning(f"Lease of task {task_id} expired after attempt {record['attempts']}/{record['max_attempts']}")
+            if record["attempts"] >= record["max_attempts"]:
+                record.update(state=FAILED, lease=None, error=self._expired_lease_error(record["attempts"]))
+                self._store(record, ttl=self.result_ttl)
+            else:
+                record.update(state=QUEUED, lease=None)
+                self._store(record)
+                self.client.zadd(self._ready(record["kind"]), {task_id: now})
+
+    def heartbeat(self, task, visibility_timeout=60.0):
+        record = self._load(task.id)
+        if record is None or record["state"] != LEASED or record["lease"] != task.lease:
+            return False
+        self.client.zadd(self._leased, {task.id: time.time() + visibility_timeout})
+        return True
+
+    def complete(self, task, result):
+        record = self._load(task.id)
+        if record is None or record["state"] not in (QUEUED, LEASED):
+            return False
+        self.client.zrem(self._leased, task.id)
+        self.client.zrem(self._ready(task.kind), task.id)
+        record.update(state=DONE, lease=None, result=result)
+        self._store(record, ttl=self.result_ttl)
+        return True
+
+    def fail(self, task, error, retry=True):
+        record = self._load(task.id)
+        if record is None or record["lease"] != task.lease:
+            return False
+        self.client.zrem(self._leased, task.id)
+        if retry and task.attempts < task.max_attempts:
+            record.update(state=QUEUED, lease=None, error=error)
+            self._store(record)
+            self.client.zadd(self._ready(task.kind), {task.id: time.time() + self._backoff(task.attempts)})
+            return True
+        record.update(state=FAILED, lease=None, error=error)
+        self._store(record, ttl=self.result_ttl)
+        return False
+
+    def cancel(self, task_id):
+        record = self._load(task_id)
+        if record is None or record["state"] in FINISHED:
+            return
+        self.client.zrem(self._ready(record["kind"]), task_id)
+        self.client.zrem(self._leased, task_id)
+        record.update(state=CANCELLED, lease=None)
+        self._store(record, ttl=self.result_ttl)
+
+    def status(self, task_id):
+        record = self._load(task_id)
+        if record is None:
+            return None
+        return {key: record[key] for key in ("state", "attempts", "result", "error")}
+
+    def forget(self, task_id):
+        self.client.delete(self._key(task_id))
+
+    def stats(self):
+        kinds = [self._text(kind) for kind in self.client.zrangebyscore(self._kinds, "-inf", "+inf")]
+        return {
+            QUEUED: sum(self.client.zcard(self._ready(kind)) for kind in kinds),
+            LEASED: self.client.zcard(self._leased),
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_work_queue():
+    """
+    Return the process-wide work queue, creating it on first use.
+
+    The backend is "redis" (REDIS_URL) when EXTRACTION_QUEUE is "redis",
+    otherwise SQLite at WORK_QUEUE_PATH.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            settings = get_settings()
+            if settings.extraction_queue == "redis":
+                _queue = RedisWorkQueue.from_url(settings.redis_url)
+            else:
+                _queue = SQLiteWorkQueue(settings.work_queue_path)
+            logger.info(f"Using {type(_queue).__name__} for the work queue")
+        return _queue
+
+
+def set_work_queue(queue):
+    """Replace the process-wide work queue (used by tests and tools)."""
+    global _queue
+    _queue = queue
@@ -0,0 +1,172 @@
+"""
+Extraction worker.
+
+Claims extraction tasks (PDFs, web articles, YouTube transcripts) from the
+work queue and runs them, so API processes started with EXTRACTION_QUEUE set
+do not extract sources themselves. Run the workers with the same
+EXTRACTION_QUEUE: "sqlite" for workers on the same host as the API, "redis"
+(REDIS_URL) for workers on any node, which then need the API's uploads
+directory on shared storage to read PDFs.
+
+While a task runs its lease is extended by heartbeats; when a heartbeat
+finds the task cancelled (its request went away or ran out of time) the
+extraction is stopped. Failed attempts are retried with backoff by whichever
+worker claims the task next, and tasks of a worker that died are retried
+once their lease expires.
+
+Usage:
+    EXTRACTION_QUEUE=sqlite python -m app.worker --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from app.config import get_settings
+from app.services.extractionQueue import EXTRACTORS
+from app.utils import metrics
+from app.utils.cancellation import CancelToken, WorkCancelled, cancel_scope
+from app.utils.deadline import Deadline, DeadlineExceeded, check_deadline, deadline_scope
+from app.utils.logger import setup_logger
+from app.utils.work_queue import CANCELLED, DONE, FAILED, error_record, get_work_queue
+
+logger = setup_logger(__name__)
+
+RETRY = "retry"
+
+
+def run_task(queue, task, visibility_timeout):
+    """
+    Run one claimed task and acknowledge it with its result or error.
+
+    Args:
+        queue: The work queue the task was claimed from
+        task: The claimed Task
+        visibility_timeout: Lease length; heartbeats renew it every third of it
+
+    Returns:
+        str: DONE, RETRY (failed, will be retried), FAILED or CANCELLED
+    """
+    fn = EXTRACTORS.get(task.kind)
+    if fn is None:
+        queue.fail(task, {"type": "ValueError", "message": f"Unknown task kind: {task.kind}"}, retry=False)
+        return FAILED
+
+    expires_at = task.payload.get("deadline")
+    deadline = Deadline(expires_at - time.time()) if expires_at else None
+    token = CancelToken()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(visibility_timeout / 3):
+            if not queue.heartbeat(task, visibility_timeout):
+                logger.info(f"Task {task.id} was cancelled or taken over, stopping it")
+                token.cancel()
+                return
+
+    beat = threading.Thread(target=heartbeat, name=f"heartbeat-{task.id[:8]}", daemon=True)
+    beat.start()
+    started = time.time()
+    try:
+        with deadline_scope(deadline), cancel_scope(token):
+            check_deadline(f"{task.kind} task {task.id}")
+            target = task.payload["target"]
+            result = asyncio.run(fn(target)) if asyncio.iscoroutinefunction(fn) else fn(target)
+    except WorkCancelled:
+        outcome = CANCELLED
+    except Exception as e:
+        logger.warning(f"Task {task.id} ({task.kind}) failed on attempt {task.attempts}/{task.max_attempts}: {e}")
+        # A request that ran out of time will not be there to take a retry's result
+        retried = queue.fail(task, error_record(e), retry=not isinstance(e, DeadlineExceeded))
+        outcome = RETRY if retried else FAILED
+    else:
+        queue.complete(task, result)
+        outcome = DONE
+    finally:
+        stop.set()
+        beat.join()
+
+    metrics.increment("work_queue_tasks_total", kind=task.kind, outcome=outcome)
+    logger.info(f"Task {task.id} ({task.kind}, attempt {task.attempts}): {outcome} in {time.time() - started:.1f}s")
+    return outcome
+
+
+def work(queue, kinds=None, stop=None, until_idle=False, idle_seconds=0.5):
+    """
+    Claim and run tasks one at a time.
+
+    Args:
+        queue: The work queue
+        kinds: Optional task kinds to take (default: all)
+        stop: Optional threading.Event; the worker stops after its current task once set
+        until_idle: Return as soon as no task is ready instead of waiting for more
+        idle_seconds: Wait between claims while the queue is empty
+
+    Returns:
+        dict: Number of tasks per outcome
+    """
+    visibility_timeout = get_settings().work_queue_visibility_seconds
+    stop = stop or threading.Event()
+    counts = {}
+    while not stop.is_set():
+        task = queue.claim(kinds, visibility_timeout)
+        if task is None:
+            if until_idle:
+                break
+            stop.wait(idle_seconds)
+            continue
+        outcome = run_task(queue, task, visibility_timeout)
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+def _serve(kinds, until_idle):
+    stop = threading.Event()
+    # Finish the current task before exiting; one left unfinished would only
+    # be retried once its lease expires
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    logger.info(f"Worker {os.getpid()} taking {', '.join(kinds or EXTRACTORS)} tasks")
+    counts = work(get_work_queue(), kinds, stop, until_idle)
+    logger.info(f"Worker {os.getpid()} stopped after {counts or 'no tasks'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run extraction tasks queued by the API processes.")
+    parser.add_argument("--processes", "-p", type=int, default=1, help="Worker processes to run")
+    parser.add_argument("--kinds", default=None, help=f"Comma-separated task kinds to take ({', '.join(EXTRACTORS)})")
+    parser.add_argument("--until-idle", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args(argv)
+
+    if not get_settings().extraction_queue:
+        print("EXTRACTION_QUEUE is not set; set it to sqlite or redis, as for the API processes", file=sys.stderr)
+        return 2
+    kinds = args.kinds.split(",") if args.kinds else None
+    unknown = set(kinds or ()) - set(EXTRACTORS)
+    if unknown:
+        print(f"Unknown task kinds: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    if args.processes <= 1:
+        _serve(kinds, args.until_idle)
+        return 0
+    processes = [
+        multiprocessing.Process(target=_serve, args=(kinds, args.until_idle), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # Ctrl-C reaches the children directly; SIGTERM is passed on to them. Either
+    # way they stop after their current task
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""
+Shared fixtures of the test suite.
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config import get_settings
+from app.services import gemini, guideStore, resultStore
+from app.utils import shared_state
+from fake_gemini import FakeGeminiClient
+
+
+@pytest.fixture(autouse=True)
+def result_dir(monkeypatch, tmp_path):
+    """Keep results stored by the tests out of the real result store."""
+    monkeypatch.setattr(resultStore, "RESULT_DIR", tmp_path / "results")
+    return tmp_path / "results"
+
+
+@pytest.fixture
+def fake_client(monkeypatch, tmp_path):
+    """
+    Answer Gemini calls with a FakeGeminiClient, without the rate limit gap.
+
+    Guides are stored under tmp_path and the shared state is kept in memory,
+    so no cached result or lock leaks from one test into another. Tests that
+    need another stand-in patch gemini._create_client on top of this.
+    """
+    fake = FakeGeminiClient()
+    monkeypatch.setattr(gemini, "_create_client", fake)
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    monkeypatch.setattr(get_settings(), "gemini_api_key", "test-key")
+    monkeypatch.setattr(guideStore, "GUIDE_DIR", tmp_path / "guides")
+    monkeypatch.setattr(shared_state, "_backend", shared_state.MemoryStateBackend())
+    return fake
+
+
+@pytest.fixture
+def client(fake_client):
+    """Test client of the app, whose Gemini calls go to fake_client."""
+    return TestClient(app)
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the Gemini client used by the offline tests.
+
+Topic extraction prompts are answered by treating every "Topic: content"
+line of the analysed text as one topic; study guide prompts echo the topics
+back with a generated summary; multi-source topic extraction prompts get the
+topics of each source. Single-call prompts get both at once, with
+the content of each topic attributed to its sources.
+"""
+import json
+import threading
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _topic_lines(text):
+    """Treat every "Topic: content" line of text as one topic."""
+    topics = {}
+    for line in text.splitlines():
+        if ":" in line:
+            name, content = line.split(":", 1)
+            if name.strip() and content.strip():
+                topics[name.strip()] = content.strip()
+    return topics
+
+
+class FakeModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        return self._owner.respond(model, contents)
+
+
+class FakeGeminiClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self.models = FakeModels(self)
+
+    def __call__(self, api_key=None, **kwargs):
+        # Allows the instance to stand in for the genai.Client class
+        return self
+
+    def respond(self, model, prompt):
+        with self._lock:
+            self.calls.append({"model": model, "prompt": prompt})
+        if self.latency:
+            time.sleep(self.latency)
+        if "TEXT TO ANALYZE:" in prompt:
+            text = prompt.split("TEXT TO ANALYZE:", 1)[1].rsplit("Return ONLY", 1)[0]
+            return FakeResponse(json.dumps(_topic_lines(text)))
+        if "SOURCES FOR TOPIC EXTRACTION:" in prompt:
+            # Multi-source topic extraction: the content of each topic by source number
+            text = prompt.split("SOURCES FOR TOPIC EXTRACTION:", 1)[1].rsplit("Return ONLY", 1)[0]
+            topics = {}
+            for number, source in enumerate(text.split("SOURCE ")[1:], 1):
+                for name, content in _topic_lines(source.split(":", 1)[1]).items():
+                    topics.setdefault(name, {})[str(number)] = content
+            return FakeResponse(json.dumps(topics))
+        if "SOURCES TO ANALYZE:" in prompt:
+            # Single-call prompt: topics of every source and their guide entries at once
+            text = prompt.split("SOURCES TO ANALYZE:", 1)[1].split("Return ONLY", 1)[0]
+            entries = {}
+            for number, source in enumerate(text.split("SOURCE ")[1:], 1):
+                for name, content in _topic_lines(source.split(":", 1)[1]).items():
+                    entry = entries.setdefault(name, {
+                        "topic": name, "content": {}, "summary": f"Summary of {name}", "key_points": [name]
+                    })
+                    entry["content"][str(number)] = content
+            guide = {"overview": f"Covers {len(entries)} topics.", "topics": list(entries.values())}
+            return FakeResponse(json.dumps(guide))
+        topics_json = prompt.split("TOPICS AND CONTENT:", 1)[1].split("Generate a complete study guide", 1)[0]
+        topics = json.loads(topics_json)
+        guide = {
+            "overview": f"Covers {len(topics)} topics.",
+            "topics": [
+                {"topic": name, "original_content": content, "summary": f"Summary of {name}", "key_points": [name]}
+                for name, content in topics.items()
+            ]
+        }
+        return FakeResponse(json.dumps(guide))
@@ -0,0 +1,222 @@
+"""
+Tests for the adaptive concurrency limit of Gemini calls, including a
+simulation of a rate-limited service and of a service that slows down under
+load, showing that the limit converges near their capacity.
+
+Run directly to print the simulation results for a few capacities:
+    python tests/test_adaptive_concurrency.py
+"""
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import gemini, modelRouter
+from app.services.modelRouter import ModelRouter
+from app.utils import metrics, scheduler
+from app.utils.adaptive_limit import AdaptiveLimit
+from app.utils.scheduler import CallScheduler
+from fake_gemini import FakeAPIError, FakeGeminiClient
+
+PROMPT = "TEXT TO ANALYZE:\nTopic: content\nReturn ONLY the JSON object"
+
+
+def test_rate_limits_cut_the_limit_once_per_overload():
+    metrics.reset()
+    limit = AdaptiveLimit(initial=8, maximum=16)
+    assert limit.record(started=10.0, latency=1.0, in_flight=8, overloaded=True) == 4
+    # Calls that were already in flight when the limit was cut do not cut it again
+    assert limit.record(started=10.5, latency=0.6, in_flight=7, overloaded=True) == 4
+    assert limit.record(started=11.5, latency=0.5, in_flight=4, overloaded=True) == 2
+    assert metrics.get_counter("gemini_concurrency_decreases_total") == 2
+    gauges = {gauge["name"]: gauge["value"] for gauge in metrics.snapshot()["gauges"]}
+    assert gauges["gemini_concurrency_limit"] == 2
+
+
+def test_limit_grows_only_while_in_use():
+    limit = AdaptiveLimit(initial=4, maximum=6)
+    for i in range(100):
+        limit.record(started=i, latency=1.0, in_flight=1)
+    assert limit.limit == 4
+
+    for i in range(100):
+        limit.record(started=i, latency=1.0, in_flight=limit.limit)
+    assert limit.limit == 6
+
+
+def test_latency_spikes_cut_the_limit():
+    limit = AdaptiveLimit(initial=8, maximum=8)
+    for i in range(20):
+        limit.record(started=i, latency=1.0, in_flight=8, key="topics")
+        limit.record(started=i, latency=5.0, in_flight=8, key="guide")
+    assert limit.limit == 8
+
+    for i in range(20, 40):
+        limit.record(started=i, latency=4.0, in_flight=8, key="topics")
+    assert limit.limit < 8
+    assert limit.stats()["latency_seconds"]["guide"] == {"recent": 5.0, "usual": 5.0}
+
+
+# ---------------------------------------------------------------------------
+# Simulation
+# ---------------------------------------------------------------------------
+
+def simulate(capacity, mode, clients=40, duration=600.0, seed=1):
+    """
+    Run clients that always have a call to make against a simulated service,
+    in virtual time, with the number of calls in flight set by an AdaptiveLimit.
+
+    Args:
+        capacity: Function of the time returning how many calls the service handles at once
+        mode: "quota" answers 429 above capacity; "queue" slows every call down
+            in proportion to the calls beyond capacity
+        clients: Callers competing for the limit
+        duration: Simulated seconds
+
+    Returns:
+        list: (time, limit, rate limited) after every call
+    """
+    rng = random.Random(seed)
+    limit = AdaptiveLimit(initial=2, maximum=64)
+    now, in_flight, pending, trace = 0.0, 0, [], []
+
+    def start_calls():
+        nonlocal in_flight
+        while in_flight < min(limit.limit, clients):
+            in_flight += 1
+            noise = rng.uniform(0.5, 1.5)
+            if mode == "quota" and in_flight > capacity(now):
+                latency, overloaded = 0.1 * noise, True
+            else:
+                latency = noise * (max(1.0, in_flight / capacity(now)) if mode == "queue" else 1.0)
+                overloaded = False
+            heapq.heappush(pending, (now + latency, now, latency, overloaded))
+
+    start_calls()
+    while pending and now < duration:
+        now, started, latency, overloaded = heapq.heappop(pending)
+        limit.record(started, latency, in_flight, overloaded, key="sim")
+        in_flight -= 1
+        trace.append((now, limit.limit, overloaded))
+        start_calls()
+    return trace
+
+
+def settled(trace, start, end=None):
+    """Average limit and share of rate-limited calls between two times."""
+    window = [(size, overloaded) for at, size, overloaded in trace if at >= start and (end is None or at < end)]
+    return sum(size for size, _ in window) / len(window), sum(o for _, o in window) / len(window)
+
+
+@pytest.mark.parametrize("capacity", [4, 10, 25])
+def test_simulation_converges_below_a_quota(capacity):
+    average, rejected = settled(simulate(lambda now: capacity, "quota"), 300)
+    assert 0.6 * capacity <= average <= capacity
+    assert rejected < 0.15
+
+
+@pytest.mark.parametrize("capacity", [4, 10])
+def test_simulation_converges_when_the_service_queues(capacity):
+    average, _ = settled(simulate(lambda now: capacity, "queue"), 300)
+    # Latency stays within twice that of an unloaded service
+    assert capacity <= average <= 2 * capacity
+
+
+@pytest.mark.parametrize("mode", ["quota", "queue"])
+def test_simulation_follows_a_capacity_drop(mode):
+    trace = simulate(lambda now: 20 if now < 300 else 6, mode)
+    before, _ = settled(trace, 200, 300)
+    after, _ = settled(trace, 450)
+    assert after < before / 2
+    assert after <= 2 * 6
+
+
+# ---------------------------------------------------------------------------
+# Against a local endpoint
+# ---------------------------------------------------------------------------
+
+class QuotaEndpoint:
+    """Local stand-in for a service that answers 429 to calls beyond `capacity` in flight."""
+
+    def __init__(self, capacity, latency=0.01):
+        self.capacity = capacity
+        self.latency = latency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def call(self):
+        with self._lock:
+            self.in_flight += 1
+            overloaded = self.in_flight > self.capacity
+        try:
+            if overloaded:
+                raise FakeAPIError(429, "RESOURCE_EXHAUSTED")
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_limit_converges_against_a_rate_limited_endpoint():
+    endpoint = QuotaEndpoint(capacity=6)
+    calls = CallScheduler(max_concurrent=24, limit=AdaptiveLimit(initial=24, maximum=24))
+    outcomes = []
+
+    def worker():
+        for _ in range(40):
+            with calls.slot() as call:
+                started = time.time()
+                try:
+                    endpoint.call()
+                except FakeAPIError:
+                    call.record(time.time() - started, overloaded=True)
+                    outcomes.append(True)
+                else:
+                    call.record(time.time() - started, key="endpoint")
+                    outcomes.append(False)
+
+    threads = [threading.Thread(target=worker) for _ in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert calls.limit.limit <= 2 * endpoint.capacity
+    later = outcomes[len(outcomes) // 2:]
+    assert sum(later) / len(later) < 0.2
+    assert calls.stats()["running"] == 0
+
+
+def test_gemini_calls_report_to_the_limit(monkeypatch):
+    monkeypatch.setattr(modelRouter, "_router", ModelRouter({"topics": ["lite", "flash"]}))
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    calls = CallScheduler(max_concurrent=8, limit=AdaptiveLimit(initial=8, maximum=8))
+    monkeypatch.setattr(scheduler, "_scheduler", calls)
+
+    class RateLimitedLite(FakeGeminiClient):
+        def respond(self, model, prompt):
+            if model == "lite":
+                raise FakeAPIError(429, "RESOURCE_EXHAUSTED")
+            return super().respond(model, prompt)
+
+    gemini._call_gemini_with_retry(RateLimitedLite(), ["lite", "flash"], PROMPT, stage="topics")
+    stats = calls.stats()
+    assert stats["limit"] == 4
+    assert list(stats["adaptive"]["latency_seconds"]) == ["flash/topics"]
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    print(f"{'mode':>6} {'capacity':>9} {'limit':>6} {'429s':>6}")
+    for mode in ("quota", "queue"):
+        for capacity in (4, 10, 25):
+            average, rejected = settled(simulate(lambda now: capacity, mode), 300)
+            print(f"{mode:>6} {capacity:>9} {average:>6.1f} {rejected:>6.1%}")
@@ -0,0 +1,97 @@
+"""
+Tests for the batch study guide CLI.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import batch
+from app.services import guideStore
+
+
+def write_manifest(tmp_path, guides):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"guides": guides}))
+    return path
+
+
+GUIDES = [
+    {"id": "loops", "text": ["Loops: for and while"]},
+    {"id": "recursion", "text": ["Recursion: a function calling itself", "Base case: stops recursion"]},
+    {"id": "sets", "text": ["Sets: unordered collections"]},
+]
+
+
+def test_manifest_validation(tmp_path):
+    pdf_dir = tmp_path / "cpsc110"
+    pdf_dir.mkdir()
+    entries = batch.load_manifest(write_manifest(tmp_path, [{"id": "cpsc110", "pdfs": ["cpsc110/notes.pdf"]}]))
+    assert entries == [{
+        "id": "cpsc110", "pdfs": [str(pdf_dir / "notes.pdf")], "urls": [], "videos": [], "text": []
+    }]
+
+    for guides in (
+        [{"id": "../escape", "text": ["x"]}],
+        [{"id": "a", "text": ["x"]}, {"id": "a", "text": ["y"]}],
+        [{"id": "empty"}],
+        [{"id": "a", "urls": "https://example.com"}],
+    ):
+        with pytest.raises(ValueError):
+            batch.load_manifest(write_manifest(tmp_path, guides))
+
+
+def test_batch_writes_guides_and_checkpoint(fake_client, tmp_path):
+    out = tmp_path / "out"
+    lines = []
+    stats = batch.run_batch(batch.load_manifest(write_manifest(tmp_path, GUIDES)), out, workers=0, report=lines.append)
+
+    assert stats["done"] == 3 and stats["failed"] == 0 and stats["skipped"] == 0
+    assert stats["guides_per_minute"] > 0 and stats["p95_guide_seconds"] is not None
+    assert len(lines) == 3
+    assert "Loops" in (out / "loops.md").read_text()
+    assert "Base case" in (out / "recursion.md").read_text()
+
+    checkpoint = batch.read_checkpoint(out)
+    assert {record["status"] for record in checkpoint.values()} == {"done"}
+    assert checkpoint["recursion"]["sources"] == 2
+    assert guideStore.load_guide(checkpoint["sets"]["guide_id"]) is not None
+
+
+def test_resume_skips_completed_guides(fake_client, tmp_path):
+    out = tmp_path / "out"
+    entries = batch.load_manifest(write_manifest(tmp_path, GUIDES + [{"id": "missing", "pdfs": ["nope.pdf"]}]))
+
+    first = batch.run_batch(entries, out, workers=0, report=lambda line: None)
+    assert first["done"] == 3 and first["failed"] == 1
+    assert "nope.pdf" in batch.read_checkpoint(out)["missing"]["error"]
+    calls = len(fake_client.calls)
+
+    # Everything already processed: nothing is generated again
+    second = batch.run_batch(entries, out, workers=0, report=lambda line: None)
+    assert second["skipped"] == 4 and second["guides"] == 0
+    assert len(fake_client.calls) == calls
+
+    # A crash can leave a partial checkpoint line; it is ignored
+    with open(out / batch.CHECKPOINT_FILE, "a") as f:
+        f.write('{"id": "lo')
+    third = batch.run_batch(entries, out, workers=0, retry_failed=True, report=lambda line: None)
+    assert third["skipped"] == 3 and third["failed"] == 1
+    assert batch.read_checkpoint(out)["missing"]["status"] == "failed"
+
+
+def test_process_pool_and_cli(fake_client, tmp_path, capsys):
+    out = tmp_path / "out"
+    manifest = write_manifest(tmp_path, GUIDES)
+    # Earlier in-process runs started the parent's Gemini call threads
+    batch.run_batch(batch.load_manifest(manifest), tmp_path / "warm", workers=0, report=lambda line: None)
+
+    assert batch.main([str(manifest), "--output", str(out), "--workers", "2"]) == 0
+    assert "3 done, 0 failed" in capsys.readouterr().out
+    assert sorted(path.name for path in out.glob("*.md")) == ["loops.md", "recursion.md", "sets.md"]
+
+    assert batch.main([str(tmp_path / "absent.json"), "--output", str(out)]) == 2
@@ -0,0 +1,134 @@
+"""
+Tests for the source access stats and cache warming.
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api import routes
+from app.config import get_settings
+from app.services import sourceStats
+from app.services.sourceStats import SourceAccessStats
+from app.utils import scheduler
+from app.utils.scheduler import CallScheduler
+
+ADMIN = {"X-Admin-Token": "secret"}
+LOOPS = "https://example.com/loops"
+SETS = "https://example.com/sets"
+ARTICLES = {
+    LOOPS: "Loops: for and while loops repeat work",
+    SETS: "Sets: unordered collections of unique items",
+}
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Serve the test articles instead of fetching pages, recording each extraction."""
+    calls = []
+
+    def extract(url):
+        calls.append(url)
+        time.sleep(0.02)
+        if url not in ARTICLES:
+            raise ValueError("404 Not Found")
+        return {"title": url, "text": ARTICLES[url]}
+
+    monkeypatch.setattr(routes, "extract_web_article", extract)
+    return calls
+
+
+@pytest.fixture
+def client(monkeypatch, fake_client, extracted):
+    monkeypatch.setattr(get_settings(), "admin_token", "secret")
+    monkeypatch.setattr(scheduler, "_scheduler", CallScheduler(max_concurrent=8))
+    # One event loop for all requests, so warming jobs outlive the request that started them
+    with TestClient(app) as client:
+        yield client
+
+
+def wait_for_report(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        report = client.get(f"/api/admin/warm/{job_id}", headers=ADMIN).json()
+        if report["state"] == "done":
+            return report
+        time.sleep(0.02)
+    raise AssertionError(f"Warming job {job_id} did not finish")
+
+
+def test_access_stats_count_canonical_sources(tmp_path):
+    stats = SourceAccessStats(tmp_path / "access.db")
+    stats.record(urls=[LOOPS, SETS], videos=["https://www.youtube.com/watch?v=dQw4w9WgXcQ"])
+    stats.record(urls=[LOOPS + "?utm_source=mail"])
+    stats.record(urls=[LOOPS, None])
+
+    top = stats.top(2)
+    assert [(row["id"], row["count"]) for row in top] == [("url:https://example.com/loops", 3), (top[1]["id"], 1)]
+    assert {row["kind"] for row in stats.top(10)} == {"url", "video"}
+    assert stats.top(10, since=time.time() + 1) == []
+
+
+def test_warming_fills_the_caches_for_later_requests(client, fake_client, extracted):
+    response = client.post(
+        "/api/admin/warm", data={"sources": json.dumps({"urls": [LOOPS, "https://example.com/missing"]})},
+        headers=ADMIN
+    )
+    assert response.status_code == 202
+    assert response.json()["sources"] == 2
+
+    report = wait_for_report(client, response.json()["job_id"])
+    assert (report["warmed"], report["cached"], report["failed"], report["coverage"]) == (1, 0, 1, 0.5)
+    results = {result["label"]: result for result in report["results"]}
+    assert results[LOOPS]["stages"] == ["extraction", "topics"]
+    assert results[LOOPS]["seconds_saved"] > 0
+    assert report["time_saved_seconds"] == pytest.approx(results[LOOPS]["seconds_saved"])
+    assert results["https://example.com/missing"]["status"] == "failed"
+    # Warming calls are made in the background class, behind interactive requests
+    assert scheduler.get_scheduler().stats()["dispatched"]["background"] == len(fake_client.calls)
+
+    extracted.clear()
+    calls = len(fake_client.calls)
+    response = client.post("/api/get-output", data={"sources": json.dumps({"urls": [LOOPS]})})
+    assert response.status_code == 200
+    assert "Loops" in response.json()["study_guide"]
+    # Only the study guide itself was generated
+    assert extracted == []
+    assert len(fake_client.calls) == calls + 1
+
+
+def test_warming_again_reports_cached_sources(client):
+    first = client.post("/api/admin/warm", data={"sources": json.dumps({"urls": [LOOPS]})}, headers=ADMIN)
+    wait_for_report(client, first.json()["job_id"])
+    second = client.post("/api/admin/warm", data={"sources": json.dumps({"urls": [LOOPS]})}, headers=ADMIN)
+    report = wait_for_report(client, second.json()["job_id"])
+    assert (report["warmed"], report["cached"], report["coverage"], report["time_saved_seconds"]) == (0, 1, 1.0, 0)
+
+
+def test_warming_the_most_requested_sources(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(get_settings(), "source_access_stats", True)
+    monkeypatch.setattr(sourceStats, "_stats", SourceAccessStats(tmp_path / "access.db"))
+    # Requests count their sources even when they fail
+    for urls in ([SETS], [SETS, LOOPS], [SETS]):
+        client.post("/api/get-output", data={"sources": json.dumps({"urls": urls}), "deadline_seconds": 0.001})
+    assert [row["count"] for row in sourceStats.get_source_stats().top(2)] == [3, 1]
+
+    response = client.post("/api/admin/warm", data={"top": 1}, headers=ADMIN)
+    report = wait_for_report(client, response.json()["job_id"])
+    assert [result["label"] for result in report["results"]] == [SETS]
+    assert report["coverage"] == 1.0
+
+
+def test_warming_requires_admin_and_sources(client):
+    assert client.post("/api/admin/warm", data={"sources": json.dumps({"urls": [LOOPS]})}).status_code == 403
+    assert client.get("/api/admin/warm/unknown", headers=ADMIN).status_code == 404
+    assert client.post("/api/admin/warm", headers=ADMIN).status_code == 400
+    # The access stats are off by default
+    assert client.post("/api/admin/warm", data={"top": 5}, headers=ADMIN).status_code == 400
@@ -0,0 +1,149 @@
+"""
+Tests for cancelling work when clients disconnect.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from app.api import routes
+from app.config import get_settings
+from app.services import gemini
+from app.utils import metrics
+from app.utils.cancellation import WorkCancelled
+from app.utils.deadline import check_deadline
+from app.utils.singleflight import SingleFlight
+from fake_gemini import FakeGeminiClient
+
+PROMPT = "TEXT TO ANALYZE:\nTopic: content\nReturn ONLY the JSON object"
+
+
+class FakeRequest:
+    """Reports a disconnect after `connected_polls` calls to is_disconnected."""
+
+    def __init__(self, connected_polls):
+        self.connected_polls = connected_polls
+
+    async def is_disconnected(self):
+        self.connected_polls -= 1
+        return self.connected_polls < 0
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(get_settings(), "disconnect_poll_seconds", 0.05)
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    metrics.reset()
+
+
+def test_work_continues_until_every_caller_is_cancelled():
+    progress = {"pages": 0, "stopped": False}
+
+    def extract():
+        try:
+            for _ in range(100):
+                check_deadline("page")
+                progress["pages"] += 1
+                time.sleep(0.02)
+        except WorkCancelled:
+            progress["stopped"] = True
+            raise
+        return "done"
+
+    async def run():
+        group = SingleFlight("test")
+        first = asyncio.ensure_future(group.do("key", extract))
+        second = asyncio.ensure_future(group.do("key", extract))
+        await asyncio.sleep(0.1)
+
+        first.cancel()
+        await asyncio.sleep(0.1)
+        assert not group.pending("key").done()
+
+        second.cancel()
+        await asyncio.sleep(0.1)
+        assert group.in_flight() == 0
+
+    asyncio.run(run())
+    assert progress["stopped"]
+    assert progress["pages"] < 50
+    assert metrics.get_counter("flight_cancellations_total", flight="test") == 1
+
+
+def test_disconnect_abandons_gemini_call():
+    client = FakeGeminiClient(latency=2.0)
+    group = SingleFlight("llm-test")
+
+    async def run():
+        work = group.do("key", gemini._call_gemini_with_retry, client, "m", PROMPT, stage="topics")
+        return await routes._until_disconnected(FakeRequest(connected_polls=2), "req", "get_output", work)
+
+    started = time.time()
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(run())
+    assert excinfo.value.status_code == 499
+    assert time.time() - started < 1.0
+
+    # The waiting worker thread notices the cancellation and gives up on the call
+    for _ in range(40):
+        if metrics.get_counter("gemini_calls_cancelled_total", model="m", stage="topics"):
+            break
+        time.sleep(0.05)
+    assert metrics.get_counter("gemini_calls_cancelled_total", model="m", stage="topics") == 1
+    assert metrics.get_counter("requests_cancelled_total", endpoint="get_output") == 1
+
+
+def test_connected_client_gets_result():
+    async def run():
+        async def work():
+            await asyncio.sleep(0.1)
+            return "guide"
+        return await routes._until_disconnected(FakeRequest(connected_polls=100), "req", "get_output", work())
+
+    assert asyncio.run(run()) == "guide"
+
+
+def test_disconnect_stops_pdf_extraction_between_pages(tmp_path, monkeypatch):
+    import pymupdf
+    from app.services.pdfExtraction import extract_pdf_text
+
+    path = str(tmp_path / "long.pdf")
+    doc = pymupdf.open()
+    for i in range(100):
+        doc.new_page().insert_text((72, 72), f"Page text {i}")
+    doc.save(path)
+    doc.close()
+
+    pages = []
+    get_text = pymupdf.Page.get_text
+
+    def slow_get_text(self, *args, **kwargs):
+        pages.append(self.number)
+        time.sleep(0.02)
+        return get_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(pymupdf.Page, "get_text", slow_get_text)
+    group = SingleFlight("extraction-test")
+
+    async def run():
+        work = group.do(path, extract_pdf_text, path)
+        return await routes._until_disconnected(FakeRequest(connected_polls=2), "req", "get_output", work)
+
+    started = time.time()
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(run())
+    assert excinfo.value.status_code == 499
+    # The disconnect was noticed while pages were still being parsed
+    assert time.time() - started < 1.0
+
+    # The worker thread stops at its next page
+    time.sleep(0.2)
+    read = len(pages)
+    time.sleep(0.2)
+    assert len(pages) == read < 100
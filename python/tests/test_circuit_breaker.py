@@ -0,0 +1,182 @@
+"""
+Tests for the backend circuit breakers.
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config import get_settings
+from app.services import gemini
+from app.services.webArticleExtraction import extract_web_article
+from app.services.youtubeTranscript import get_youtube_transcript
+from app.utils import metrics
+from app.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from app.utils.circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_breaker, reset_breakers
+)
+from fake_gemini import FakeGeminiClient
+
+PROMPT = "TEXT TO ANALYZE:\nTopic: content\nReturn ONLY the JSON object"
+
+
+class UnavailableClient(FakeGeminiClient):
+    def respond(self, model, prompt):
+        super().respond(model, prompt)
+        raise Exception("503 UNAVAILABLE: the model is overloaded")
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "circuit_min_calls", 3)
+    monkeypatch.setattr(settings, "circuit_failure_rate", 0.5)
+    monkeypatch.setattr(settings, "circuit_open_seconds", 30)
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    reset_breakers()
+    metrics.reset()
+    yield
+    reset_breakers()
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, open_seconds=0.1)
+    for failed in (False, True, False, True):
+        breaker.allow()
+        breaker.record_failure() if failed else breaker.record_success()
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.state == HALF_OPEN
+    breaker.allow()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert metrics.get_counter("circuit_rejections_total", backend="test") == 2
+
+
+def test_gemini_fails_fast_once_circuit_opens():
+    client = UnavailableClient()
+    with pytest.raises(CircuitOpenError):
+        gemini._call_gemini_with_retry(client, "m", PROMPT, initial_delay=0)
+    # Three failures open the circuit; the remaining retries are not attempted
+    assert len(client.calls) == 3
+
+    started = time.time()
+    with pytest.raises(CircuitOpenError) as excinfo:
+        gemini._call_gemini_with_retry(client, "m", PROMPT, initial_delay=0)
+    assert time.time() - started < 0.1
+    assert len(client.calls) == 3
+    assert "temporarily unavailable" in str(excinfo.value)
+    assert get_breaker("gemini").stats()["state"] == OPEN
+
+
+def test_youtube_throttling_opens_circuit(monkeypatch):
+    import youtube_transcript_api as yta
+
+    class BlockedApi:
+        calls = 0
+
+        def list(self, video_id):
+            BlockedApi.calls += 1
+            raise yta._errors.RequestBlocked(video_id)
+
+    monkeypatch.setattr(yta, "YouTubeTranscriptApi", BlockedApi)
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            get_youtube_transcript(url)
+    assert BlockedApi.calls == 3
+    assert get_breaker("youtube").state == OPEN
+
+
+def test_expired_deadline_leaves_youtube_circuit_closed(monkeypatch):
+    import youtube_transcript_api as yta
+
+    class SlowListing:
+        language_code = "en"
+
+        def __iter__(self):
+            return iter([self])
+
+        def find_transcript(self, languages):
+            return self
+
+        def fetch(self):
+            raise AssertionError("The transcript must not be downloaded past the deadline")
+
+    class SlowApi:
+        def list(self, video_id):
+            time.sleep(0.02)
+            return SlowListing()
+
+    monkeypatch.setattr(yta, "YouTubeTranscriptApi", SlowApi)
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    # Expired before the call, and while it was being made
+    for seconds in (0, 0, 0, 0.01, 0.01, 0.01):
+        with deadline_scope(Deadline(seconds)), pytest.raises(DeadlineExceeded):
+            get_youtube_transcript(url)
+    assert get_breaker("youtube").state == CLOSED
+    assert get_breaker("youtube").stats()["failures"] == 0
+
+
+def test_downloads_cut_short_by_the_deadline_leave_the_host_circuit_closed(monkeypatch):
+    import trafilatura
+
+    timeouts = []
+
+    def fetch_url(url, config=None):
+        # A download given up when its capped timeout runs out
+        timeouts.append(config.getfloat("DEFAULT", "DOWNLOAD_TIMEOUT"))
+        time.sleep(0.02)
+        return None
+
+    monkeypatch.setattr(trafilatura, "fetch_url", fetch_url)
+    url = "https://slow.example.com/article"
+    for seconds in (0.01, 0.01, 0.01, 5, 5):
+        with deadline_scope(Deadline(seconds)), pytest.raises((DeadlineExceeded, ValueError)):
+            extract_web_article(url)
+    assert len(timeouts) == 5
+    assert get_breaker("web:slow.example.com").state == CLOSED
+    assert get_breaker("web:slow.example.com").stats()["failures"] == 0
+
+    # Without a deadline capping them, failed downloads count against the host
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            extract_web_article(url)
+    assert get_breaker("web:slow.example.com").state == OPEN
+
+
+def test_open_gemini_circuit_returns_503(monkeypatch, fake_client):
+    monkeypatch.setattr(gemini, "_create_client", UnavailableClient())
+    monkeypatch.setattr(gemini, "_call_gemini_with_retry", _no_backoff(gemini._call_gemini_with_retry))
+
+    response = TestClient(app).post("/api/get-output", data={"sources": json.dumps({"text": ["A: b"]})})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+
+    circuits = TestClient(app).get("/api/metrics").json()["circuits"]
+    assert circuits["gemini"]["state"] == OPEN
+
+
+def _no_backoff(fn):
+    def call(*args, **kwargs):
+        kwargs["initial_delay"] = 0
+        return fn(*args, **kwargs)
+    return call
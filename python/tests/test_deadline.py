@@ -0,0 +1,131 @@
+"""
+Tests for the end-to-end request deadline.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services import gemini, guideStore
+from app.utils import shared_state
+from app.utils.cancellation import CancelToken, WorkCancelled, cancel_scope
+from app.utils.circuit_breaker import get_breaker
+from app.utils.deadline import (
+    Deadline, DeadlineExceeded, cap_timeout, check_deadline, current_deadline, deadline_scope
+)
+from fake_gemini import FakeGeminiClient
+
+
+class SlowGuideClient(FakeGeminiClient):
+    """Answers topic extraction immediately but takes `guide_latency` seconds per guide."""
+
+    def __init__(self, guide_latency):
+        super().__init__()
+        self.guide_latency = guide_latency
+
+    def respond(self, model, prompt):
+        if "TOPICS AND CONTENT:" in prompt:
+            time.sleep(self.guide_latency)
+        return super().respond(model, prompt)
+
+
+@pytest.fixture
+def slow_client(monkeypatch, fake_client):
+    fake = SlowGuideClient(guide_latency=2.0)
+    monkeypatch.setattr(gemini, "_create_client", fake)
+    return fake
+
+
+def test_deadline_scope_and_helpers():
+    assert current_deadline() is None
+    assert cap_timeout(30) == 30
+    check_deadline("nothing")  # no deadline, no error
+
+    with deadline_scope(Deadline(5)) as deadline:
+        assert current_deadline() is deadline
+        assert 4 < cap_timeout(30) <= 5
+        assert cap_timeout(1) == 1
+    assert current_deadline() is None
+
+    with deadline_scope(Deadline(0)):
+        with pytest.raises(DeadlineExceeded):
+            check_deadline("extraction")
+
+
+def test_retry_backoff_stops_at_deadline(monkeypatch):
+    class RateLimitedClient(FakeGeminiClient):
+        def respond(self, model, prompt):
+            super().respond(model, prompt)
+            raise Exception("429 RESOURCE_EXHAUSTED")
+
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    client = RateLimitedClient()
+    started = time.time()
+    with deadline_scope(Deadline(1)):
+        with pytest.raises(DeadlineExceeded):
+            gemini._call_gemini_with_retry(client, "m", "TEXT TO ANALYZE:\nA: b\nReturn ONLY", initial_delay=3)
+    # The 3 second backoff does not fit in the budget, so no sleep happens
+    assert time.time() - started < 0.5
+    assert len(client.calls) == 1
+
+
+def test_rate_limit_gap_stops_at_deadline_and_on_cancellation(monkeypatch):
+    monkeypatch.setattr(shared_state, "_backend", shared_state.MemoryStateBackend())
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 5)
+    gemini._rate_limit()  # the next call slot is 5 seconds away
+
+    started = time.time()
+    with deadline_scope(Deadline(1)):
+        with pytest.raises(DeadlineExceeded):
+            gemini._rate_limit()
+    assert time.time() - started < 0.5
+
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+    started = time.time()
+    with cancel_scope(token):
+        with pytest.raises(WorkCancelled):
+            gemini._rate_limit()
+    assert time.time() - started < 1
+
+    # A call that runs out of time in the gap gives back its circuit breaker slot
+    released = []
+    monkeypatch.setattr(get_breaker("gemini"), "release", lambda: released.append(True))
+    client = FakeGeminiClient()
+    with deadline_scope(Deadline(1)):
+        with pytest.raises(DeadlineExceeded):
+            gemini._call_gemini_with_retry(client, "m", "TEXT TO ANALYZE:\nA: b\nReturn ONLY")
+    assert released == [True]
+    assert client.calls == []
+
+
+def test_short_deadline_returns_partial_guide(slow_client):
+    client = TestClient(app)
+    sources = {"text": ["Loops: for and while", "Sets: unordered"]}
+    started = time.time()
+    response = client.post("/api/get-output", data={"sources": json.dumps(sources), "deadline_seconds": "1"})
+    elapsed = time.time() - started
+
+    assert response.status_code == 200
+    body = response.json()
+    assert elapsed < 2
+    assert body["notes"] == ["Summaries and key points were skipped: the time budget ran out while generating them"]
+    assert "Partial study guide" in body["study_guide"]
+    assert "for and while" in body["study_guide"]
+
+    # Topics without generated summaries are regenerated by the next update
+    record = guideStore.load_guide(body["guide_id"])
+    assert record["topics"] == {}
+
+
+def test_invalid_deadline_is_rejected(slow_client):
+    response = TestClient(app).post("/api/get-output", data={"sources": "{}", "deadline_seconds": "0"})
+    assert response.status_code == 400
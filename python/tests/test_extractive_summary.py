@@ -0,0 +1,155 @@
+"""
+Tests for extractive pre-summarization, plus a benchmark of runtime and
+compression ratio over large generated corpora.
+
+Run directly for the full benchmark:
+    python tests/test_extractive_summary.py
+"""
+import json
+import os
+import random
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.extractiveSummary import (
+    TEXTRANK, TFIDF, allocate_budget, split_sentences, summarize_texts
+)
+from app.services.textNormalization import estimate_tokens
+
+
+def make_textbook(seed, chapters=20, sentences_per_chapter=200):
+    """
+    Generate a deterministic "textbook": chapters of sentences drawn mostly
+    from a chapter-specific vocabulary, with shared filler words.
+    """
+    rng = random.Random(seed)
+    filler = ["the", "of", "and", "system", "value", "result", "method", "example", "important", "students"]
+    paragraphs = []
+    for chapter in range(chapters):
+        terms = [f"term{seed}x{chapter}x{i}" for i in range(30)]
+        for start in range(0, sentences_per_chapter, 8):
+            sentences = []
+            for _ in range(8):
+                words = rng.choices(terms, k=rng.randint(4, 9)) + rng.choices(filler, k=rng.randint(3, 8))
+                rng.shuffle(words)
+                sentences.append(" ".join(words).capitalize() + ".")
+            paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def chapters_covered(text, seed, chapters=20):
+    return sum(1 for chapter in range(chapters) if f"term{seed}x{chapter}x" in text)
+
+
+def test_split_sentences():
+    text = "Recursion is useful. It needs a base case! Does it terminate?\n\nHeading\nNext line. 3 items follow."
+    assert split_sentences(text) == [
+        "Recursion is useful.", "It needs a base case!", "Does it terminate?", "Heading\nNext line.", "3 items follow."
+    ]
+
+
+def test_budget_allocation_keeps_every_source():
+    shares = allocate_budget([100_000, 1_000, 50], 10_000)
+    assert shares[2] == 50
+    assert shares[1] == 1_000
+    assert 8_900 <= shares[0] <= 8_950
+    assert allocate_budget([10, 20], 100) == [10, 20]
+
+
+def test_small_inputs_are_unchanged_and_bad_arguments_rejected():
+    assert summarize_texts(["Short text."], 1000) == ["Short text."]
+    with pytest.raises(ValueError):
+        summarize_texts(["x"], 1000, method="lsa")
+    with pytest.raises(ValueError):
+        summarize_texts(["x"], 0)
+
+
+@pytest.mark.parametrize("method", [TEXTRANK, TFIDF])
+def test_compresses_to_budget_with_coverage(method):
+    books = [make_textbook(seed, chapters=10, sentences_per_chapter=80) for seed in (1, 2, 3)]
+    total = sum(estimate_tokens(book) for book in books)
+    budget = total // 10
+
+    summaries = summarize_texts(books, budget, method=method)
+
+    used = sum(estimate_tokens(summary) for summary in summaries)
+    assert budget * 0.8 <= used <= budget
+    for seed, summary in zip((1, 2, 3), summaries):
+        assert summary
+        # Sentences are kept verbatim and in their original order
+        kept = summary.split("\n")
+        book = books[seed - 1]
+        positions = [book.index(sentence) for sentence in kept]
+        assert positions == sorted(positions)
+        assert chapters_covered(summary, seed, chapters=10) >= 8
+
+
+def test_get_output_compresses_to_requested_budget(client):
+    book = make_textbook(7, chapters=5, sentences_per_chapter=40)
+    response = client.post("/api/get-output", data={
+        "sources": json.dumps({"text": [book, "Loops: for and while"]}),
+        "token_budget": "1000"
+    })
+    assert response.status_code == 200
+    tokens = [source["tokens"] for source in response.json()["sources"]]
+    assert sum(t.get("summarized", t["after"]) for t in tokens) <= 1000
+    assert tokens[0]["summarized"] < tokens[0]["after"]
+    # The small source fits its share of the budget and is kept whole
+    assert tokens[1].get("summarized", tokens[1]["after"]) == tokens[1]["after"]
+
+    response = client.post("/api/get-output", data={"sources": "{}", "token_budget": "10", "summarizer": "lsa"})
+    assert response.status_code == 400
+
+
+def test_long_single_sentence_source_keeps_its_start():
+    sentence = " ".join(f"word{i}" for i in range(400)) + "."
+    summaries = summarize_texts([sentence, "Short one. " * 50], 100)
+    assert summaries[0] and sentence.startswith(summaries[0])
+    assert all(summaries)
+    assert sum(estimate_tokens(summary) for summary in summaries) <= 100
+
+
+def test_get_output_with_a_long_single_sentence_source(client):
+    sentence = "Recursion: " + " ".join(f"word{i}" for i in range(400)) + "."
+    response = TestClient(app).post("/api/get-output", data={
+        "sources": json.dumps({"text": [sentence, "Loops: repeat work. " * 50]}),
+        "token_budget": "100"
+    })
+    assert response.status_code == 200
+    assert len(response.json()["sources"]) == 2
+
+
+def run_benchmark(books, ratios=(0.05, 0.2), methods=(TFIDF, TEXTRANK)):
+    """Return (method, ratio, input tokens, output tokens, seconds) rows."""
+    total = sum(estimate_tokens(book) for book in books)
+    rows = []
+    for method in methods:
+        for ratio in ratios:
+            started = time.perf_counter()
+            summaries = summarize_texts(books, int(total * ratio), method=method)
+            elapsed = time.perf_counter() - started
+            rows.append((method, ratio, total, sum(estimate_tokens(s) for s in summaries), elapsed))
+    return rows
+
+
+def test_benchmark_large_corpus_runs_in_seconds():
+    books = [make_textbook(seed, chapters=20, sentences_per_chapter=200) for seed in range(3)]
+    for method, ratio, total, used, elapsed in run_benchmark(books, ratios=(0.1,)):
+        assert used <= total * ratio
+        assert elapsed < 10, f"{method} took {elapsed:.1f}s for {total} tokens"
+
+
+if __name__ == "__main__":
+    for count, chapters in ((3, 20), (6, 40)):
+        books = [make_textbook(seed, chapters=chapters, sentences_per_chapter=200) for seed in range(count)]
+        print(f"\n{count} books, {sum(len(split_sentences(b)) for b in books)} sentences")
+        print(f"{'method':>9} {'target':>7} {'tokens in':>10} {'tokens out':>11} {'ratio':>6} {'seconds':>8}")
+        for method, ratio, total, used, elapsed in run_benchmark(books):
+            print(f"{method:>9} {ratio:>7.0%} {total:>10} {used:>11} {used / total:>6.1%} {elapsed:>8.2f}")
@@ -0,0 +1,149 @@
+"""
+Tests for stored study guides and incremental updates.
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api import routes
+from app.config import get_settings
+from app.services import gemini, guideStore
+from app.services.guideStore import merge_topic_maps, diff_topics
+from app.utils import shared_state
+from fake_gemini import FakeGeminiClient
+
+
+def test_merge_and_diff_topic_maps():
+    merged = merge_topic_maps({"a": {"Loops": "for"}, "b": {"loops ": "while", "Sets": "{}"}})
+    assert merged == {"Loops": "for\n\nwhile", "Sets": "{}"}
+    assert diff_topics({"Loops": "for", "Sets": "{}"}, {"Loops": "for", "Sets": "set()", "Maps": "dict"}) == ["Sets", "Maps"]
+
+
+def test_merge_drops_paragraphs_repeated_across_sources():
+    merged = merge_topic_maps({
+        "a": {"Loops": "for repeats a block\n\nwhile checks first"},
+        "b": {"loops": "For  repeats a block\n\n  \ndo-while checks last"}
+    })
+    assert merged == {"Loops": "for repeats a block\n\nwhile checks first\n\ndo-while checks last"}
+
+
+def test_topics_of_several_sources_come_from_one_call(fake_client):
+    client = TestClient(app)
+    sources = {"text": ["Loops: for and while", "Functions: def", "Sets: unordered"]}
+    response = client.post("/api/get-output", data={"sources": json.dumps(sources)})
+    assert response.status_code == 200
+    # Topics of all three sources in one call, then the guide
+    assert len(fake_client.calls) == 2
+    assert "SOURCES FOR TOPIC EXTRACTION:" in fake_client.calls[0]["prompt"]
+    record = guideStore.load_guide(response.json()["guide_id"])
+    assert [sorted(source["topics"]) for source in record["sources"].values()] == [["Loops"], ["Functions"], ["Sets"]]
+
+    # Each source's topic map is cached on its own, so a request reusing one source calls only for the guide
+    fake_client.calls.clear()
+    response = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Functions: def"]})})
+    assert response.status_code == 200
+    assert len(fake_client.calls) == 1
+
+
+def test_topic_batches_are_bounded_by_tokens(fake_client, monkeypatch):
+    sources = json.dumps({"text": ["Loops: for and while", "Functions: def", "Sets: unordered"]})
+    monkeypatch.setattr(get_settings(), "topics_batch_max_tokens", 10)
+    assert TestClient(app).post("/api/get-output", data={"sources": sources}).status_code == 200
+    extractions = [call for call in fake_client.calls if "Generate a complete study guide" not in call["prompt"]]
+    assert 1 < len(extractions) < 3
+
+    # Without batching every source gets a call of its own
+    fake_client.calls.clear()
+    monkeypatch.setattr(get_settings(), "topics_batch_max_tokens", 0)
+    sources = json.dumps({"text": ["Maps: keys", "Graphs: nodes", "Trees: roots"]})
+    assert TestClient(app).post("/api/get-output", data={"sources": sources}).status_code == 200
+    assert all("TEXT TO ANALYZE:" in call["prompt"] for call in fake_client.calls[:3])
+    assert len(fake_client.calls) == 4
+
+
+def test_update_only_processes_the_delta(fake_client):
+    client = TestClient(app)
+    sources = {"text": ["Loops: for and while\nSets: unordered", "Functions: def"]}
+    response = client.post("/api/get-output", data={"sources": json.dumps(sources)})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["sources"]) == 2
+    assert len(fake_client.calls) == 2  # one topic extraction for both sources and one guide
+
+    fake_client.calls.clear()
+    removed = [body["sources"][1]["id"]]
+    response = client.post(
+        f"/api/guides/{body['guide_id']}/update",
+        data={"sources": json.dumps({"text": ["Sets: hashable members"]}), "removed": json.dumps(removed)}
+    )
+    assert response.status_code == 200
+    updated = response.json()
+    assert [s["kind"] for s in updated["sources"]] == ["text", "text"]
+    assert "Functions" not in updated["study_guide"]
+    assert "hashable members" in updated["study_guide"]
+
+    # One topic extraction for the added source, one guide call for the changed topic only
+    assert len(fake_client.calls) == 2
+    guide_prompt = fake_client.calls[1]["prompt"]
+    assert '"Sets"' in guide_prompt and '"Loops"' not in guide_prompt.split("Generate a complete")[0]
+
+
+def test_update_unknown_guide(fake_client):
+    response = TestClient(app).post(f"/api/guides/{'0' * 32}/update", data={"sources": "{}"})
+    assert response.status_code == 404
+
+
+def test_coalesced_requests_get_guides_of_their_own(fake_client, monkeypatch):
+    slow = FakeGeminiClient(latency=0.3)
+    monkeypatch.setattr(gemini, "_create_client", slow)
+    sources = json.dumps({"text": ["Loops: for and while", "Functions: def"]})
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(2) as pool:
+            first, second = pool.map(lambda _: client.post("/api/get-output", data={"sources": sources}).json(), range(2))
+        # One pipeline run served both requests
+        assert len(slow.calls) == 2
+        assert first["study_guide"] == second["study_guide"]
+        assert first["guide_id"] != second["guide_id"]
+
+        response = client.post(
+            f"/api/guides/{first['guide_id']}/update",
+            data={"removed": json.dumps([first["sources"][1]["id"]])}
+        )
+        assert response.status_code == 200
+        assert "Functions" not in response.json()["study_guide"]
+
+    # The other request's guide is unchanged
+    assert len(guideStore.load_guide(second["guide_id"])["sources"]) == 2
+    # Locks of guides nobody is updating are not kept
+    assert routes._guide_locks == {}
+
+
+def test_updates_wait_for_an_update_in_another_worker(fake_client):
+    client = TestClient(app)
+    body = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Loops: for and while"]})}).json()
+    # Another worker is updating the guide
+    lock_key = f"lock:guide:{body['guide_id']}"
+    assert shared_state.get_shared_state().add(lock_key, "other-worker", ttl=60)
+
+    update = {"sources": json.dumps({"text": ["Sets: unordered"]})}
+    response = client.post(f"/api/guides/{body['guide_id']}/update", data={**update, "deadline_seconds": "0.5"})
+    assert response.status_code == 504
+
+    with ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(client.post, f"/api/guides/{body['guide_id']}/update", data=update)
+        time.sleep(0.5)
+        assert not pending.done()
+        shared_state.get_shared_state().delete(lock_key)
+        assert pending.result(timeout=10).status_code == 200
+    assert "Sets" in guideStore.load_guide(body["guide_id"])["topics"]
+    # The update released the shared lock
+    assert shared_state.get_shared_state().get(lock_key) is None
@@ -0,0 +1,85 @@
+"""
+Tests for per-call deadlines and hedged Gemini requests.
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import get_settings
+from app.services import gemini
+from app.utils import metrics
+from fake_gemini import FakeGeminiClient
+
+PROMPT = "TEXT TO ANALYZE:\nTopic: content\nReturn ONLY the JSON object"
+
+
+class SlowFirstCallClient(FakeGeminiClient):
+    """The first call hangs for `first_latency` seconds, later calls are fast."""
+
+    def __init__(self, first_latency):
+        super().__init__()
+        self.first_latency = first_latency
+        self._count = 0
+        self._count_lock = threading.Lock()
+
+    def respond(self, model, prompt):
+        with self._count_lock:
+            self._count += 1
+            first = self._count == 1
+        if first:
+            time.sleep(self.first_latency)
+        return super().respond(model, prompt)
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    monkeypatch.setattr(gemini, "_hedge_budget", {"calls": 100, "hedges": 0})
+    monkeypatch.setattr(settings, "gemini_hedge_min_samples", 20)
+    monkeypatch.setattr(settings, "gemini_hedge_max_ratio", 0.1)
+    metrics.reset()
+    return settings
+
+
+def test_slow_call_is_hedged_and_hedge_wins(settings, monkeypatch):
+    monkeypatch.setattr(settings, "gemini_hedging", True)
+    for _ in range(20):
+        metrics.observe("gemini_latency_seconds", 0.05, model="m")
+
+    client = SlowFirstCallClient(first_latency=1.0)
+    started = time.time()
+    response = gemini._generate_with_deadline(client, "m", PROMPT, "topics")
+    elapsed = time.time() - started
+
+    assert response.text == '{"Topic": "content"}'
+    assert elapsed < 0.5
+    assert metrics.get_counter("gemini_hedges_fired_total", model="m", stage="topics") == 1
+    assert metrics.get_counter("gemini_hedges_won_total", model="m", stage="topics") == 1
+
+
+def test_no_hedge_without_latency_history_or_budget(settings, monkeypatch):
+    monkeypatch.setattr(settings, "gemini_hedging", True)
+    client = SlowFirstCallClient(first_latency=0.2)
+    gemini._generate_with_deadline(client, "m", PROMPT, "topics")
+    assert len(client.calls) == 1
+
+    for _ in range(20):
+        metrics.observe("gemini_latency_seconds", 0.01, model="m")
+    monkeypatch.setattr(gemini, "_hedge_budget", {"calls": 0, "hedges": 0})
+    client = SlowFirstCallClient(first_latency=0.2)
+    gemini._generate_with_deadline(client, "m", PROMPT, "topics")
+    assert len(client.calls) == 1
+
+
+def test_call_deadline(settings, monkeypatch):
+    monkeypatch.setattr(settings, "gemini_call_timeout_seconds", 0.1)
+    with pytest.raises(gemini.GeminiTimeoutError):
+        gemini._generate_with_deadline(SlowFirstCallClient(first_latency=0.5), "m", PROMPT, "topics")
+    assert metrics.get_counter("gemini_call_timeouts_total", model="m", stage="topics") == 1
@@ -0,0 +1,54 @@
+"""
+Import-time benchmark for the FastAPI application.
+
+Runs `python -X importtime -c "import app.main"` in a fresh interpreter and
+checks that the heavy service dependencies are not loaded at start-up and
+that the total import time stays within budget.
+
+Run directly to print the slowest imports:
+    python tests/test_import_time.py
+"""
+import os
+import subprocess
+import sys
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pymupdf", "fitz", "trafilatura", "youtube_transcript_api", "google.genai"]
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "1.5"))
+
+
+def measure_import_times(module="app.main"):
+    """
+    Return {module name: cumulative import time in seconds} for a cold import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PYTHON_DIR, capture_output=True, text=True, check=True,
+        env={**os.environ, "PREWARM_IMPORTS": "0"}
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_heavy_dependencies_are_not_imported_at_startup():
+    times = measure_import_times()
+    loaded = [m for m in HEAVY_MODULES if m in times]
+    assert not loaded, f"Heavy modules imported at start-up: {loaded}"
+
+
+def test_app_import_time_within_budget():
+    times = measure_import_times()
+    assert times["app.main"] < IMPORT_BUDGET_SECONDS, f"app.main took {times['app.main']:.3f}s to import"
+
+
+if __name__ == "__main__":
+    times = measure_import_times()
+    print(f"app.main imported in {times['app.main']:.3f}s (budget {IMPORT_BUDGET_SECONDS:.1f}s)")
+    for name, seconds in sorted(times.items(), key=lambda item: -item[1])[:15]:
+        print(f"{seconds:8.3f}s  {name}")
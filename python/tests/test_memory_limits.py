@@ -0,0 +1,99 @@
+"""
+Tests for per-request memory accounting and the memory guardrails.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import get_settings
+from app.utils import metrics
+from app.utils.memory import (
+    MemoryBudget, MemoryLimitExceeded, current_budget, memory_scope, memory_stage, text_bytes
+)
+
+LONG_TEXT = "\n".join(f"Topic {i}: explanation number {i} of a long course reader" for i in range(2000))
+
+
+@pytest.fixture
+def client(client):
+    metrics.reset()
+    return client
+
+
+def test_budget_charge_fit_and_replace():
+    budget = MemoryBudget(limit_bytes=10_000)
+    budget.charge(4_000)
+    assert budget.remaining() == 6_000
+    with pytest.raises(MemoryLimitExceeded):
+        budget.charge(7_000, "a big source")
+
+    text = "x" * 20_000
+    kept = budget.fit(text)
+    assert 0 < len(kept) < len(text)
+    assert budget.used <= budget.limit
+    assert budget.fit("more" * 100) == ""
+
+    used = budget.used
+    budget.replace(kept, kept[:100])
+    assert budget.used == used - text_bytes(kept) + text_bytes(kept[:100])
+    assert budget.peak == used
+
+    unlimited = MemoryBudget()
+    assert unlimited.remaining() is None
+    assert unlimited.fit(text) is text
+
+
+def test_scope_and_stage_stats():
+    metrics.reset()
+    with memory_stage("r", "outside") as budget:
+        assert budget is None
+
+    with memory_scope(MemoryBudget(trace=True)) as budget:
+        assert current_budget() is budget
+        with memory_stage("r", "extract"):
+            budget.charge(5_000)
+            held = [bytearray(200_000)]
+            budget.release(5_000)
+        del held
+    assert current_budget() is None
+
+    stats = budget.stages["extract"]
+    assert stats["accounted_peak_bytes"] == 5_000
+    assert stats["traced_peak_bytes"] >= 200_000
+    assert "rss_bytes" in stats
+    assert metrics.summary_count("request_memory_peak_bytes", stage="extract") == 1
+    assert metrics.summary_count("request_traced_peak_bytes", stage="extract") == 1
+
+
+def test_large_source_is_truncated_with_note(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "request_memory_limit_bytes", 30_000)
+    sources = json.dumps({"text": [LONG_TEXT, "Sets: unordered collections"]})
+    response = client.post("/api/get-output", data={"sources": sources})
+    assert response.status_code == 200
+    notes = response.json()["notes"]
+    assert len(notes) == 2
+    assert notes[0].startswith("Truncated Topic 0:")
+    assert "memory limit" in notes[0]
+    assert notes[1] == "Dropped Sets: unordered collections: the request memory limit was reached"
+    assert metrics.summary_count("request_memory_peak_bytes", stage="extract") == 1
+    assert metrics.summary_count("request_memory_peak_bytes", stage="guide") == 1
+
+
+def test_requests_within_the_limit_have_no_notes(client):
+    sources = json.dumps({"text": [LONG_TEXT]})
+    response = client.post("/api/get-output", data={"sources": sources})
+    assert response.status_code == 200
+    assert response.json()["notes"] == []
+
+
+def test_requests_are_refused_when_worker_rss_is_high(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "worker_rss_limit_bytes", 1)
+    response = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Loops: for"]})})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert metrics.get_counter("requests_rejected_memory_total") == 1
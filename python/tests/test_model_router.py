@@ -0,0 +1,87 @@
+"""
+Tests for Gemini model routing and failover.
+"""
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import gemini, modelRouter
+from app.services.modelRouter import ModelRouter, classify_error, RATE_LIMITED, SERVER_ERROR, CLIENT_ERROR
+from app.utils import metrics
+from fake_gemini import FakeGeminiClient
+
+
+class APIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FailingModelClient(FakeGeminiClient):
+    """Fails every call to the models in `failures` with the given error."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def respond(self, model, prompt):
+        if model in self.failures:
+            self.calls.append({"model": model, "prompt": prompt})
+            raise self.failures[model]
+        return super().respond(model, prompt)
+
+
+PROMPT = "TEXT TO ANALYZE:\nTopic: content\nReturn ONLY the JSON object"
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ModelRouter({"default": ["lite", "flash"], "topics": ["lite", "flash"], "guide": ["flash", "lite"]})
+    monkeypatch.setattr(modelRouter, "_router", router)
+    monkeypatch.setattr(gemini, "_min_delay_between_calls", 0)
+    monkeypatch.setattr(gemini.time, "sleep", lambda s: pytest.fail(f"unexpected sleep of {s}s"))
+    metrics.reset()
+    return router
+
+
+def test_classify_error():
+    assert classify_error(APIError(429, "RESOURCE_EXHAUSTED")) == RATE_LIMITED
+    assert classify_error(APIError(503, "UNAVAILABLE")) == SERVER_ERROR
+    assert classify_error(APIError(400, "INVALID_ARGUMENT")) == CLIENT_ERROR
+
+
+def test_fails_over_instead_of_sleeping(router):
+    client = FailingModelClient({"lite": APIError(429, "RESOURCE_EXHAUSTED. Please retry in 30s")})
+    routing = []
+    gemini._call_gemini_with_retry(client, ["lite", "flash"], PROMPT, stage="topics", routing=routing)
+
+    assert [c["model"] for c in client.calls] == ["lite", "flash"]
+    assert [(r["model"], r["outcome"]) for r in routing] == [("lite", RATE_LIMITED), ("flash", "ok")]
+    assert not router.is_available("lite")
+    assert metrics.get_counter("gemini_failovers_total", from_model="lite", to_model="flash", stage="topics") == 1
+
+    # The cooling-down model is skipped by later calls
+    client.calls.clear()
+    gemini._call_gemini_with_retry(client, ["lite", "flash"], PROMPT, stage="topics")
+    assert [c["model"] for c in client.calls] == ["flash"]
+
+
+def test_routing_recorded_in_guide_metadata(router, monkeypatch):
+    client = FailingModelClient({"flash": APIError(500, "INTERNAL")})
+    monkeypatch.setattr(gemini, "_create_client", client)
+    monkeypatch.setattr(gemini, "_get_api_key", lambda key=None: "test-key")
+
+    guide = gemini.make_study_guide({"Loops": "for and while"})
+    assert [(r["model"], r["outcome"]) for r in guide["metadata"]["routing"]] == [("flash", SERVER_ERROR), ("lite", "ok")]
+
+
+def test_order_prefers_available_models():
+    router = ModelRouter({"default": ["a", "b", "c"]}, rate_limit_cooldown=60)
+    router.record_failure("a", "default", RATE_LIMITED)
+    router.record_failure("b", "default", RATE_LIMITED, retry_after=5)
+    assert router.order(["a", "b", "c"]) == ["c", "b", "a"]
@@ -0,0 +1,112 @@
+"""
+Tests for opt-in request profiling and the admin profile endpoints.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import get_settings
+from app.services import gemini, profileStore
+from app.utils.profiler import SamplingProfiler
+from fake_gemini import FakeGeminiClient
+
+ADMIN = {"X-Admin-Token": "secret"}
+SOURCES = json.dumps({"text": ["Loops: for and while", "Sets: unordered collections"]})
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, client):
+    monkeypatch.setattr(gemini, "_create_client", FakeGeminiClient(latency=0.05))
+    monkeypatch.setattr(get_settings(), "admin_token", "secret")
+    monkeypatch.setattr(get_settings(), "profile_interval_seconds", 0.001)
+    monkeypatch.setattr(profileStore, "PROFILE_DIR", tmp_path / "profiles")
+    return client
+
+
+def busy_work(seconds):
+    end = time.time() + seconds
+    total = 0
+    while time.time() < end:
+        total += sum(range(1000))
+    return total
+
+
+def test_profiler_counts_busy_threads_only():
+    idle = threading.Event()
+    waiter = threading.Thread(target=idle.wait, name="idle-waiter")
+    waiter.start()
+    profiler = SamplingProfiler(interval=0.001).start()
+    worker = threading.Thread(target=busy_work, args=(0.2,), name="busy-worker_0")
+    worker.start()
+    worker.join()
+    profiler.stop()
+    idle.set()
+    waiter.join()
+
+    collapsed = profiler.collapsed()
+    assert profiler.samples > 20
+    lines = collapsed.splitlines()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("busy-worker;") and "busy_work (tests/test_profiling.py:" in line for line in lines)
+    assert not any(line.startswith("idle-waiter") for line in lines)
+    assert profiler.top_functions(1)[0][0].startswith("busy_work")
+
+
+def test_profiling_requires_admin_token(client, monkeypatch):
+    assert client.post("/api/get-output", data={"sources": SOURCES}, headers={"X-Profile": "1"}).status_code == 403
+    response = client.post(
+        "/api/get-output?profile=1", data={"sources": SOURCES}, headers={"X-Admin-Token": "wrong"}
+    )
+    assert response.status_code == 403
+    assert client.get("/api/admin/profiles").status_code == 403
+
+    # Without an admin token configured the admin endpoints are closed
+    monkeypatch.setattr(get_settings(), "admin_token", "")
+    assert client.get("/api/admin/profiles", headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_profiled_request_can_be_listed_and_downloaded(client):
+    response = client.post("/api/get-output", data={"sources": SOURCES}, headers={"X-Profile": "1", **ADMIN})
+    assert response.status_code == 200
+    profile_id = response.json()["profile_id"]
+
+    profiles = client.get("/api/admin/profiles", headers=ADMIN).json()["profiles"]
+    assert [p["profile_id"] for p in profiles] == [profile_id]
+    assert profiles[0]["endpoint"] == "get_output"
+    assert profiles[0]["samples"] > 0
+
+    download = client.get(f"/api/admin/profiles/{profile_id}", headers=ADMIN)
+    assert download.status_code == 200
+    assert download.text
+    for line in download.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+    assert client.get("/api/admin/profiles/..%2Fsecrets", headers=ADMIN).status_code in (400, 404)
+    assert client.get("/api/admin/profiles/bad.id", headers=ADMIN).status_code == 400
+    assert client.get("/api/admin/profiles/123", headers=ADMIN).status_code == 404
+
+
+def test_unprofiled_requests_store_nothing(client):
+    response = client.post("/api/get-output", data={"sources": SOURCES}, headers=ADMIN)
+    assert response.status_code == 200
+    assert "profile_id" not in response.json()
+    assert not profileStore.PROFILE_DIR.exists()
+
+
+def test_old_profiles_are_pruned(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "profile_max_files", 2)
+    for index in range(3):
+        profiler = SamplingProfiler(interval=0.001).start()
+        busy_work(0.01)
+        profileStore.save_profile(f"p{index}", profiler.stop(), "test")
+        time.sleep(0.01)
+    assert [p["profile_id"] for p in profileStore.list_profiles()] == ["p2", "p1"]
+    assert not profileStore.profile_path("p0").exists()
@@ -0,0 +1,158 @@
+"""
+Tests for the content-addressed result store, conditional and compressed
+result downloads and JSON serialization of large responses.
+"""
+import gzip
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import get_settings
+from app.services import gemini, resultStore
+from app.utils import responses, shared_state
+from app.utils.responses import dumps, etag_matches, negotiate_encoding
+from fake_gemini import FakeGeminiClient
+
+# Long enough for compression to matter
+TEXT = "\n".join(f"Topic {i}: explanation number {i} of a concept worth studying" for i in range(200))
+SOURCES = json.dumps({"text": [TEXT]})
+
+
+def test_negotiate_encoding():
+    available = ["br", "gzip"]
+    assert negotiate_encoding("gzip, deflate, br", available) == "br"
+    assert negotiate_encoding("br;q=0.5, gzip", available) == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity", available) is None
+    assert negotiate_encoding("*", ["gzip"]) == "gzip"
+    assert negotiate_encoding("", available) is None
+    assert negotiate_encoding("br", ["gzip"]) is None
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', ['"b"'])
+    assert etag_matches('W/"a"', ['"a"'])
+    assert etag_matches("*", ['"a"'])
+    assert not etag_matches('"a"', ['"b"'])
+    assert not etag_matches(None, ['"a"'])
+
+
+def test_dumps_falls_back_for_values_orjson_rejects():
+    assert json.loads(dumps({"guide": "é" * 3, "n": 1})) == {"guide": "ééé", "n": 1}
+    assert json.loads(dumps({1: "a"})) == {"1": "a"}
+
+
+def test_generated_guide_can_be_downloaded(client):
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+    body = response.json()
+    result_id = body["result_id"]
+
+    download = client.get(f"/api/results/{result_id}", headers={"Accept-Encoding": "identity"})
+    assert download.status_code == 200
+    assert download.text == body["study_guide"]
+    assert download.headers["content-type"] == "text/markdown; charset=utf-8"
+    assert "content-encoding" not in download.headers
+    etag = download.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    # The same inputs map to the same result, whose content does not change
+    again = client.post("/api/get-output", data={"sources": SOURCES}).json()
+    assert again["result_id"] == result_id
+    assert client.get(f"/api/results/{result_id}", headers={"Accept-Encoding": "identity"}).headers["etag"] == etag
+
+
+def test_download_is_compressed_and_revalidated(client):
+    result_id = client.post("/api/get-output", data={"sources": SOURCES}).json()["result_id"]
+    record = resultStore.load_result(result_id)
+
+    compressed = client.get(f"/api/results/{result_id}", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["vary"]
+    assert int(compressed.headers["content-length"]) == record["encodings"]["gzip"] < record["bytes"] / 3
+    assert gzip.decompress(resultStore.read_result(result_id, "gzip")).decode("utf-8") == compressed.text
+
+    # A client holding either representation gets 304 without a body
+    for etag in (compressed.headers["etag"], resultStore.result_etag(record)):
+        cached = client.get(f"/api/results/{result_id}", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == compressed.headers["etag"]
+    stale = client.get(f"/api/results/{result_id}", headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+
+
+def test_regenerated_guide_gets_a_result_of_its_own(client, monkeypatch):
+    class Regenerating(FakeGeminiClient):
+        generation = 0
+
+        def respond(self, model, prompt):
+            response = super().respond(model, prompt)
+            if "TOPICS AND CONTENT:" in prompt:
+                Regenerating.generation += 1
+                guide = json.loads(response.text)
+                guide["overview"] += f" Generation {Regenerating.generation}."
+                response.text = json.dumps(guide)
+            return response
+
+    monkeypatch.setattr(gemini, "_create_client", Regenerating())
+    first = client.post("/api/get-output", data={"sources": SOURCES}).json()
+    # The LLM result cache expires and the same inputs are generated again
+    monkeypatch.setattr(shared_state, "_backend", shared_state.MemoryStateBackend())
+    second = client.post("/api/get-output", data={"sources": SOURCES}).json()
+    assert first["study_guide"] != second["study_guide"]
+    assert first["result_id"] != second["result_id"]
+    for body in (first, second):
+        download = client.get(f"/api/results/{body['result_id']}", headers={"Accept-Encoding": "identity"})
+        assert download.text == body["study_guide"]
+
+
+def test_results_expire(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "result_ttl_seconds", 3600)
+    result_id = client.post("/api/get-output", data={"sources": SOURCES}).json()["result_id"]
+    assert resultStore.prune_results(time.time() + 60) == 0
+    assert client.get(f"/api/results/{result_id}").status_code == 200
+
+    assert resultStore.prune_results(time.time() + 3600) == 1
+    assert list(resultStore.RESULT_DIR.iterdir()) == []
+    assert client.get(f"/api/results/{result_id}").status_code == 404
+
+
+def test_brotli_is_preferred_when_installed(client):
+    pytest.importorskip("brotli")
+    result_id = client.post("/api/get-output", data={"sources": SOURCES}).json()["result_id"]
+    assert list(resultStore.load_result(result_id)["encodings"]) == ["br", "gzip"]
+    response = client.get(f"/api/results/{result_id}", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_partial_guides_are_not_stored(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "request_memory_limit_bytes", len(TEXT) // 2)
+    body = client.post("/api/get-output", data={"sources": SOURCES}).json()
+    assert body["notes"]
+    assert "result_id" not in body
+
+
+def test_unknown_and_invalid_results(client):
+    assert client.get(f"/api/results/{'0' * 64}").status_code == 404
+    assert client.get("/api/results/not-a-result").status_code == 400
+
+
+def test_responses_are_serialized_with_orjson_when_installed(client, monkeypatch):
+    pytest.importorskip("orjson")
+    serialized = []
+    original = responses.orjson.dumps
+
+    def record(content):
+        serialized.append(content)
+        return original(content)
+
+    monkeypatch.setattr(responses.orjson, "dumps", record)
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+    assert serialized and serialized[-1]["study_guide"] == response.json()["study_guide"]
@@ -0,0 +1,160 @@
+"""
+Tests for the Gemini call scheduler: priorities, fair queuing across
+tenants and starvation protection.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config import get_settings
+from app.utils import metrics, scheduler
+from app.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from app.utils.scheduler import BACKGROUND, BULK, INTERACTIVE, CallScheduler, call_scope
+from app.utils.singleflight import SingleFlight
+
+
+class Queue:
+    """Queues calls on a one-slot scheduler from threads and records the order they are served in."""
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.order = []
+        self.holder = calls.acquire()
+        self.threads = []
+
+    def add(self, label, priority, tenant, cost=1.0):
+        def run():
+            with call_scope(priority, tenant):
+                ticket = self.calls.acquire(cost)
+            self.order.append(label)
+            self.calls.release(ticket)
+
+        queued = sum(self.calls.stats()["waiting"].values())
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        # Wait until it is queued, so calls are queued in the order added
+        while sum(self.calls.stats()["waiting"].values()) == queued:
+            time.sleep(0.001)
+
+    def drain(self):
+        self.calls.release(self.holder)
+        for thread in self.threads:
+            thread.join(timeout=5)
+        return self.order
+
+
+def test_higher_priorities_are_served_first():
+    queue = Queue(CallScheduler(max_concurrent=1))
+    queue.add("bulk", BULK, "a")
+    queue.add("background", BACKGROUND, "a")
+    queue.add("interactive", INTERACTIVE, "a")
+    assert queue.drain() == ["interactive", "background", "bulk"]
+
+
+def test_tenants_share_slots_fairly():
+    queue = Queue(CallScheduler(max_concurrent=1))
+    for i in range(6):
+        queue.add(f"a{i}", INTERACTIVE, "busy")
+    queue.add("b0", INTERACTIVE, "quiet")
+    queue.add("b1", INTERACTIVE, "quiet")
+    order = queue.drain()
+    # The quiet tenant does not wait behind all of the busy tenant's calls
+    assert order.index("b0") <= 2 and order.index("b1") <= 4
+
+
+def test_fair_share_is_measured_in_cost():
+    queue = Queue(CallScheduler(max_concurrent=1))
+    queue.add("huge0", INTERACTIVE, "big", cost=10)
+    queue.add("huge1", INTERACTIVE, "big", cost=10)
+    for i in range(5):
+        queue.add(f"small{i}", INTERACTIVE, "small", cost=1)
+    order = queue.drain()
+    assert order.index("huge1") == len(order) - 1
+
+
+def test_long_queued_calls_are_not_starved():
+    calls = CallScheduler(max_concurrent=1, max_queue_seconds=0.2)
+    queue = Queue(calls)
+    queue.add("bulk", BULK, "batch")
+    time.sleep(0.3)
+    queue.add("interactive", INTERACTIVE, "user")
+    assert queue.drain() == ["bulk", "interactive"]
+    assert calls.stats()["promoted"][BULK] == 1
+
+
+def test_queued_call_gives_up_at_the_deadline():
+    calls = CallScheduler(max_concurrent=1)
+    holder = calls.acquire()
+    started = time.time()
+    with deadline_scope(Deadline(0.3)):
+        with pytest.raises(DeadlineExceeded):
+            calls.acquire()
+    assert time.time() - started < 1
+    assert calls.stats()["waiting"][BACKGROUND] == 0
+    calls.release(holder)
+    calls.release(calls.acquire())
+
+
+def test_unlimited_scheduler_admits_immediately():
+    calls = CallScheduler(max_concurrent=0)
+    tickets = [calls.acquire() for _ in range(100)]
+    assert calls.stats()["running"] == 0
+    for ticket in tickets:
+        calls.release(ticket)
+
+
+def test_requests_queue_as_interactive(monkeypatch, fake_client):
+    monkeypatch.setattr(scheduler, "_scheduler", CallScheduler(max_concurrent=2))
+    metrics.reset()
+
+    response = TestClient(app).post("/api/get-output", data={"sources": json.dumps({"text": ["Loops: for and while"]})})
+    assert response.status_code == 200
+
+    stats = TestClient(app).get("/api/metrics").json()["scheduler"]
+    assert stats["dispatched"] == {INTERACTIVE: 2, BACKGROUND: 0, BULK: 0}
+    assert stats["running"] == 0
+    assert metrics.summary_count("gemini_queue_seconds", priority=INTERACTIVE) == 2
+
+
+def test_queued_calls_do_not_hold_default_executor_threads(monkeypatch):
+    monkeypatch.setattr(get_settings(), "gemini_max_concurrent_calls", 1)
+    monkeypatch.setattr(get_settings(), "gemini_call_threads", 0)
+    calls = CallScheduler(max_concurrent=1)
+    monkeypatch.setattr(scheduler, "_scheduler", calls)
+    monkeypatch.setattr(scheduler, "_call_executor", None)
+    flights = SingleFlight("test", executor=scheduler.get_call_executor)
+    holder = calls.acquire()
+
+    def gemini_call():
+        calls.release(calls.acquire())
+        return threading.current_thread().name
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        queued = [asyncio.ensure_future(flights.do(str(i), gemini_call)) for i in range(8)]
+        try:
+            for _ in range(200):
+                if sum(calls.stats()["waiting"].values()) == 8:
+                    break
+                await asyncio.sleep(0.01)
+            # Other blocking work still gets a thread while the calls wait for the slot
+            assert await asyncio.wait_for(asyncio.to_thread(lambda: "done"), 1) == "done"
+        finally:
+            calls.release(holder)
+        return await asyncio.gather(*queued)
+
+    names = asyncio.run(run())
+    assert all(name.startswith("gemini-work") for name in names)
+    assert scheduler.get_call_executor()._max_workers == 16
@@ -0,0 +1,138 @@
+"""
+Tests for the shared state backends, plus a benchmark showing that the
+aggregate Gemini call rate stays within budget as worker processes are added.
+
+Run directly for a larger benchmark:
+    python tests/test_shared_state.py
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import gemini
+from app.utils import shared_state
+from app.utils.shared_state import MemoryStateBackend, SQLiteStateBackend, RedisStateBackend
+from app.utils.singleflight import SingleFlight
+
+
+class FakeRedis:
+    """Minimal local stand-in for the redis-py calls used by RedisStateBackend."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value.encode("utf-8") if value is not None else None
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self.get(key) is not None:
+            return None
+        self.data[key] = (value, time.time() + px / 1000 if px else None)
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def _backends(tmp_path):
+    return [MemoryStateBackend(), SQLiteStateBackend(tmp_path / "state.db"), RedisStateBackend(FakeRedis())]
+
+
+def test_backend_semantics(tmp_path):
+    for backend in _backends(tmp_path):
+        backend.set("a", "1")
+        assert backend.get("a") == "1"
+        assert backend.add("lock", "x", ttl=0.05) is True
+        assert backend.add("lock", "y", ttl=0.05) is False
+        time.sleep(0.06)
+        assert backend.add("lock", "z") is True
+        backend.delete("a")
+        assert backend.get("a") is None
+
+        # Consecutive reservations are spaced by the interval
+        assert backend.reserve_interval("rate", 0.5) == pytest.approx(0, abs=0.01)
+        assert backend.reserve_interval("rate", 0.5) == pytest.approx(0.5, abs=0.02)
+
+
+def test_cache_is_shared_between_flight_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_state, "_backend", SQLiteStateBackend(tmp_path / "state.db"))
+    calls = []
+
+    def extract(url):
+        calls.append(url)
+        return {"text": url}
+
+    async def run():
+        # Two groups stand in for the same flight group in two worker processes
+        first = SingleFlight("extraction", cache_ttl=60)
+        second = SingleFlight("extraction", cache_ttl=60)
+        return await first.do("url:a", extract, "a"), await second.do("url:a", extract, "a"), second
+
+    a, b, second = asyncio.run(run())
+    assert a == b == {"text": "a"}
+    assert calls == ["a"]
+    assert second.cache_hits == 1
+
+
+def _rate_limited_worker(db_path, interval, duration, results):
+    shared_state.set_shared_state(SQLiteStateBackend(db_path))
+    gemini._min_delay_between_calls = interval
+    stamps = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        gemini._rate_limit()
+        stamps.append(time.time())
+    results.put(stamps)
+
+
+def run_rate_benchmark(db_path, workers, interval, duration):
+    """Run rate-limited workers in parallel and return (calls, peak calls per second)."""
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_rate_limited_worker, args=(db_path, interval, duration, results))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    stamps = sorted(t for _ in procs for t in results.get())
+    for p in procs:
+        p.join()
+
+    peak, lo = 0, 0
+    for hi, t in enumerate(stamps):
+        while stamps[lo] <= t - 1.0:
+            lo += 1
+        peak = max(peak, hi - lo + 1)
+    return len(stamps), peak
+
+
+def test_aggregate_rate_stays_within_budget_as_workers_scale(tmp_path):
+    interval = 0.05  # budget of 20 calls per second (1200 RPM)
+    budget_per_second = 1 / interval
+    for workers in (1, 2, 4):
+        calls, peak = run_rate_benchmark(tmp_path / f"state-{workers}.db", workers, interval, 1.5)
+        assert peak <= budget_per_second + 1, f"{workers} workers peaked at {peak} calls/s"
+        assert calls >= budget_per_second  # the budget is actually used
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    interval = 0.02
+    print(f"Budget: {60 / interval:.0f} RPM")
+    print(f"{'workers':>8} {'calls':>8} {'agg RPM':>10} {'peak RPM':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in (1, 2, 4, 8, 16):
+            duration = 5.0
+            calls, peak = run_rate_benchmark(os.path.join(tmp, f"{workers}.db"), workers, interval, duration)
+            print(f"{workers:>8} {calls:>8} {calls / duration * 60:>10.0f} {peak * 60:>10.0f}")
@@ -0,0 +1,148 @@
+"""
+Tests for the single-call fast path for small inputs, including a benchmark
+of its latency against the separate topics and study guide calls.
+
+Run directly to print the benchmark for a few call latencies and rate limit gaps:
+    python tests/test_single_call_guide.py
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.config import get_settings
+from app.services import gemini, guideStore
+from app.services.gemini import format_study_guide_as_markdown, make_quick_study_guide
+from app.utils import metrics, shared_state
+from fake_gemini import FakeGeminiClient, FakeResponse
+
+SOURCES = json.dumps({"text": [
+    "Loops: for and while loops repeat work\nSets: unordered collections of unique items",
+    "Loops: a loop body runs once per iteration\nMaps: key to value lookups",
+]})
+
+
+@pytest.fixture
+def fake_client(monkeypatch, fake_client):
+    monkeypatch.setattr(get_settings(), "single_call_max_tokens", 1000)
+    return fake_client
+
+
+def test_single_call_attributes_topics_to_sources(fake_client):
+    result = make_quick_study_guide(["Loops: for\nSets: {}", "Loops: while"])
+    assert result["source_topics"] == [{"Loops": "for", "Sets": "{}"}, {"Loops": "while"}]
+    guide = result["guide"]
+    assert [entry["topic"] for entry in guide["topics"]] == ["Loops", "Sets"]
+    assert guide["topics"][0]["original_content"] == "for\n\nwhile"
+    assert guide["metadata"]["guide_type"] == "concise"
+    assert guide["metadata"]["single_call"] is True
+    assert "Summary of Loops" in format_study_guide_as_markdown(guide)
+
+
+def test_small_request_makes_one_call(fake_client):
+    client = TestClient(app)
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(fake_client.calls) == 1
+    assert "SOURCES TO ANALYZE:" in fake_client.calls[0]["prompt"]
+    assert all(name in body["study_guide"] for name in ("Loops", "Sets", "Maps"))
+
+    # The per-source topic maps are stored, so the guide can be updated incrementally
+    record = guideStore.load_guide(body["guide_id"])
+    assert [sorted(source["topics"]) for source in record["sources"].values()] == [["Loops", "Sets"], ["Loops", "Maps"]]
+    update = client.post(
+        f"/api/guides/{body['guide_id']}/update",
+        data={"sources": json.dumps({"text": ["Graphs: nodes and edges"]})}
+    )
+    assert update.status_code == 200
+    assert "Graphs" in update.json()["study_guide"]
+
+
+def test_larger_request_makes_separate_calls(fake_client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "single_call_max_tokens", 10)
+    response = TestClient(app).post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+    # Topics of both sources in one call, then the guide
+    assert len(fake_client.calls) == 2
+
+
+def test_invalid_single_call_response_falls_back(fake_client, monkeypatch):
+    metrics.reset()
+
+    class Truncated(FakeGeminiClient):
+        def respond(self, model, prompt):
+            if "SOURCES TO ANALYZE:" in prompt:
+                self.calls.append({"model": model, "prompt": prompt})
+                return FakeResponse('{"overview": "Covers')
+            return super().respond(model, prompt)
+
+    fake = Truncated()
+    monkeypatch.setattr(gemini, "_create_client", fake)
+    response = TestClient(app).post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+    assert "Maps" in response.json()["study_guide"]
+    assert metrics.get_counter("single_call_fallbacks_total") == 1
+    # The failed combined call, then the topics of both sources in one call and the guide
+    assert len(fake.calls) == 3
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def measure(single_call_max_tokens, latency, gap, runs=3):
+    """
+    Return the mean seconds a small request takes against a Gemini stand-in
+    answering after latency seconds, with calls spaced by gap seconds.
+    """
+    settings = get_settings()
+    saved = (gemini._create_client, gemini._min_delay_between_calls, settings.gemini_api_key,
+             settings.single_call_max_tokens, shared_state._backend)
+    client = TestClient(app)
+    timings = []
+    try:
+        gemini._create_client = FakeGeminiClient(latency=latency)
+        gemini._min_delay_between_calls = gap
+        settings.gemini_api_key = "test-key"
+        settings.single_call_max_tokens = single_call_max_tokens
+        for run in range(runs):
+            # A fresh cache and rate limiter for every run
+            shared_state._backend = shared_state.MemoryStateBackend()
+            sources = json.dumps({"text": [f"Loops: for and while loops, run {run}", "Sets: unique items"]})
+            started = time.time()
+            response = client.post("/api/get-output", data={"sources": sources})
+            timings.append(time.time() - started)
+            assert response.status_code == 200
+    finally:
+        (gemini._create_client, gemini._min_delay_between_calls, settings.gemini_api_key,
+         settings.single_call_max_tokens, shared_state._backend) = saved
+    return sum(timings) / len(timings)
+
+
+def test_single_call_cuts_small_request_latency(monkeypatch, tmp_path):
+    monkeypatch.setattr(guideStore, "GUIDE_DIR", tmp_path)
+    separate = measure(0, latency=0.1, gap=0.3)
+    single = measure(1000, latency=0.1, gap=0.3)
+    # Two sources: one topic call and a guide call after a rate limit gap, against one call
+    assert single < separate / 2
+
+
+if __name__ == "__main__":
+    import logging
+    import tempfile
+    from pathlib import Path
+    logging.disable(logging.CRITICAL)
+    guideStore.GUIDE_DIR = Path(tempfile.mkdtemp())
+    print(f"{'latency':>8} {'gap':>5} {'separate':>9} {'single':>7} {'saved':>6}")
+    for latency, gap in ((0.5, 0.0), (0.5, 2.0), (2.0, 2.0), (4.0, 2.0)):
+        separate = measure(0, latency, gap, runs=1)
+        single = measure(1000, latency, gap, runs=1)
+        print(f"{latency:>7.1f}s {gap:>4.1f}s {separate:>8.2f}s {single:>6.2f}s {1 - single / separate:>6.0%}")
@@ -0,0 +1,86 @@
+"""
+Tests for request coalescing and canonical input hashing.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.helpers import canonical_hash, normalize_url
+from app.utils.singleflight import SingleFlight
+
+
+def test_concurrent_duplicates_share_one_computation():
+    calls = []
+
+    def slow_extract(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return value.upper()
+
+    async def run():
+        group = SingleFlight("test")
+        return await asyncio.gather(*(group.do("same", slow_extract, "pdf") for _ in range(10))), group
+
+    results, group = asyncio.run(run())
+    assert results == ["PDF"] * 10
+    assert calls == ["pdf"]
+    assert group.leaders == 1 and group.followers == 9
+    assert group.in_flight() == 0
+
+
+def test_distinct_keys_and_errors():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        group = SingleFlight("test")
+        results = await asyncio.gather(group.do("a", fail), group.do("a", fail), return_exceptions=True)
+        ok = await group.do("b", lambda: "fresh")
+        return results, ok
+
+    results, ok = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert ok == "fresh"
+
+
+def test_canonical_hash_and_url_normalization():
+    assert canonical_hash({"a": 1, "b": [1, 2]}) == canonical_hash({"b": [1, 2], "a": 1})
+    assert canonical_hash(["x", "y"]) != canonical_hash(["y", "x"])
+    assert normalize_url(" HTTPS://Example.COM/Article/#intro ") == "https://example.com/Article"
+    assert normalize_url("https://example.com/?q=1") == "https://example.com?q=1"
+
+
+def test_pdf_extraction_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import pymupdf
+    from app.services.pdfExtraction import extract_pdf_text
+
+    path = str(tmp_path / "doc.pdf")
+    doc = pymupdf.open()
+    for i in range(3):
+        doc.new_page().insert_text((72, 72), f"Page text {i}")
+    doc.save(path)
+    doc.close()
+
+    threads = []
+    get_text = pymupdf.Page.get_text
+
+    def spy(self, *args, **kwargs):
+        threads.append(threading.get_ident())
+        return get_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(pymupdf.Page, "get_text", spy)
+
+    async def run():
+        text = await SingleFlight("test").do(path, extract_pdf_text, path)
+        return text, threading.get_ident()
+
+    text, loop_thread = asyncio.run(run())
+    assert "Page text 2" in text
+    assert len(threads) == 3
+    assert loop_thread not in threads
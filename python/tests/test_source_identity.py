@@ -0,0 +1,74 @@
+"""
+Tests for canonical source identities and in-request deduplication.
+"""
+import json
+import os
+import sys
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.sourceIdentity import canonical_url, clean_url, resolve_sources, youtube_video_id
+
+
+def test_video_links_resolve_to_one_id():
+    links = [
+        "https://youtu.be/dQw4w9WgXcQ",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=30",
+        "https://youtube.com/shorts/dQw4w9WgXcQ?feature=share",
+        "m.youtube.com/watch?feature=youtu.be&v=dQw4w9WgXcQ",
+        "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+        "https://www.youtube.com/live/dQw4w9WgXcQ?si=abc",
+    ]
+    assert {youtube_video_id(link) for link in links} == {"dQw4w9WgXcQ"}
+    assert youtube_video_id("https://example.com/watch?v=dQw4w9WgXcQ") == ""
+    assert youtube_video_id("https://www.youtube.com/@channel") == ""
+
+
+def test_url_canonicalization():
+    assert clean_url("HTTPS://Example.COM:443/Path/?utm_source=x&b=2&a=1&fbclid=y#section") == "https://example.com/Path?a=1&b=2"
+    assert clean_url("http://example.com:8080/") == "http://example.com:8080"
+    assert canonical_url("http://www.example.com/a?gclid=1") == canonical_url("https://example.com/a/")
+    # Parameters that select content are kept
+    assert canonical_url("https://example.com/a?page=2") != canonical_url("https://example.com/a?page=3")
+
+
+def test_resolve_sources_dedups_before_fetching():
+    pdfs = [{"filename": "a.pdf", "sha256": "1" * 64}, {"filename": "copy.pdf", "sha256": "1" * 64}]
+    urls = [
+        "https://example.com/article?utm_campaign=spring",
+        "https://www.example.com/article#comments",
+        "https://youtu.be/dQw4w9WgXcQ",
+        42,
+    ]
+    videos = ["https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=30", "not a video"]
+    texts = ["Loops:  for", "Loops: for\n", ""]
+
+    resolved = resolve_sources(pdfs, urls, videos, texts)
+
+    assert [pdf["filename"] for pdf in resolved["pdfs"]] == ["a.pdf"]
+    assert resolved["urls"] == ["https://example.com/article", 42]
+    assert resolved["videos"] == ["https://www.youtube.com/watch?v=dQw4w9WgXcQ", "not a video"]
+    assert resolved["text"] == ["Loops:  for", ""]
+    assert resolved["ids"][:3] == ["pdf:" + "1" * 64, "url:https://example.com/article", "video:dQw4w9WgXcQ"]
+    assert resolved["duplicates"] == [
+        "copy.pdf", "https://www.example.com/article#comments",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=30", "Loops: for"
+    ]
+    assert resolved["unresolved"] == [42, "not a video", ""]
+
+
+def test_duplicate_inputs_are_processed_once(client, fake_client):
+    response = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Sets: unordered", " Sets:  unordered "]})})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["sources"]) == 1
+    assert body["notes"] == ["Ignored duplicate source: Sets: unordered"]
+    assert len(fake_client.calls) == 2  # one topic extraction and one guide
+
+    # Differently written but identical requests share the cached work (pasted
+    # text keeps its inner whitespace, which can be code indentation)
+    fake_client.calls.clear()
+    response = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Sets: unordered  \n\n"]})})
+    assert response.status_code == 200
+    assert fake_client.calls == []
@@ -0,0 +1,176 @@
+"""
+Tests for the per-request source document store, plus a benchmark of the
+peak memory of a request relative to the size of its sources.
+
+Run directly for the full benchmark (a few hundred MB of sources):
+    python tests/test_source_store.py
+"""
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import textNormalization
+from app.services.sourceIdentity import text_label, text_source_id
+from app.services.sourceStore import SourceStore
+from app.services.textNormalization import estimate_tokens
+from app.utils.helpers import canonical_hash, text_digest
+from app.utils.memory import MemoryBudget, memory_scope, text_bytes
+from fake_gemini import FakeGeminiClient, FakeResponse
+
+MB = 1024 * 1024
+
+
+def test_documents_are_held_once():
+    texts = ["first source", "second source text", "third"]
+    store = SourceStore()
+    documents = [store.add(f"text:{i}", "text", f"t{i}", text) for i, text in enumerate(texts)]
+
+    assert [document.text for document in store] == texts
+    assert all(document.text is text for document, text in zip(documents, texts))
+
+    store.set_text(documents[0], "1st")
+    store.remove(documents[1])
+    assert [document.text for document in store] == ["1st", "third"]
+    assert store.total_chars() == len("1st") + len("third")
+
+
+def test_store_accounts_texts_to_the_budget():
+    budget = MemoryBudget(limit_bytes=100_000)
+    with memory_scope(budget):
+        store = SourceStore()
+        whole = store.add("text:a", "text", "a", "a" * 1000)
+        cut = store.add("text:b", "text", "b", "b" * 200_000)
+    assert len(whole.text) == 1000
+    assert 0 < len(cut.text) < 200_000
+    assert budget.used == text_bytes(whole.text) + text_bytes(cut.text)
+
+    store.set_text(cut, "short")
+    assert budget.used == text_bytes(whole.text) + text_bytes("short")
+    assert store.add("text:c", "text", "c", "") is None
+
+    digest = whole.digest
+    store.discard_texts()
+    assert budget.used == 0
+    assert [document.id for document in store] == ["text:a", "text:b"]
+    assert digest == text_digest("a" * 1000)
+
+
+def test_streamed_hashes_and_counts_match_the_whole_text_versions():
+    text = " \n".join(f"Word{i}\t  «quoted» \"{i}\" \\ end" for i in range(200_000))
+    assert text_source_id(text) == f"text:{canonical_hash(' '.join(text.split()))[:32]}"
+    assert text_label(text) == " ".join(text.split())[:60]
+    assert text_digest([text[:10], text[10:]]) == text_digest(text)
+    assert estimate_tokens(text) == len(textNormalization._TOKEN_PIECE.findall(text))
+
+
+# ---------------------------------------------------------------------------
+# Peak memory benchmark
+# ---------------------------------------------------------------------------
+
+class TinyTopicsClient(FakeGeminiClient):
+    """Answers topic extraction with one topic, without keeping prompts."""
+
+    def respond(self, model, prompt):
+        if "TEXT TO ANALYZE:" in prompt:
+            return FakeResponse(json.dumps({f"Source of {len(prompt)} characters": "Its content"}))
+        return super().respond(model, prompt)
+
+
+def make_pdf_text(megabytes, seed):
+    """Generate text shaped like extract_pdf_text output: page banners, running headers, page numbers."""
+    body = "".join(
+        f"Paragraph {i} of document {seed} explains an idea about data struc-\ntures in some detail.\n\n"
+        for i in range(30)
+    )
+    pages = []
+    size, number = 0, 1
+    while size < megabytes * MB:
+        page = f"\n{'=' * 60}\nPage {number}\n{'=' * 60}\n\nCourse Reader\n{body}\n{number}\n"
+        pages.append(page)
+        size += len(page)
+        number += 1
+    return "".join(pages)
+
+
+def measure_request(megabytes, tmp_dir):
+    """
+    Run the extraction and generation pipeline on two PDFs and one text input
+    totalling about megabytes MB, in this process.
+
+    Returns:
+        dict: Source size and the peak RSS growth during the request, in bytes
+    """
+    from pathlib import Path
+    from app.api import routes
+    from app.config import get_settings
+    from app.services import gemini, guideStore
+    from app.utils import shared_state
+
+    gemini._create_client = TinyTopicsClient()
+    gemini._min_delay_between_calls = 0
+    get_settings().gemini_api_key = "test-key"
+    guideStore.GUIDE_DIR = Path(tmp_dir)
+    shared_state._backend = shared_state.MemoryStateBackend()
+    routes._extraction_flights.cache_ttl = None
+
+    pdf_megabytes = megabytes * 2 // 5
+
+    def extract(path):
+        return make_pdf_text(pdf_megabytes, path)
+
+    routes.extract_pdf_text = extract
+    pdfs = [{"path": f"doc{i}", "filename": f"doc{i}.pdf", "sha256": f"{i:064x}"} for i in range(2)]
+    text = make_pdf_text(megabytes - 2 * pdf_megabytes, "text").replace("Page", "Part")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    started = time.perf_counter()
+    with memory_scope(MemoryBudget()):
+        asyncio.run(routes.generate_study_guide("bench", pdfs, [], [], [text], None, ""))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        "source_bytes": len(text) + 2 * pdf_megabytes * MB,
+        "peak_growth_bytes": max(0, peak - rss_before),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def run_benchmark(megabytes, tmp_dir):
+    """Measure one request in a fresh interpreter, so the peak RSS is its own."""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", str(megabytes), str(tmp_dir)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="ru_maxrss is in kilobytes on Linux only")
+def test_benchmark_peak_memory_stays_close_to_source_size(tmp_path):
+    result = run_benchmark(24, tmp_path)
+    ratio = result["peak_growth_bytes"] / result["source_bytes"]
+    assert ratio < 4, f"Peak memory grew by {ratio:.1f}x the size of the sources"
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    if sys.argv[1:2] == ["--measure"]:
+        import logging
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(measure_request(int(sys.argv[2]), sys.argv[3])))
+        sys.exit(0)
+
+    print(f"{'sources MB':>11} {'peak growth MB':>15} {'ratio':>6} {'seconds':>8}")
+    for megabytes in (50, 100, 300):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = run_benchmark(megabytes, tmp_dir)
+        source, growth = result["source_bytes"] / MB, result["peak_growth_bytes"] / MB
+        print(f"{source:>11.0f} {growth:>15.0f} {growth / source:>6.2f} {result['seconds']:>8.1f}")
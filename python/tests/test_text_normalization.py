@@ -0,0 +1,87 @@
+"""
+Tests for the token-minimizing text normalizer.
+"""
+import os
+import sys
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.textNormalization import normalize_text, page_for_offset, estimate_tokens
+
+
+def _pdf_text(pages):
+    """Build text in the format produced by extract_pdf_text."""
+    return "".join(
+        f"\n{'=' * 60}\nPage {number}\n{'=' * 60}\n\n{text}\n"
+        for number, text in enumerate(pages, 1)
+    )
+
+
+PAGES = [
+    f"CPSC 110 — Lecture Notes, Fall 2024\n\n{body}\n\nUniversity of Example    Page {n} of 4\n{n}\n"
+    for n, body in enumerate([
+        "Recursion solves a problem by reducing it to smaller instances of the same prob-\nlem.",
+        "A base case stops the recursion.\n\n\n\n   Every   recursive call must make progress.",
+        "Tail calls can be optimized by some compilers.\n--------------",
+        "Memoization caches results of earlier calls.",
+    ], 1)
+]
+
+
+def test_pdf_boilerplate_is_removed():
+    result = normalize_text(_pdf_text(PAGES), kind="pdf")
+    text = result["text"]
+
+    assert "=" * 10 not in text and "Page 1" not in text
+    assert "Lecture Notes" not in text
+    assert "University of Example" not in text
+    assert "same problem." in text
+    assert "Every recursive call must make progress." in text
+    assert "-----" not in text
+    assert "\n\n\n" not in text
+    assert result["tokens_after"] < result["tokens_before"] * 0.6
+
+
+def test_page_map_points_back_to_pages():
+    result = normalize_text(_pdf_text(PAGES), kind="pdf")
+    text = result["text"]
+    assert [entry["page"] for entry in result["page_map"]] == [1, 2, 3, 4]
+    for entry in result["page_map"]:
+        assert text[entry["start"]:entry["end"]].strip() == text[entry["start"]:entry["end"]]
+    assert page_for_offset(result["page_map"], text.index("Memoization")) == 4
+    assert page_for_offset(result["page_map"], text.index("base case")) == 2
+
+
+def test_short_documents_keep_their_lines():
+    # Too few pages to tell running headers from content
+    result = normalize_text(_pdf_text(["Intro\nContent one", "Intro\nContent two"]), kind="pdf")
+    assert result["text"] == "Intro\nContent one\n\nIntro\nContent two"
+
+
+def test_transcript_and_text_normalization():
+    transcript = normalize_text("[Music] so today  we talk\nabout graphs [Applause]", kind="video")
+    assert transcript["text"] == "so today we talk\nabout graphs"
+    assert normalize_text("  Loops:   for\n\n\n\nSets: {}  ", kind="url")["text"] == "Loops: for\n\nSets: {}"
+    assert normalize_text("Loops: for  \n\n\n\nSets: {}\n", kind="text")["text"] == "Loops: for\n\nSets: {}"
+    assert normalize_text("", kind="text") == {"text": "", "page_map": [], "tokens_before": 0, "tokens_after": 0}
+    assert estimate_tokens("=" * 60) == 15
+
+
+def test_pasted_code_keeps_its_indentation_and_lines():
+    code = (
+        "Callbacks:\n"
+        "app.get('/', (req, res) => {\n"
+        "    if (req.user) {\n"
+        "        res.send(total -\n"
+        "            fee);\n"
+        "    }\n"
+        "});\n"
+        "/* ---\n"
+        " * Notes\n"
+        " */   \n"
+    )
+    result = normalize_text(code, kind="text")
+    assert result["text"] == code.replace("   \n", "").rstrip("\n")
+    # The same lines from a web page are treated as layout output
+    assert "});" not in normalize_text(code, kind="url")["text"]
@@ -0,0 +1,54 @@
+"""
+Tests for upload spooling.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.datastructures import UploadFile
+from app.services import uploadIngestion
+from app.services.uploadIngestion import spool_uploads, remove_spool, UploadLimitError
+
+
+def _upload(name, data):
+    return UploadFile(file=io.BytesIO(data), filename=name)
+
+
+def test_spool_hashes_and_drops_duplicates():
+    a, b = b"%PDF-a" * 1000, b"%PDF-b" * 10
+    spool_dir, files = asyncio.run(spool_uploads([_upload("a.pdf", a), _upload("b.pdf", b), _upload("a2.pdf", a)], "test"))
+    try:
+        assert [f["filename"] for f in files] == ["a.pdf", "b.pdf"]
+        assert files[0]["sha256"] == hashlib.sha256(a).hexdigest()
+        assert open(files[0]["path"], "rb").read() == a
+        assert files[1]["size"] == len(b)
+    finally:
+        remove_spool(spool_dir)
+    assert not os.path.exists(spool_dir)
+
+
+def test_limits_are_enforced_while_streaming():
+    with pytest.raises(UploadLimitError):
+        asyncio.run(spool_uploads([_upload("big.pdf", b"x" * 5000)], "test", max_file_bytes=4096))
+    with pytest.raises(UploadLimitError):
+        asyncio.run(spool_uploads([_upload("a.pdf", b"a" * 3000), _upload("b.pdf", b"b" * 3000)], "test",
+                                  max_file_bytes=4096, max_request_bytes=5000))
+
+
+def test_spool_directory_is_only_created_for_uploads(monkeypatch, tmp_path):
+    monkeypatch.setattr(uploadIngestion, "UPLOAD_DIR", tmp_path / "uploads")
+    assert asyncio.run(spool_uploads([], "test")) == (None, [])
+    assert not (tmp_path / "uploads").exists()
+    remove_spool(None)
+
+    spool_dir, files = asyncio.run(spool_uploads([_upload("a.pdf", b"%PDF-a")], "test"))
+    assert spool_dir.parent == tmp_path / "uploads"
+    assert len(files) == 1
+    remove_spool(spool_dir)
@@ -0,0 +1,203 @@
+"""
+Tests for per-tenant usage accounting and budgets.
+"""
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api import routes
+from app.config import get_settings
+from app.services import gemini, usageLedger
+from app.services.usageLedger import BudgetExceededError, UsageLedger, tenant_budget
+from app.utils import metrics
+from app.utils.usage import Usage, usage_scope
+from fake_gemini import FakeAPIError, FakeGeminiClient
+
+ADMIN = {"X-Admin-Token": "secret"}
+TENANT = "client:testclient"
+SOURCES = json.dumps({"text": [
+    "Loops: for and while loops repeat work\nSets: unordered collections of unique items",
+    "Maps: key to value lookups",
+]})
+DAY = 86400
+
+
+@pytest.fixture
+def ledger(monkeypatch, tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.db")
+    monkeypatch.setattr(usageLedger, "_ledger", ledger)
+    monkeypatch.setattr(get_settings(), "usage_ledger", True)
+    return ledger
+
+
+@pytest.fixture
+def client(monkeypatch, client, ledger):
+    monkeypatch.setattr(get_settings(), "admin_token", "secret")
+    return client
+
+
+def test_admission_counts_requests_against_the_budget(tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.db", window_seconds=DAY)
+    budget = {"requests": 2, "tokens": 0}
+    now = 10 * DAY + 3600
+    ledger.admit("client:a", budget, now=now)
+    ledger.admit("client:a", budget, now=now)
+    with pytest.raises(BudgetExceededError) as error:
+        ledger.admit("client:a", budget, now=now)
+    assert error.value.retry_after == DAY - 3600
+    # Other tenants and the next window are not affected
+    ledger.admit("client:b", budget, now=now)
+    ledger.admit("client:a", budget, now=11 * DAY)
+
+    report = {entry["tenant"]: entry for entry in ledger.report(now=now)}
+    assert (report["client:a"]["requests"], report["client:a"]["rejected"]) == (2, 1)
+    assert report["client:b"]["requests"] == 1
+
+
+def test_recorded_usage_is_added_up_per_tenant(tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.db")
+    for calls in (1, 2):
+        usage = Usage("client:a")
+        for attempt in range(calls):
+            usage.add_call(0.5, input_tokens=100, output_tokens=10, retry=attempt > 0)
+        usage.add_stages({"extract": {"seconds": 0.25}, "topics": {"seconds": 1.0}})
+        ledger.record(usage)
+
+    [entry] = ledger.report("client:a")
+    assert (entry["calls"], entry["retries"], entry["input_tokens"], entry["output_tokens"]) == (3, 1, 300, 30)
+    assert entry["tokens"] == 330
+    assert entry["gemini_seconds"] == 1.5
+    assert entry["stage_seconds"] == {"extract": 0.5, "topics": 2.0}
+
+    budget = {"requests": 0, "tokens": 400}
+    ledger.check_tokens("client:a", budget, 70)
+    with pytest.raises(BudgetExceededError):
+        ledger.check_tokens("client:a", budget, 71)
+    with pytest.raises(BudgetExceededError):
+        ledger.admit("client:a", {"requests": 0, "tokens": 330})
+
+
+def test_budgets_apply_to_the_shared_key(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "usage_request_budget", 10)
+    monkeypatch.setattr(settings, "usage_token_budget", 0)
+    monkeypatch.setattr(settings, "usage_budgets", {"client:10.0.0.7": {"tokens": 500}, "key:abc": {"requests": 3}})
+    assert tenant_budget("client:10.0.0.1", shared_key=True) == {"requests": 10, "tokens": 0}
+    assert tenant_budget("client:10.0.0.7", shared_key=True) == {"requests": 0, "tokens": 500}
+    assert tenant_budget("key:def", shared_key=False) is None
+    assert tenant_budget("key:abc", shared_key=False) == {"requests": 3, "tokens": 0}
+    monkeypatch.setattr(settings, "usage_request_budget", 0)
+    assert tenant_budget("client:10.0.0.1", shared_key=True) is None
+
+
+def test_gemini_calls_are_accounted(fake_client, monkeypatch):
+    class Metered(FakeGeminiClient):
+        def respond(self, model, prompt):
+            response = super().respond(model, prompt)
+            response.usage_metadata = SimpleNamespace(prompt_token_count=1234, candidates_token_count=56)
+            return response
+
+    monkeypatch.setattr(gemini, "_create_client", Metered())
+    usage = Usage(TENANT)
+    with usage_scope(usage):
+        gemini.extract_unique_topics_with_text("Loops: for and while loops", api_key="user-key")
+    assert (usage.calls, usage.retries, usage.input_tokens, usage.output_tokens) == (1, 0, 1234, 56)
+
+
+def test_requests_are_recorded_in_the_ledger(client, fake_client, ledger):
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 200
+
+    [entry] = ledger.report()
+    assert entry["tenant"] == TENANT
+    # Topics of both sources in one call, then the guide
+    assert (entry["requests"], entry["calls"], entry["retries"]) == (1, 2, 0)
+    prompt_chars = sum(len(call["prompt"]) for call in fake_client.calls)
+    assert entry["input_tokens"] == pytest.approx(prompt_chars / 4, abs=3)
+    assert entry["output_tokens"] > 0
+    assert {"extract", "normalize", "topics", "guide"} <= set(entry["stage_seconds"])
+
+    usage = client.get("/api/admin/usage", headers=ADMIN).json()
+    assert usage["window_seconds"] == DAY
+    assert usage["tenants"][0]["tenant"] == TENANT
+    assert usage["tenants"][0]["budget"] is None
+    assert client.get("/api/admin/usage").status_code == 403
+
+
+def test_retries_are_recorded(client, monkeypatch, ledger):
+    class Flaky(FakeGeminiClient):
+        def respond(self, model, prompt):
+            if not self.calls:
+                self.calls.append({"model": model, "prompt": prompt})
+                raise FakeAPIError(500, "INTERNAL")
+            return super().respond(model, prompt)
+
+    monkeypatch.setattr(gemini, "_create_client", Flaky())
+    assert client.post("/api/get-output", data={"sources": json.dumps({"text": ["Loops: repeat"]})}).status_code == 200
+    [entry] = ledger.report()
+    assert (entry["calls"], entry["retries"]) == (3, 1)
+
+
+def test_request_budget_of_the_shared_key(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "usage_request_budget", 1)
+    assert client.post("/api/get-output", data={"sources": SOURCES}).status_code == 200
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    # Requests made with the user's own key are not limited
+    own_key = client.post("/api/get-output", data={"sources": SOURCES, "api_key": "user-key"})
+    assert own_key.status_code == 200
+
+
+def test_token_budget_is_checked_before_gemini_calls(client, fake_client, monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(get_settings(), "usage_token_budget", 10)
+    response = client.post("/api/get-output", data={"sources": SOURCES})
+    assert response.status_code == 429
+    assert fake_client.calls == []
+    assert metrics.get_counter("usage_budget_rejections_total", stage="generation") == 1
+
+    # A budget that fits one request's tokens lets it through and refuses the next
+    monkeypatch.setattr(get_settings(), "usage_token_budget", 200)
+    assert client.post("/api/get-output", data={"sources": SOURCES}).status_code == 200
+    response = client.post("/api/get-output", data={"sources": json.dumps({"text": ["Graphs: nodes and edges"]})})
+    assert response.status_code == 429
+    assert metrics.get_counter("usage_budget_rejections_total", stage="admission") == 1
+
+
+def test_usage_accounting_is_off_by_default(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "usage_ledger", False)
+    assert usageLedger.get_usage_ledger() is None
+    assert client.post("/api/get-output", data={"sources": SOURCES}).status_code == 200
+    assert client.get("/api/admin/usage", headers=ADMIN).status_code == 404
+
+
+def test_coalesced_requests_are_each_charged_for_the_shared_run(client, monkeypatch, ledger):
+    slow = FakeGeminiClient(latency=0.3)
+    monkeypatch.setattr(gemini, "_create_client", slow)
+    # Tell the tenants apart by a header, as the test client has one address
+    monkeypatch.setattr(routes, "_tenant", lambda request, key_hash: f"client:{request.headers['x-user']}")
+
+    def post(user):
+        return shared.post("/api/get-output", data={"sources": SOURCES}, headers={"X-User": user}).status_code
+
+    # One event loop for both requests, so they can share a pipeline run
+    with TestClient(app) as shared:
+        with ThreadPoolExecutor(2) as pool:
+            assert list(pool.map(post, ["alice", "bob"])) == [200, 200]
+    # One run served both requests
+    assert len(slow.calls) == 2
+
+    report = {entry["tenant"]: entry for entry in ledger.report()}
+    alice, bob = report["client:alice"], report["client:bob"]
+    assert alice["calls"] == bob["calls"] == 2
+    assert alice["tokens"] == bob["tokens"] > 0
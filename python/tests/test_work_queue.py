@@ -0,0 +1,355 @@
+"""
+Tests for the work queue backends, the extraction worker and extraction
+through the queue from an API request.
+"""
+import asyncio
+import bisect
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to sys.path so 'app' can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app import worker
+from app.main import app
+from app.config import get_settings
+from app.services import extractionQueue
+from app.utils import work_queue
+from app.utils.work_queue import CANCELLED, DONE, FAILED, LEASED, QUEUED, RedisWorkQueue, SQLiteWorkQueue
+
+
+class FakeRedis:
+    """Minimal local stand-in for the redis-py calls used by RedisWorkQueue."""
+
+    def __init__(self):
+        self.data = {}
+        self.zsets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self.data.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.time():
+                return None
+            return value.encode("utf-8") if value is not None else None
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            self.data[key] = (value, time.time() + px / 1000 if px else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self.data.pop(key, None)
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            self.zsets.setdefault(name, {}).update(mapping)
+
+    def zrem(self, name, *values):
+        with self._lock:
+            zset = self.zsets.get(name, {})
+            return sum(zset.pop(value, None) is not None for value in values)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self.zsets.get(name, {}))
+
+    def zrangebyscore(self, name, low, high, start=None, num=None):
+        low, high = float(low), float(high)
+        with self._lock:
+            items = sorted((score, member) for member, score in self.zsets.get(name, {}).items())
+        members = [member.encode("utf-8") for score, member in items[bisect.bisect_left(items, (low, "")):]
+                   if score <= high]
+        return members[start:start + num] if num is not None else members
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteWorkQueue(tmp_path / "queue.db", retry_delay=0.05)
+    return RedisWorkQueue(FakeRedis(), retry_delay=0.05)
+
+
+def test_submit_claim_complete(queue):
+    task_id = queue.submit("pdf", {"target": "a.pdf"})
+    assert queue.status(task_id)["state"] == QUEUED
+
+    task = queue.claim()
+    assert (task.id, task.kind, task.payload, task.attempts) == (task_id, "pdf", {"target": "a.pdf"}, 1)
+    assert queue.status(task_id)["state"] == LEASED
+    assert queue.claim() is None
+
+    assert queue.complete(task, "text") is True
+    assert queue.status(task_id) == {"state": DONE, "attempts": 1, "result": "text", "error": None}
+    queue.forget(task_id)
+    assert queue.status(task_id) is None
+
+
+def test_claim_filters_kinds(queue):
+    queue.submit("pdf", {})
+    video_id = queue.submit("video", {})
+    assert queue.claim(kinds=["url", "video"]).id == video_id
+    assert queue.claim(kinds=["url"]) is None
+
+
+def test_expired_lease_is_claimed_again(queue):
+    task_id = queue.submit("url", {}, max_attempts=2)
+    first = queue.claim(visibility_timeout=0.05)
+    time.sleep(0.1)
+    second = queue.claim(visibility_timeout=10)
+    assert second.id == task_id and second.attempts == 2
+    # The first worker lost its lease
+    assert queue.heartbeat(first, 10) is False
+    assert queue.heartbeat(second, 10) is True
+
+
+def test_lost_last_attempt_fails_the_task(queue):
+    task_id = queue.submit("url", {}, max_attempts=1)
+    queue.claim(visibility_timeout=0.05)
+    time.sleep(0.1)
+    assert queue.claim() is None
+    status = queue.status(task_id)
+    assert status["state"] == FAILED
+    assert status["error"]["type"] == "WorkerLost"
+
+
+def test_failed_attempts_are_retried_with_backoff(queue):
+    task_id = queue.submit("url", {}, max_attempts=2)
+    task = queue.claim()
+    assert queue.fail(task, {"type": "ValueError", "message": "boom"}) is True
+    assert queue.claim() is None  # Still backing off
+    time.sleep(0.1)
+    task = queue.claim()
+    assert task.attempts == 2
+    assert queue.fail(task, {"type": "ValueError", "message": "boom again"}) is False
+    status = queue.status(task_id)
+    assert (status["state"], status["error"]["message"]) == (FAILED, "boom again")
+
+
+def test_cancelled_tasks_are_not_run(queue):
+    queued = queue.submit("pdf", {})
+    leased = queue.submit("pdf", {})
+    queue.cancel(queued)
+    task = queue.claim()
+    assert task.id == leased
+    queue.cancel(leased)
+    assert queue.heartbeat(task, 10) is False
+    assert queue.status(queued)["state"] == CANCELLED
+    assert queue.claim() is None
+
+
+def test_each_task_is_claimed_once(queue):
+    task_ids = {queue.submit("pdf", {"n": i}) for i in range(60)}
+    claimed = []
+
+    def claimer():
+        while True:
+            task = queue.claim()
+            if task is None:
+                return
+            claimed.append(task.id)
+            queue.complete(task, task.payload["n"])
+
+    threads = [threading.Thread(target=claimer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(task_ids)
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+def test_worker_acknowledges_results_and_errors(queue, monkeypatch):
+    def extract(target):
+        if target == "bad":
+            raise ValueError("not a document")
+        return target.upper()
+
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "test", extract)
+    good = queue.submit("test", {"target": "good"})
+    bad = queue.submit("test", {"target": "bad"}, max_attempts=2)
+    expired = queue.submit("test", {"target": "good", "deadline": time.time() - 1})
+
+    counts = worker.work(queue, until_idle=True)
+    time.sleep(0.1)
+    counts.update({k: counts.get(k, 0) + v for k, v in worker.work(queue, until_idle=True).items()})
+
+    assert counts == {DONE: 1, worker.RETRY: 1, FAILED: 2}
+    assert queue.status(good)["result"] == "GOOD"
+    assert queue.status(bad)["error"] == {"type": "ValueError", "message": "not a document"}
+    assert queue.status(bad)["attempts"] == 2
+    # A task whose request is out of time is not retried
+    assert queue.status(expired)["error"]["type"] == "DeadlineExceeded"
+    assert queue.status(expired)["attempts"] == 1
+
+
+def test_worker_stops_cancelled_task(queue, monkeypatch):
+    from app.utils.deadline import check_deadline
+
+    started = threading.Event()
+
+    def extract(target):
+        started.set()
+        for _ in range(500):
+            check_deadline("a page")
+            time.sleep(0.01)
+        return "finished"
+
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "test", extract)
+    task_id = queue.submit("test", {"target": "x"})
+    task = queue.claim(visibility_timeout=0.3)
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(worker.run_task(queue, task, 0.3)))
+    thread.start()
+    started.wait(5)
+    queue.cancel(task_id)
+    thread.join(5)
+    assert outcome == [CANCELLED]
+
+
+def _work_in_child(path):
+    queue = SQLiteWorkQueue(path)
+    worker.work(queue, until_idle=True)
+
+
+def _extract_pid(target):
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _hang_in_child(target, parent_pid=os.getpid()):
+    if os.getpid() != parent_pid:
+        time.sleep(60)
+    return "recovered"
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="relies on fork to share the test extractors")
+def test_worker_processes_share_the_queue(tmp_path, monkeypatch):
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "pid", _extract_pid)
+    queue = SQLiteWorkQueue(tmp_path / "queue.db")
+    task_ids = [queue.submit("pid", {"target": i}) for i in range(12)]
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_work_in_child, args=(tmp_path / "queue.db",)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+
+    pids = [queue.status(task_id)["result"] for task_id in task_ids]
+    assert all(pid in {process.pid for process in processes} for pid in pids)
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="relies on fork to share the test extractors")
+def test_task_of_a_killed_worker_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "hang", _hang_in_child)
+    monkeypatch.setattr(get_settings(), "work_queue_visibility_seconds", 0.5)
+    queue = SQLiteWorkQueue(tmp_path / "queue.db")
+    task_id = queue.submit("hang", {"target": "x"})
+
+    process = multiprocessing.get_context("fork").Process(target=_work_in_child, args=(tmp_path / "queue.db",))
+    process.start()
+    while queue.status(task_id)["state"] != LEASED:
+        time.sleep(0.01)
+    process.kill()
+    process.join()
+
+    time.sleep(0.6)
+    assert worker.work(queue, until_idle=True) == {DONE: 1}
+    assert queue.status(task_id)["result"] == "recovered"
+    assert queue.status(task_id)["attempts"] == 2
+
+
+# ---------------------------------------------------------------------------
+# Requests
+# ---------------------------------------------------------------------------
+
+def test_waiting_for_a_task_keeps_queue_calls_off_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(get_settings(), "work_queue_poll_seconds", 0.01)
+    queue = SQLiteWorkQueue(tmp_path / "queue.db")
+    monkeypatch.setattr(work_queue, "_queue", queue)
+    threads = {}
+    for name in ("submit", "status", "forget", "cancel"):
+        def recorded(*args, _call=getattr(queue, name), _name=name, **kwargs):
+            threads.setdefault(_name, set()).add(threading.get_ident())
+            return _call(*args, **kwargs)
+        monkeypatch.setattr(queue, name, recorded)
+
+    def extract(url):
+        if "slow" in url:
+            time.sleep(0.5)
+        return {"title": "Loops", "text": "Loops: for and while loops repeat work"}
+
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "url", extract)
+
+    async def run():
+        loop_thread = threading.get_ident()
+        article = await extractionQueue.extract_on_worker("url", "https://example.com/loops")
+        abandoned = asyncio.ensure_future(extractionQueue.extract_on_worker("url", "https://example.com/slow"))
+        await asyncio.sleep(0.1)
+        abandoned.cancel()
+        await asyncio.gather(abandoned, return_exceptions=True)
+        return loop_thread, article
+
+    stop = threading.Event()
+    runner = threading.Thread(target=worker.work, args=(queue,), kwargs={"stop": stop, "idle_seconds": 0.01})
+    runner.start()
+    try:
+        loop_thread, article = asyncio.run(run())
+    finally:
+        stop.set()
+        runner.join()
+
+    assert article["title"] == "Loops"
+    assert set(threads) == {"submit", "status", "forget", "cancel"}
+    assert all(loop_thread not in idents for idents in threads.values())
+
+
+def test_request_extracts_through_the_queue(monkeypatch, tmp_path, fake_client):
+    monkeypatch.setattr(get_settings(), "extraction_queue", "sqlite")
+    monkeypatch.setattr(get_settings(), "work_queue_poll_seconds", 0.01)
+    queue = SQLiteWorkQueue(tmp_path / "queue.db", retry_delay=0.01)
+    monkeypatch.setattr(work_queue, "_queue", queue)
+
+    threads = []
+
+    def extract(url):
+        threads.append(threading.current_thread().name)
+        if "missing" in url:
+            raise ValueError("404 Not Found")
+        return {"title": "Loops", "text": "Loops: for and while loops repeat work"}
+
+    monkeypatch.setitem(extractionQueue.EXTRACTORS, "url", extract)
+    stop = threading.Event()
+    runner = threading.Thread(target=worker.work, args=(queue,), kwargs={"stop": stop, "idle_seconds": 0.01},
+                              name="extraction-worker")
+    runner.start()
+    try:
+        client = TestClient(app)
+        sources = json.dumps({"urls": ["https://example.com/loops", "https://example.com/missing"]})
+        response = client.post("/api/get-output", data={"sources": sources})
+        stats = client.get("/api/metrics").json()["work_queue"]
+    finally:
+        stop.set()
+        runner.join()
+
+    assert response.status_code == 200
+    body = response.json()
+    assert "Loops" in body["study_guide"]
+    assert [source["label"] for source in body["sources"]] == ["https://example.com/loops"]
+    assert body["notes"] == []
+    assert set(threads) == {"extraction-worker"}
+    assert len(threads) == 1 + get_settings().work_queue_max_attempts
+    # Finished tasks are removed once the request has their outcome
+    assert stats[QUEUED] == stats[LEASED] == stats[DONE] == 0